@@ -4,80 +4,24 @@ from handlers.message_handler import handle_message
 from collections import defaultdict
 import re
 from message_store import messages_store
-from database import db
+from database import db, to_epoch_ms, iter_ndjson
 from flask_socketio import emit
-from datetime import datetime
+from datetime import datetime, timezone
+import os
 import json
+import base64
 import logging
 import requests
-from session_store import get_session, set_session
+from session_store import (update_session, get_sessions_dados, get_global_queue as get_queued_phones,
+                           get_transfer_states, get_agent_conversations, prune_queue_index,
+                           claim_next, claim_conversation, release_conversation, queue_priority)
+from webhook_dispatcher import WEBHOOK_ASYNC, save_incoming, enqueue_message
+from realtime import publish_message, publish_conversation, publish_reset, get_seq, get_epoch
 
 logger = logging.getLogger(__name__)
 
 api_bp = Blueprint("api", __name__)
 
-# Global variable to store socketio instance
-socketio = None
-
-def init_socketio(sio):
-    global socketio
-    socketio = sio
-
-# Variável global para controlar debounce
-_last_emit_time = 0
-
-def emit_message_update():
-    """Função auxiliar para emitir atualização de mensagens via WebSocket"""
-    global _last_emit_time
-    
-    if not socketio:
-        return
-    
-    # Debounce para evitar múltiplas emissões em sequência
-    import time
-    current_time = time.time()
-    if current_time - _last_emit_time < 1.0:  # 1 segundo de debounce
-        logger.info("⏸️ Debounce: ignorando emissão muito rápida")
-        return
-    _last_emit_time = current_time
-        
-    try:
-        # Get updated conversations
-        all_messages = db.get_messages(limit=1000)
-        conversations = {}
-        
-        for msg in all_messages:
-            phone_num = msg['phone_number']
-            if phone_num not in conversations:
-                conversations[phone_num] = {
-                    'phone': phone_num,
-                    'messages': [],
-                    'last_message': '',
-                    'last_timestamp': None
-                }
-            
-            conversations[phone_num]['messages'].append({
-                'id': msg['id'],
-                'from': msg['from'],
-                'text': msg['message_text'],
-                'timestamp': msg['timestamp'],
-                'direction': msg['direction']
-            })
-            
-            if not conversations[phone_num]['last_timestamp'] or msg['timestamp'] > conversations[phone_num]['last_timestamp']:
-                conversations[phone_num]['last_message'] = msg['message_text']
-                conversations[phone_num]['last_timestamp'] = msg['timestamp']
-        
-        conversations_list = list(conversations.values())
-        conversations_list.sort(key=lambda x: x['last_timestamp'] or '', reverse=True)
-        
-        logger.info(f"📊 Conversas agrupadas: {len(conversations_list)} conversas")
-        socketio.emit('message_update', {'conversations': conversations_list})
-        logger.info("✅ Evento 'message_update' emitido via WebSocket")
-        
-    except Exception as e:
-        logger.error(f"❌ Erro ao emitir WebSocket: {e}")
-
 # Função para formatar número de telefone
 def format_phone_number(phone):
     """Formata o número de telefone para exibição"""
@@ -146,119 +90,142 @@ def webhook():
     print(f"🔔 Mensagem recebida de {from_number}: {incoming_msg}")
 
     # PRIMEIRO: Salvar mensagem do usuário imediatamente e emitir WebSocket
-    db.save_message(from_number, incoming_msg, "received", "user")
-    
-    # Emitir WebSocket imediatamente para mostrar a mensagem do usuário
-    logger.info("🔔 Emitindo mensagem do usuário via WebSocket...")
-    emit_message_update()
-    logger.info("✅ Mensagem do usuário emitida via WebSocket")
+    save_incoming(from_number, incoming_msg)
 
-    # SEGUNDO: Processar resposta do bot (pode demorar)
-    reply_text = handle_message(from_number, incoming_msg) or "Desculpe, não entendi."
-    print(f"💬 Resposta gerada: {reply_text}")
+    # Modo assíncrono: responde 202 e a resposta do bot segue pelo Venom Bot
+    if WEBHOOK_ASYNC:
+        enqueue_message(from_number, incoming_msg)
+        return jsonify({"status": "queued"}), 202
 
-    # TERCEIRO: Salvar resposta do bot e emitir WebSocket novamente
-    if reply_text:
-        db.save_message(from_number, reply_text, "sent", "agent")
-        
-        # Emitir WebSocket novamente para mostrar a resposta do bot
-        logger.info("🔔 Emitindo resposta do bot via WebSocket...")
-        emit_message_update()
-        logger.info("✅ Resposta do bot emitida via WebSocket")
+    # SEGUNDO: Processar resposta do bot na fila ordenada da conversa (pode demorar)
+    reply_text = enqueue_message(from_number, incoming_msg, deliver=False).result()
+    print(f"💬 Resposta gerada: {reply_text}")
 
     return jsonify({"result": reply_text, "status": "ok"}), 200
 
+# Paginação por cursor (keyset): o cursor é opaco para o painel e carrega a
+# chave de ordenação do último item da página anterior.
+DEFAULT_CONVERSATIONS_PAGE = 100
+DEFAULT_MESSAGES_PAGE = 50
+MAX_PAGE_SIZE = 500
+DEFAULT_QUEUE_PAGE = MAX_PAGE_SIZE
+
+def encode_cursor(*key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor):
+    """Decodifica o cursor recebido; retorna None se ausente e levanta ValueError se inválido"""
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("cursor inválido")
+    if not isinstance(key, list) or len(key) != 2:
+        raise ValueError("cursor inválido")
+    return tuple(key)
+
+def get_page_size(default):
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def summary_to_conversation(summary):
+    """Converte uma linha de conversation_summary no formato de conversa do painel"""
+    phone = summary['phone_number']
+    return {
+        'id': phone,
+        'phone': phone,
+        'last_message': summary['last_message'] or '',
+        'last_timestamp': summary['last_timestamp'],
+        'last_ts': summary['last_ts'],
+        'last_direction': summary['last_direction'],
+        'message_count': summary['message_count'],
+        'received_count': summary['received_count'],
+        'sent_count': summary['sent_count'],
+        'transferido_humano': False,
+        'atribuido_para': None,
+        'dados_transferencia': None
+    }
+
+def apply_transfer_data(conversations):
+    """Preenche transferido_humano/atribuido_para/dados_transferencia a partir dos índices da fila"""
+    states = get_transfer_states([conv['phone'] for conv in conversations])
+    # Leitura parcial: só dados.dados_transferencia de cada sessão transferida
+    sessions = get_sessions_dados(list(states), ['dados_transferencia'])
+    if sessions is None:
+        # Leitura falhou: o índice vale como está, sem podar nem os dados da transferência
+        sessions = {phone: {'dados_transferencia': None} for phone in states}
+    else:
+        prune_queue_index([phone for phone in states if phone not in sessions])
+    for conv in conversations:
+        dados = sessions.get(conv['phone'])
+        if dados is None:
+            continue
+        conv['transferido_humano'] = True
+        conv['atribuido_para'] = states[conv['phone']]
+        conv['dados_transferencia'] = dados['dados_transferencia']
+    logger.info(f"📋 Conversas transferidas para humano nesta página: {len(sessions)}")
+
 @api_bp.route("/messages", methods=["GET"])
 @cross_origin()
 def get_messages():
-    """Get all messages grouped by phone number"""
+    """
+    Get one summary per conversation, most recent first, paginated by cursor
+    (messages are loaded per phone via /messages/<phone>).
+    """
+    limit = get_page_size(DEFAULT_CONVERSATIONS_PAGE)
     try:
-        # Get all messages from database
-        all_messages = db.get_messages(limit=1000)
-        
-        # Group messages by phone number
-        conversations = {}
-        for msg in all_messages:
-            phone = msg['phone_number']
-            if phone not in conversations:
-                conversations[phone] = {
-                    'phone': phone,
-                    'messages': [],
-                    'last_message': '',
-                    'last_timestamp': None,
-                    'transferido_humano': False,  # Default value
-                    'dados_transferencia': None
-                }
-            
-            # Add message to conversation
-            conversations[phone]['messages'].append({
-                'id': msg['id'],
-                'from': msg['from'],
-                'text': msg['message_text'],
-                'timestamp': msg['timestamp'],
-                'direction': msg['direction']
-            })
-            
-            # Update last message info
-            if not conversations[phone]['last_timestamp'] or msg['timestamp'] > conversations[phone]['last_timestamp']:
-                conversations[phone]['last_message'] = msg['message_text']
-                conversations[phone]['last_timestamp'] = msg['timestamp']
-        
-        # Check for transfer data in session store
-        for phone in conversations:
-            session_data = get_session(phone)
-            logger.info(f"📋 Verificando sessão para {phone}: {session_data}")
-            
-            # Garantir que os campos sempre existam
-            conversations[phone]['transferido_humano'] = False  # Default
-            conversations[phone]['atribuido_para'] = None  # Default
-            conversations[phone]['dados_transferencia'] = None  # Default
-            
-            if session_data and session_data.get('dados', {}).get('transferido_humano'):
-                conversations[phone]['transferido_humano'] = True
-                conversations[phone]['dados_transferencia'] = session_data.get('dados', {}).get('dados_transferencia')
-                conversations[phone]['atribuido_para'] = session_data.get('dados', {}).get('atribuido_para')
-                logger.info(f"✅ Conversa {phone} transferida para humano: {conversations[phone]['transferido_humano']}, atribuída para: {conversations[phone]['atribuido_para']}")
-            else:
-                logger.info(f"📝 Conversa {phone} permanece no bot (não transferida)")
+        before = decode_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        summaries = db.get_conversation_summaries(limit=limit, before=before)
+        conversations = [summary_to_conversation(s) for s in summaries]
+        
+        # Transfer state comes from the queue index (one HMGET); only the
+        # transferred conversations need their session, fetched in one MGET
+        apply_transfer_data(conversations)
         
         # Adicionar campos obrigatórios para cada conversa
-        for conv in conversations.values():
-            conv['id'] = conv['phone']  # Garantir que id existe
+        for conv in conversations:
             conv['name'] = extract_name_from_phone(conv['phone']) or f"Paciente {conv['phone']}"
             conv['avatar'] = generate_avatar(conv['phone'])
             conv['formattedPhone'] = format_phone_number(conv['phone'])
             conv['originalName'] = extract_name_from_phone(conv['phone'])
-            
-            # Garantir que os campos de transferência sempre existam
-            if 'transferido_humano' not in conv:
-                conv['transferido_humano'] = False
-            if 'atribuido_para' not in conv:
-                conv['atribuido_para'] = None
-            if 'dados_transferencia' not in conv:
-                conv['dados_transferencia'] = None
-        
-        # Ordenar as mensagens de cada conversa do mais antigo para o mais novo
-        for conv in conversations.values():
-            conv['messages'].sort(key=lambda m: m['timestamp'])
+            conv['seq'] = get_seq(conv['phone'])  # Base para aplicar os eventos incrementais
         
-        # Convert to list and sort by last timestamp
-        conversations_list = list(conversations.values())
-        conversations_list.sort(key=lambda x: x['last_timestamp'] or '', reverse=True)
-        
-        logger.info(f"📊 Conversas agrupadas: {len(conversations_list)} conversas")
-        return jsonify(conversations_list)
+        # Já vem ordenado por last_timestamp (mais recente primeiro)
+        logger.info(f"📊 Conversas carregadas: {len(conversations)} conversas")
+        next_cursor = None
+        if len(summaries) == limit:
+            last = summaries[-1]
+            next_cursor = encode_cursor(last['last_ts'], last['phone_number'])
+        return jsonify({'conversations': conversations, 'next_cursor': next_cursor, 'epoch': get_epoch()})
         
     except Exception as e:
         logger.error(f"❌ Error getting messages: {e}")
-        return jsonify([]), 500
+        return jsonify({'conversations': [], 'next_cursor': None}), 500
 
 @api_bp.route("/messages/<phone>", methods=["GET"])
 @cross_origin()
 def get_messages_by_phone(phone):
-    """Get messages for a specific phone number"""
+    """
+    Get the latest messages for a specific phone number, oldest first.
+    Pass next_cursor back as ?cursor= to load the page before it.
+    """
+    limit = get_page_size(DEFAULT_MESSAGES_PAGE)
+    try:
+        before = decode_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
-        messages = db.get_messages_by_phone(phone, limit=100)
+        messages = db.get_messages_by_phone(phone, limit=limit, before=before,
+                                            columns=('from_field', 'message_text', 'timestamp', 'direction'))
         
         # Format messages for frontend
         formatted_messages = []
@@ -268,14 +235,60 @@ def get_messages_by_phone(phone):
                 'from': msg['from'],
                 'text': msg['message_text'],
                 'timestamp': msg['timestamp'],
+                'ts': msg['ts'],
                 'direction': msg['direction']
             })
         
-        return jsonify(formatted_messages)
+        next_cursor = None
+        if len(messages) == limit:
+            oldest = messages[0]
+            next_cursor = encode_cursor(oldest['ts'], oldest['id'])
+        return jsonify({'messages': formatted_messages, 'next_cursor': next_cursor})
         
     except Exception as e:
         logger.error(f"❌ Error getting messages for {phone}: {e}")
-        return jsonify([]), 500
+        return jsonify({'messages': [], 'next_cursor': None}), 500
+
+def parse_time_param(name):
+    """Lê um parâmetro de data (epoch ms ou ISO 8601); levanta ValueError se inválido"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    ts = int(value) if value.isdigit() else to_epoch_ms(value)
+    if ts is None:
+        raise ValueError(f"'{name}' inválido: use epoch ms ou ISO 8601")
+    return ts
+
+@api_bp.route("/search", methods=["GET"])
+@cross_origin()
+def search_messages():
+    """
+    Full-text search over message history, best matches first.
+    Query params: q (required), phone, from/to (epoch ms or ISO 8601, 'to' exclusive),
+    limit and offset; pass next_offset back as ?offset= for the next page.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': "'q' is required"}), 400
+    if not db.fts_enabled:
+        return jsonify({'error': 'Full-text search is not available'}), 503
+
+    limit = get_page_size(DEFAULT_MESSAGES_PAGE)
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        start_ts = parse_time_param('from')
+        end_ts = parse_time_param('to')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    results = db.search_messages(query, phone_number=request.args.get('phone') or None,
+                                 start_ts=start_ts, end_ts=end_ts, limit=limit, offset=offset)
+    for result in results:
+        result['formattedPhone'] = format_phone_number(result['phone_number'])
+    return jsonify({
+        'results': results,
+        'next_offset': offset + limit if len(results) == limit else None
+    })
 
 @api_bp.route("/send-message", methods=["POST"])
 @cross_origin()
@@ -309,9 +322,8 @@ def send_message():
         
         # Se chegou até aqui, a mensagem foi enviada com sucesso
         # Agora salva no banco de dados
-        from datetime import datetime
-        timestamp = datetime.now().isoformat()
-        success = db.save_message(
+        timestamp = datetime.now(timezone.utc).isoformat()
+        message_id = db.save_message(
             phone_number=phone,
             message_text=message,
             direction='sent',
@@ -319,10 +331,10 @@ def send_message():
             timestamp=timestamp
         )
         
-        if success:
+        if message_id:
             # Emit WebSocket update
             logger.info("🔔 Emitindo atualização de mensagens via WebSocket...")
-            emit_message_update()
+            publish_message(phone, message_id, message, 'sent', 'agent', timestamp)
             
             return jsonify({'success': True, 'message': 'Message sent successfully'})
         else:
@@ -357,7 +369,7 @@ def clear_messages():
         success = db.clear_messages()
         if success:
             # Emit WebSocket update
-            emit_message_update()
+            publish_reset()
             
             return jsonify({'success': True, 'message': 'All messages cleared'})
         else:
@@ -367,23 +379,49 @@ def clear_messages():
         logger.error(f"❌ Error clearing messages: {e}")
         return jsonify({'error': str(e)}), 500
 
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+# Diretório de onde /api/migrate-messages pode ler arquivos (desativado se vazio)
+IMPORT_DIR = os.getenv("IMPORT_DIR", "")
+
+def resolve_import_path(path):
+    """Caminho absoluto do arquivo se estiver dentro de IMPORT_DIR, senão None"""
+    if not IMPORT_DIR:
+        return None
+    base = os.path.realpath(IMPORT_DIR)
+    full = os.path.realpath(os.path.join(base, path))
+    if os.path.commonpath([base, full]) != base or not os.path.isfile(full):
+        return None
+    return full
+
 @api_bp.route("/migrate-messages", methods=["POST"])
 @cross_origin()
 def migrate_messages():
-    """Migrate old messages from Redis or other format"""
+    """
+    Import old messages without buffering them in memory. Accepts:
+    - an NDJSON body (Content-Type: application/x-ndjson), one message per line, streamed;
+    - JSON {"path": "<file>.ndjson[.gz]"} for a file inside IMPORT_DIR;
+    - JSON {"messages": [...]} (legacy format).
+    Duplicates are skipped, so the same import can be re-run safely.
+    """
     try:
-        data = request.get_json()
-        old_messages = data.get('messages', [])
-        
-        success = db.migrate_old_messages(old_messages)
+        if request.mimetype in NDJSON_MIMETYPES:
+            stats = db.import_messages(iter_ndjson(request.stream))
+        else:
+            data = request.get_json() or {}
+            if data.get('path'):
+                path = resolve_import_path(data['path'])
+                if not path:
+                    return jsonify({'error': 'path must be a file inside IMPORT_DIR'}), 400
+                stats = db.import_messages_file(path)
+            else:
+                stats = db.import_messages(data.get('messages', []))
         
-        if success:
+        if stats['inserted']:
             # Emit WebSocket update after migration
-            emit_message_update()
-            
-            return jsonify({'success': True, 'message': f'Migrated {len(old_messages)} messages'})
-        else:
-            return jsonify({'error': 'Failed to migrate messages'}), 500
+            publish_reset()
+        
+        return jsonify({'success': True, 'message': f"Migrated {stats['inserted']} messages", 'stats': stats})
             
     except Exception as e:
         logger.error(f"❌ Error migrating messages: {e}")
@@ -400,58 +438,41 @@ def test_bot():
     resposta = handle_message(numero, mensagem)
     return jsonify({'resposta': resposta})
 
+def mirror_assignment(phone, user_id, priority=None):
+    """Espelha na sessão a atribuição já feita na fila (só os campos de dados alterados)"""
+    def assign(session_data):
+        session_data.setdefault('dados', {})
+        session_data['dados']['transferido_humano'] = True
+        session_data['dados']['atribuido_para'] = user_id
+        if priority is not None:
+            session_data['dados']['prioridade'] = priority
+    
+    session_data = update_session(phone, assign, create=False)
+    if session_data is None and user_id:
+        # Sem a sessão a atribuição ficaria só no índice: devolve a conversa à fila
+        release_conversation(phone, user_id)
+    return session_data
+
 @api_bp.route('/global-queue', methods=['GET'])
 @cross_origin()
 def get_global_queue():
-    """Get conversations transferred by bot (not yet assigned to human)"""
+    """
+    Get conversations transferred by bot (not yet assigned to human), in the
+    order /claim-next hands them out: highest priority first, then oldest.
+    """
     try:
-        # Get all messages from database
-        all_messages = db.get_messages(limit=1000)
-        
-        # Group messages by phone number
-        conversations = {}
-        for msg in all_messages:
-            phone = msg['phone_number']
-            if phone not in conversations:
-                conversations[phone] = {
-                    'id': phone,
-                    'phone': phone,
-                    'messages': [],
-                    'last_message': '',
-                    'last_timestamp': None,
-                    'transferido_humano': False,
-                    'atribuido_para': None,
-                    'dados_transferencia': None
-                }
-            
-            # Add message to conversation
-            conversations[phone]['messages'].append({
-                'id': msg['id'],
-                'from': msg['from'],
-                'text': msg['message_text'],
-                'timestamp': msg['timestamp'],
-                'direction': msg['direction']
-            })
-            
-            # Update last message info
-            if not conversations[phone]['last_timestamp'] or msg['timestamp'] > conversations[phone]['last_timestamp']:
-                conversations[phone]['last_message'] = msg['message_text']
-                conversations[phone]['last_timestamp'] = msg['timestamp']
-        
-        # Check for transfer data in session store
+        # The queue only holds transferred, unassigned conversations, already ordered
+        queue = get_queued_phones(limit=get_page_size(DEFAULT_QUEUE_PAGE))
+        summaries = db.get_conversation_summaries_for([phone for phone, _, _ in queue])
         global_queue = []
-        for phone in conversations:
-            session_data = get_session(phone)
-            if session_data and session_data.get('dados', {}).get('transferido_humano'):
-                conversations[phone]['transferido_humano'] = True
-                conversations[phone]['dados_transferencia'] = session_data.get('dados', {}).get('dados_transferencia')
-                
-                # Only add to global queue if not assigned to any user
-                if not conversations[phone].get('atribuido_para'):
-                    global_queue.append(conversations[phone])
-        
-        # Sort by timestamp (oldest first for queue)
-        global_queue.sort(key=lambda x: x['last_timestamp'] or '', reverse=False)
+        for phone, priority, enqueued_at in queue:
+            if phone in summaries:
+                conv = summary_to_conversation(summaries[phone])
+                conv['prioridade'] = priority
+                conv['enfileirado_em'] = enqueued_at
+                global_queue.append(conv)
+        apply_transfer_data(global_queue)
+        global_queue = [conv for conv in global_queue if conv['transferido_humano']]
         
         logger.info(f"🌍 Global queue: {len(global_queue)} conversations")
         return jsonify(global_queue)
@@ -460,6 +481,79 @@ def get_global_queue():
         logger.error(f"❌ Error getting global queue: {e}")
         return jsonify([]), 500
 
+@api_bp.route('/agents/<user_id>/conversations', methods=['GET'])
+@cross_origin()
+def get_agent_queue(user_id):
+    """Get transferred conversations assigned to one user, most recent first"""
+    try:
+        phones = get_agent_conversations(user_id)
+        summaries = db.get_conversation_summaries_for(phones)
+        conversations = [summary_to_conversation(summaries[phone]) for phone in phones if phone in summaries]
+        apply_transfer_data(conversations)
+        conversations = [conv for conv in conversations if conv['atribuido_para'] == str(user_id)]
+        conversations.sort(key=lambda x: x['last_ts'] or 0, reverse=True)
+        
+        logger.info(f"👤 Conversations assigned to {user_id}: {len(conversations)}")
+        return jsonify(conversations)
+        
+    except Exception as e:
+        logger.error(f"❌ Error getting conversations for user {user_id}: {e}")
+        return jsonify([]), 500
+
+@api_bp.route('/claim-next', methods=['POST'])
+@cross_origin()
+def claim_next_conversation():
+    """Atomically take the head of the global queue for a user"""
+    try:
+        data = request.get_json() or {}
+        user_id = data.get('userId')
+        
+        if not user_id:
+            return jsonify({'error': 'userId is required'}), 400
+        
+        phone = claim_next(user_id)
+        if not phone:
+            return jsonify({'conversation': None})
+        
+        if not mirror_assignment(phone, user_id):
+            return jsonify({'error': 'Session was modified concurrently, try again'}), 409
+        publish_conversation(phone, {'transferido_humano': True, 'atribuido_para': user_id})
+        
+        summaries = db.get_conversation_summaries_for([phone])
+        conversation = summary_to_conversation(summaries[phone]) if phone in summaries else {'id': phone, 'phone': phone}
+        conversation.update(transferido_humano=True, atribuido_para=user_id)
+        
+        logger.info(f"✅ Conversation {phone} claimed by user {user_id}")
+        return jsonify({'conversation': conversation})
+        
+    except Exception as e:
+        logger.error(f"❌ Error claiming conversation: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/requeue-conversation', methods=['POST'])
+@cross_origin()
+def requeue_conversation():
+    """Put a conversation back at the end of the global queue with a new priority"""
+    try:
+        data = request.get_json() or {}
+        phone = data.get('phone') or data.get('conversationId')
+        
+        if not phone:
+            return jsonify({'error': 'phone is required'}), 400
+        
+        priority = queue_priority(data.get('priority'))
+        release_conversation(phone, priority=priority)
+        if not mirror_assignment(phone, None, priority=priority):
+            return jsonify({'error': 'Session was modified concurrently, try again'}), 409
+        publish_conversation(phone, {'transferido_humano': True, 'atribuido_para': None})
+        
+        logger.info(f"✅ Conversation {phone} requeued with priority {priority}")
+        return jsonify({'success': True, 'prioridade': priority})
+        
+    except Exception as e:
+        logger.error(f"❌ Error requeuing conversation: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @api_bp.route('/assign-conversation', methods=['POST'])
 @cross_origin()
 def assign_conversation():
@@ -474,25 +568,23 @@ def assign_conversation():
         
         logger.info(f"📋 Assigning conversation {conversation_id} to user {user_id}")
         
-        # Get session data for this conversation
-        session_data = get_session(conversation_id)
+        # Claim first, atomically: a conversation already taken by another user is refused
+        owner = claim_conversation(conversation_id, user_id)
+        if owner:
+            logger.warning(f"⚠️ Conversation {conversation_id} already assigned to user {owner}")
+            return jsonify({'error': f'Conversation already assigned to {owner}', 'atribuido_para': owner}), 409
+        
+        # Only the changed dados fields are written, guarded by the session version
+        session_data = mirror_assignment(conversation_id, user_id)
         
         if session_data:
-            # Update session to assign the conversation to the user
-            if 'dados' not in session_data:
-                session_data['dados'] = {}
-            
-            session_data['dados']['transferido_humano'] = True
-            session_data['dados']['atribuido_para'] = user_id
-            
-            # Save updated session
-            set_session(conversation_id, session_data)
+            publish_conversation(conversation_id, {'transferido_humano': True, 'atribuido_para': user_id})
             
             logger.info(f"✅ Conversation {conversation_id} assigned to user {user_id}")
             return jsonify({'success': True, 'message': 'Conversation assigned successfully'})
         else:
-            logger.warning(f"⚠️ No session found for conversation {conversation_id}")
-            return jsonify({'error': 'No session found for this conversation'}), 404
+            logger.warning(f"⚠️ Could not update session for conversation {conversation_id}")
+            return jsonify({'error': 'Session was modified concurrently, try again'}), 409
         
     except Exception as e:
         logger.error(f"❌ Error assigning conversation: {e}")
@@ -515,25 +607,22 @@ def transfer_conversation():
         # Get the phone number from the conversation ID (assuming it's the phone)
         phone = conversation_id
         
-        # Get session data for this conversation
-        session_data = get_session(phone)
+        # Mark as transferred to human and assigned to the current user
+        owner = claim_conversation(phone, user_id) if user_id else None
+        if owner:
+            logger.warning(f"⚠️ Conversation {conversation_id} already assigned to user {owner}")
+            return jsonify({'error': f'Conversation already assigned to {owner}', 'atribuido_para': owner}), 409
+        
+        session_data = mirror_assignment(phone, user_id)
         
         if session_data:
-            # Update session to mark as transferred to human and assigned to user
-            if 'dados' not in session_data:
-                session_data['dados'] = {}
-            
-            session_data['dados']['transferido_humano'] = True
-            session_data['dados']['atribuido_para'] = user_id  # Assign to current user
-            
-            # Save updated session
-            set_session(phone, session_data)
+            publish_conversation(phone, {'transferido_humano': True, 'atribuido_para': user_id})
             
             logger.info(f"✅ Conversation {conversation_id} transferred to human queue and assigned to user {user_id}")
             return jsonify({'success': True, 'message': 'Conversation transferred successfully'})
         else:
-            logger.warning(f"⚠️ No session found for conversation {conversation_id}")
-            return jsonify({'error': 'No session found for this conversation'}), 404
+            logger.warning(f"⚠️ Could not update session for conversation {conversation_id}")
+            return jsonify({'error': 'Session was modified concurrently, try again'}), 409
         
     except Exception as e:
         logger.error(f"❌ Error transferring conversation: {e}")
@@ -553,25 +642,18 @@ def return_to_global_queue():
         
         logger.info(f"🔄 Returning conversation {conversation_id} to global queue")
         
-        # Get session data for this conversation
-        session_data = get_session(phone)
+        # Still transferred to human, back in its original place in the queue
+        release_conversation(phone)
+        session_data = mirror_assignment(phone, None)
         
         if session_data:
-            # Update session to mark as transferred to human but not assigned
-            if 'dados' not in session_data:
-                session_data['dados'] = {}
-            
-            session_data['dados']['transferido_humano'] = True
-            session_data['dados']['atribuido_para'] = None  # Remove assignment
-            
-            # Save updated session
-            set_session(phone, session_data)
+            publish_conversation(phone, {'transferido_humano': True, 'atribuido_para': None})
             
             logger.info(f"✅ Conversation {conversation_id} returned to global queue")
             return jsonify({'success': True, 'message': 'Conversation returned to global queue successfully'})
         else:
-            logger.warning(f"⚠️ No session found for conversation {conversation_id}")
-            return jsonify({'error': 'No session found for this conversation'}), 404
+            logger.warning(f"⚠️ Could not update session for conversation {conversation_id}")
+            return jsonify({'error': 'Session was modified concurrently, try again'}), 409
         
     except Exception as e:
         logger.error(f"❌ Error returning conversation to global queue: {e}")
@@ -591,25 +673,30 @@ def add_to_global_queue():
         
         logger.info(f"🔄 Adding conversation {conversation_id} to global queue")
         
-        # Get session data for this conversation
-        session_data = get_session(phone)
+        priority = data.get('priority')
+        transfer = {}
         
-        if session_data:
-            # Update session to mark as transferred to human but not assigned
-            if 'dados' not in session_data:
-                session_data['dados'] = {}
-            
+        def enqueue(session_data):
+            # Transferred to human but not assigned to anyone
+            session_data.setdefault('dados', {})
+            transfer['new'] = not session_data['dados'].get('transferido_humano')
             session_data['dados']['transferido_humano'] = True
-            session_data['dados']['atribuido_para'] = None  # Not assigned to anyone
-            
-            # Save updated session
-            set_session(phone, session_data)
+            session_data['dados']['atribuido_para'] = None
+            if priority is not None:
+                session_data['dados']['prioridade'] = queue_priority(priority)
+        
+        session_data = update_session(phone, enqueue)
+        
+        if session_data:
+            if transfer['new']:
+                db.record_transfer(phone)
+            publish_conversation(phone, {'transferido_humano': True, 'atribuido_para': None})
             
             logger.info(f"✅ Conversation {conversation_id} added to global queue")
             return jsonify({'success': True, 'message': 'Conversation added to global queue successfully'})
         else:
-            logger.warning(f"⚠️ No session found for conversation {conversation_id}")
-            return jsonify({'error': 'No session found for this conversation'}), 404
+            logger.warning(f"⚠️ Could not update session for conversation {conversation_id}")
+            return jsonify({'error': 'Session was modified concurrently, try again'}), 409
         
     except Exception as e:
         logger.error(f"❌ Error adding conversation to global queue: {e}")
@@ -1,27 +1,44 @@
-from flask import Blueprint, jsonify, request
-from session_store import get_all_sessions
-from database import db
-from datetime import datetime, timedelta
+from flask import Blueprint, Response, jsonify, request
+from session_store import count_active_sessions, get_session_cache_stats, get_human_queue_stats
+from webhook_dispatcher import get_queue_stats
+from realtime import get_broadcaster_stats
+from retention import get_retention_stats
+from session_codec import get_codec_stats
+from database import db, EXPORT_DATASETS
+from api.routes import parse_time_param
+from datetime import datetime
+import csv
+import io
 import json
+import zlib
 
 stats_bp = Blueprint('stats', __name__)
 
+# Exportação em streaming: linhas por bloco enviado ao cliente
+EXPORT_CHUNK_ROWS = 500
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
 @stats_bp.route("/sessions", methods=["GET"])
 def get_stats():
-    agora = datetime.utcnow()
-    limite = agora - timedelta(hours=8)
-
-    total_usuarios = 0
-
-    for user_id, session_data in get_all_sessions().items():
-        if isinstance(session_data, dict):
-            historico = session_data.get("historico", [])
-            # Conta usuários que têm histórico de mensagens (considerados ativos)
-            if historico and len(historico) > 0:
-                total_usuarios += 1
+    # Usuários com sessão gravada nas últimas 8h: um ZCOUNT no registro, sem varrer o Redis
+    total_usuarios = count_active_sessions(since_seconds=8 * 60 * 60)
 
     return jsonify({"usuarios_ativos_ultimas_8h": total_usuarios})
 
+@stats_bp.route("/queue-stats", methods=["GET"])
+def queue_stats():
+    """Profundidade e tempos de espera da fila de mensagens, do broadcaster, do cache, do writer, do arquivamento, do codec/cache de sessões e da fila humana"""
+    return jsonify({
+        **get_queue_stats(),
+        'broadcaster': get_broadcaster_stats(),
+        'message_cache': db.recent.stats(),
+        'message_writer': db.writer.stats(),
+        'retention': get_retention_stats(),
+        'session_codec': get_codec_stats(),
+        'session_cache': get_session_cache_stats(),
+        'human_queue': get_human_queue_stats()
+    })
+
 @stats_bp.route("/reports", methods=["GET"])
 def get_reports():
     """Get comprehensive reporting data"""
@@ -111,6 +128,74 @@ def export_reports():
             'error': str(e)
         }), 500
 
+@stats_bp.route("/reports/export/<dataset>", methods=["GET"])
+def stream_export(dataset):
+    """
+    Exportação em streaming de messages, conversations, rollups_hourly ou rollups_daily.
+    Query params: format (csv|ndjson), from/to (epoch ms ou ISO 8601, 'to' exclusivo),
+    phone e gzip=1. As linhas saem em blocos direto do cursor: memória constante e o
+    primeiro byte sai imediatamente, qualquer que seja o período.
+    """
+    format_type = request.args.get('format', 'csv')
+    if dataset not in EXPORT_DATASETS:
+        return jsonify({'success': False, 'error': f"Dataset inválido; use {', '.join(EXPORT_DATASETS)}"}), 400
+    if format_type not in EXPORT_MIMETYPES:
+        return jsonify({'success': False, 'error': 'Unsupported format'}), 400
+    try:
+        start_ts = parse_time_param('from')
+        end_ts = parse_time_param('to')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    columns = EXPORT_DATASETS[dataset]
+    rows = db.export_rows(dataset, start_ts, end_ts, request.args.get('phone'))
+    chunks = encode_csv(columns, rows) if format_type == 'csv' else encode_ndjson(columns, rows)
+    if compress:
+        chunks = gzip_chunks(chunks)
+
+    filename = f'{dataset}_{datetime.now().strftime("%Y%m%d")}.{format_type}' + ('.gz' if compress else '')
+    return Response(
+        chunks,
+        mimetype='application/gzip' if compress else EXPORT_MIMETYPES[format_type],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+def encode_csv(columns, rows):
+    """Cabeçalho e linhas em CSV, EXPORT_CHUNK_ROWS linhas por bloco"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def encode_ndjson(columns, rows):
+    """Um objeto JSON por linha, EXPORT_CHUNK_ROWS linhas por bloco"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+def gzip_chunks(chunks):
+    """Comprime os blocos em um único stream gzip, sem acumular a saída"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
 def generate_csv_export(report_data):
     """Generate CSV content from report data"""
     lines = []
@@ -4,16 +4,18 @@ from dotenv import load_dotenv
 import os
 from flask_socketio import SocketIO, emit
 import logging
-from datetime import datetime, timezone
+from datetime import datetime
 import json
 import time
 
-from api.routes import api_bp, init_socketio
+from api.routes import api_bp
 from api.stats_routes import stats_bp
 from session_store import redis_client
 from message_store import messages_store
 from database import db
-from handlers.message_handler import handle_message
+from realtime import init_socketio
+from retention import start_retention
+from webhook_dispatcher import WEBHOOK_ASYNC, save_incoming, enqueue_message
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -56,6 +58,7 @@ socketio = SocketIO(
     logger=True,
     engineio_logger=True
 )
+init_socketio(socketio)
 
 # Blueprints
 app.register_blueprint(api_bp, url_prefix="/api")
@@ -88,39 +91,15 @@ def webhook():
         logger.info(f"🔔 Mensagem recebida de {from_number}: {incoming_msg}")
 
         # PRIMEIRO: Salvar mensagem do usuário imediatamente e emitir WebSocket
-        user_timestamp = datetime.now(timezone.utc).isoformat()
-        db.save_message(
-            phone_number=from_number,
-            message_text=incoming_msg,
-            direction='received',
-            from_field='user',
-            timestamp=user_timestamp
-        )
-        
-        # Emitir WebSocket imediatamente para mostrar a mensagem do usuário
-        logger.info("🔔 Emitindo mensagem do usuário via WebSocket...")
-        emit_message_update()
-        logger.info("✅ Mensagem do usuário emitida via WebSocket")
-
-        # SEGUNDO: Processar resposta do bot (pode demorar)
-        reply_text = handle_message(from_number, incoming_msg) or "Desculpe, não entendi."
-        logger.info(f"💬 Resposta gerada: {reply_text}")
-
-        # TERCEIRO: Salvar resposta do bot e emitir WebSocket novamente
-        if reply_text:
-            bot_timestamp = datetime.now(timezone.utc).isoformat()
-            db.save_message(
-                phone_number=from_number,
-                message_text=reply_text,
-                direction='sent',
-                from_field='agent',
-                timestamp=bot_timestamp
-            )
-            
-            # Emitir WebSocket novamente para mostrar a resposta do bot
-            logger.info("🔔 Emitindo resposta do bot via WebSocket...")
-            emit_message_update()
-            logger.info("✅ Resposta do bot emitida via WebSocket")
+        save_incoming(from_number, incoming_msg)
+
+        # Modo assíncrono: responde 202 e a resposta do bot segue pelo Venom Bot
+        if WEBHOOK_ASYNC:
+            enqueue_message(from_number, incoming_msg)
+            return jsonify({"status": "queued"}), 202
+
+        # SEGUNDO: Processar resposta do bot na fila ordenada da conversa (pode demorar)
+        reply_text = enqueue_message(from_number, incoming_msg, deliver=False).result()
 
         return jsonify({"result": reply_text, "status": "ok"}), 200
         
@@ -148,54 +127,6 @@ def handle_join_conversation(data):
             'message': f'Usuário entrou na conversa {conversation_id}'
         })
 
-# Função para emitir atualizações de mensagens
-def emit_message_update():
-    """Emit message update to all connected clients"""
-    try:
-        # Get all messages from database
-        all_messages = db.get_messages(limit=1000)
-        
-        # Group messages by phone number
-        conversations = {}
-        for msg in all_messages:
-            phone = msg['phone_number']
-            if phone not in conversations:
-                conversations[phone] = {
-                    'phone': phone,
-                    'messages': [],
-                    'last_message': '',
-                    'last_timestamp': None
-                }
-            
-            # Add message to conversation
-            conversations[phone]['messages'].append({
-                'id': msg['id'],
-                'from': msg['from'],
-                'text': msg['message_text'],
-                'timestamp': msg['timestamp'],
-                'direction': msg['direction']
-            })
-            
-            # Update last message info
-            if not conversations[phone]['last_timestamp'] or msg['timestamp'] > conversations[phone]['last_timestamp']:
-                conversations[phone]['last_message'] = msg['message_text']
-                conversations[phone]['last_timestamp'] = msg['timestamp']
-        
-        # Ordenar as mensagens de cada conversa do mais antigo para o mais novo
-        for conv in conversations.values():
-            conv['messages'].sort(key=lambda m: m['timestamp'])
-        
-        # Convert to list and sort by last timestamp
-        conversations_list = list(conversations.values())
-        conversations_list.sort(key=lambda x: x['last_timestamp'] or '', reverse=True)
-        
-        logger.info(f"📊 Conversas agrupadas: {len(conversations_list)} conversas")
-        socketio.emit('message_update', {'conversations': conversations_list})
-        logger.info("✅ Evento 'message_update' emitido via WebSocket")
-        
-    except Exception as e:
-        logger.error(f"❌ Error emitting message update: {e}")
-
 # Função para emitir atualizações de estatísticas
 def emit_stats_update(stats_data):
     """Emite atualização de estatísticas para todos os clientes conectados"""
@@ -217,5 +148,8 @@ if __name__ == "__main__":
         messages_store.clear()
         print("✅ Migração concluída")
     
+    # Arquivamento em background das conversas inativas (opt-in via ARCHIVE_AFTER_DAYS)
+    start_retention()
+    
     # Iniciar servidor com SocketIO
     socketio.run(app, host="0.0.0.0", port=port, debug=True, allow_unsafe_werkzeug=True)
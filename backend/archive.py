@@ -0,0 +1,195 @@
+import os
+import glob
+import json
+import logging
+import sqlite3
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Nível de compressão zlib do conteúdo das mensagens arquivadas
+ARCHIVE_COMPRESS_LEVEL = int(os.getenv("ARCHIVE_COMPRESS_LEVEL", 6))
+
+# Campos guardados comprimidos no payload; os demais ficam em colunas para índice e rollups
+PAYLOAD_FIELDS = ('message_text', 'from_field', 'timestamp', 'session_data', 'created_at')
+
+def archive_month(ts: int) -> str:
+    """Mês (UTC) do arquivo onde a mensagem é guardada, no formato YYYY-MM."""
+    return datetime.fromtimestamp(ts / 1000, timezone.utc).strftime('%Y-%m')
+
+def month_start_ms(month: str) -> int:
+    return int(datetime.strptime(month, '%Y-%m').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def _decode(row: tuple, columns: Sequence[str]) -> tuple:
+    """(id, phone_number, direction, ts, payload) arquivado → valores na ordem de 'columns'."""
+    message_id, phone_number, direction, ts, payload = row
+    values = dict(zip(PAYLOAD_FIELDS, json.loads(zlib.decompress(payload))))
+    values.update(id=message_id, phone_number=phone_number, direction=direction, ts=ts)
+    return tuple(values.get(name) for name in columns)
+
+class MessageArchive:
+    """
+    Arquivos SQLite mensais (messages_YYYY-MM.db) com as mensagens antigas.
+
+    Telefone, direção e ts ficam em colunas indexadas; texto, remetente, timestamp
+    e sessão vão comprimidos com zlib em um único blob. Os ids da tabela quente são
+    preservados, então o cursor (ts, id) continua válido ao atravessar do banco
+    principal para o arquivo. As conexões são abertas por operação: o arquivo é frio.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, month: str) -> str:
+        return os.path.join(self.directory, f"messages_{month}.db")
+
+    def months(self) -> List[str]:
+        """Meses arquivados, do mais antigo ao mais recente."""
+        files = glob.glob(os.path.join(self.directory, "messages_????-??.db"))
+        return sorted(os.path.basename(f)[len("messages_"):-len(".db")] for f in files)
+
+    def _connect(self, month: str, create: bool = False) -> Optional[sqlite3.Connection]:
+        path = self.path(month)
+        if not create and not os.path.exists(path):
+            return None
+        if create:
+            os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(path)
+        if create:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    phone_number TEXT NOT NULL,
+                    direction TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    text_hash TEXT,
+                    payload BLOB NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_phone_ts ON messages(phone_number, ts, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_ts ON messages(ts)')
+        return conn
+
+    def store(self, rows: Sequence[Dict]) -> Dict[str, int]:
+        """
+        Grava as mensagens nos arquivos dos seus meses, uma transação por mês.
+        É idempotente (INSERT OR IGNORE pelo id): repetir um lote interrompido é seguro.
+        Retorna quantas mensagens foram de fato gravadas em cada mês (as já presentes não contam).
+        """
+        by_month: Dict[str, List[tuple]] = {}
+        for row in rows:
+            payload = zlib.compress(json.dumps([row.get(f) for f in PAYLOAD_FIELDS]).encode('utf-8'),
+                                    ARCHIVE_COMPRESS_LEVEL)
+            by_month.setdefault(archive_month(row['ts']), []).append(
+                (row['id'], row['phone_number'], row['direction'], row['ts'], row.get('text_hash'), payload))
+
+        stored: Dict[str, int] = {}
+        for month, month_rows in by_month.items():
+            conn = self._connect(month, create=True)
+            try:
+                with conn:
+                    changes = conn.total_changes
+                    conn.executemany('''
+                        INSERT OR IGNORE INTO messages (id, phone_number, direction, ts, text_hash, payload)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', month_rows)
+                    stored[month] = conn.total_changes - changes
+            finally:
+                conn.close()
+        return stored
+
+    def get_messages_by_phone(self, phone_number: str, months: Sequence[str], limit: int,
+                              before: Optional[Tuple[int, int]], columns: Sequence[str]) -> List[tuple]:
+        """
+        Mensagens arquivadas do telefone anteriores ao cursor (ts, id), da mais recente
+        para a mais antiga, com os valores na ordem de 'columns'. Só abre os meses indicados.
+        """
+        results: List[tuple] = []
+        for month in sorted(months, reverse=True):
+            if len(results) >= limit:
+                break
+            if before and month_start_ms(month) > before[0]:
+                continue
+            conn = self._connect(month)
+            if conn is None:
+                continue
+            try:
+                if before:
+                    cursor = conn.execute('''
+                        SELECT id, phone_number, direction, ts, payload FROM messages
+                        WHERE phone_number = ? AND (ts, id) < (?, ?)
+                        ORDER BY ts DESC, id DESC LIMIT ?
+                    ''', (phone_number, before[0], before[1], limit - len(results)))
+                else:
+                    cursor = conn.execute('''
+                        SELECT id, phone_number, direction, ts, payload FROM messages
+                        WHERE phone_number = ?
+                        ORDER BY ts DESC, id DESC LIMIT ?
+                    ''', (phone_number, limit - len(results)))
+                results += [_decode(row, columns) for row in cursor]
+            finally:
+                conn.close()
+        return results
+
+    def iter_range(self, start_ts: Optional[int], end_ts: Optional[int], phone_number: Optional[str],
+                   columns: Sequence[str], fetch_rows: int = 1000) -> Iterator[tuple]:
+        """Mensagens arquivadas em [start_ts, end_ts), em ordem de (ts, id), lendo um mês por vez."""
+        conditions, params = [], []
+        if start_ts is not None:
+            conditions.append('ts >= ?')
+            params.append(start_ts)
+        if end_ts is not None:
+            conditions.append('ts < ?')
+            params.append(end_ts)
+        if phone_number:
+            conditions.append('phone_number = ?')
+            params.append(phone_number)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        for month in self.months():
+            if end_ts is not None and month_start_ms(month) >= end_ts:
+                break
+            if start_ts is not None and month < archive_month(start_ts):
+                continue
+            conn = self._connect(month)
+            if conn is None:
+                continue
+            try:
+                cursor = conn.execute(f'''
+                    SELECT id, phone_number, direction, ts, payload FROM messages
+                    {where}
+                    ORDER BY ts, id
+                ''', params)
+                while True:
+                    rows = cursor.fetchmany(fetch_rows)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield _decode(row, columns)
+            finally:
+                conn.close()
+
+    def purge(self, before_month: Optional[str] = None) -> List[str]:
+        """Apaga os arquivos dos meses anteriores a 'before_month' (todos, se None)."""
+        purged = []
+        for month in self.months():
+            if before_month is not None and month >= before_month:
+                continue
+            for suffix in ('', '-wal', '-shm', '-journal'):
+                if os.path.exists(self.path(month) + suffix):
+                    os.remove(self.path(month) + suffix)
+            purged.append(month)
+        if purged:
+            logger.info(f"🗑️ Arquivos de mensagens removidos: {', '.join(purged)}")
+        return purged
+
+    def stats(self) -> Dict:
+        months = self.months()
+        return {
+            'months': len(months),
+            'oldest_month': months[0] if months else None,
+            'newest_month': months[-1] if months else None,
+            'bytes': sum(os.path.getsize(self.path(month)) for month in months),
+        }
@@ -0,0 +1,26 @@
+"""
+Arquiva as conversas inativas e expurga os arquivos fora da retenção.
+
+Uso: python archive_messages.py [--days N] [--purge-days N] [--chunk-size N]
+"""
+import argparse
+import logging
+
+from database import db, ARCHIVE_AFTER_DAYS, ARCHIVE_PURGE_AFTER_DAYS, ARCHIVE_CHUNK
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Move conversas inativas para os arquivos mensais")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="arquiva conversas sem mensagens há mais de N dias, 0 desativa (padrão: %(default)s)")
+    parser.add_argument("--purge-days", type=int, default=ARCHIVE_PURGE_AFTER_DAYS,
+                        help="apaga meses arquivados com mais de N dias, 0 mantém (padrão: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=ARCHIVE_CHUNK,
+                        help="mensagens por transação (padrão: %(default)s)")
+    args = parser.parse_args()
+
+    stats = db.archive_conversations(older_than_days=args.days, chunk_size=args.chunk_size)
+    print(f"✅ {stats['messages']} mensagens de {stats['phones']} conversas arquivadas em {db.archive.directory}")
+    if args.purge_days > 0:
+        purged = db.purge_archives(older_than_days=args.purge_days)
+        print(f"🗑️ Meses expurgados: {', '.join(purged) if purged else 'nenhum'}")
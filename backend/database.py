@@ -1,21 +1,527 @@
 import sqlite3
+import gzip
+import hashlib
+import heapq
+import html
 import json
 import os
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 import logging
 
+from archive import MessageArchive, archive_month
+
 logger = logging.getLogger(__name__)
 
+# SQLite tuning: WAL lets readers run while the writer commits
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 20000))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+# Read connections kept open and shared between request threads; when all are busy a
+# reader waits up to SQLITE_READ_POOL_WAIT_MS, then uses a one-off connection
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", 8))
+SQLITE_READ_POOL_WAIT_MS = int(os.getenv("SQLITE_READ_POOL_WAIT_MS", 200))
+
+# Recent-messages cache: last N messages for up to M phones (LRU), 0 disables it
+RECENT_CACHE_SIZE = int(os.getenv("RECENT_CACHE_SIZE", 50))
+RECENT_CACHE_PHONES = int(os.getenv("RECENT_CACHE_PHONES", 500))
+
+# Group commit: the writer thread commits up to N queued messages per transaction,
+# waiting at most MESSAGE_WRITER_FLUSH_MS for a batch to fill
+MESSAGE_WRITER_BATCH = int(os.getenv("MESSAGE_WRITER_BATCH", 256))
+MESSAGE_WRITER_FLUSH_MS = int(os.getenv("MESSAGE_WRITER_FLUSH_MS", 2))
+
+# Retention: conversations idle for ARCHIVE_AFTER_DAYS move to compressed monthly archive
+# files (0, the default, disables it), moved ARCHIVE_CHUNK rows per transaction; archive
+# months older than ARCHIVE_PURGE_AFTER_DAYS are deleted (0 keeps them forever)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 0))
+ARCHIVE_PURGE_AFTER_DAYS = int(os.getenv("ARCHIVE_PURGE_AFTER_DAYS", 0))
+ARCHIVE_CHUNK = int(os.getenv("ARCHIVE_CHUNK", 500))
+
+# Streaming exports: rows fetched from the cursor per round trip
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", 1000))
+
+# Columns of each export dataset, in output order
+EXPORT_DATASETS = {
+    'messages': ('id', 'phone_number', 'direction', 'from_field', 'message_text', 'timestamp', 'ts'),
+    'conversations': ('id', 'phone_number', 'status', 'assigned_to', 'created_at', 'closed_at',
+                      'transfer_count', 'message_count', 'avg_response_time'),
+    'rollups_hourly': ('hour_ts', 'received', 'sent', 'phones', 'transfers', 'response_time_sum', 'response_count'),
+    'rollups_daily': ('day', 'received', 'sent', 'phones', 'transfers', 'response_time_sum', 'response_count'),
+}
+
+# Rows per transaction when backfilling messages.ts on an existing database
+TS_BACKFILL_CHUNK = int(os.getenv("TS_BACKFILL_CHUNK", 5000))
+
+def to_epoch_ms(value) -> Optional[int]:
+    """
+    Normalize a stored timestamp to epoch milliseconds (UTC).
+    Aware ISO strings keep their offset; naive 'YYYY-MM-DD HH:MM:SS' values come from
+    SQLite's CURRENT_TIMESTAMP (UTC) and naive ISO 'T' values from datetime.now() (local time).
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip()
+    try:
+        dt = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.astimezone() if 'T' in text else dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+def utc_text(ts: int) -> str:
+    """Epoch ms → 'YYYY-MM-DD HH:MM:SS' in UTC, the format of CURRENT_TIMESTAMP columns"""
+    return datetime.fromtimestamp(ts / 1000, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def now_ms() -> int:
+    return int(datetime.now(timezone.utc).timestamp() * 1000)
+
+# Bulk import: rows per executemany/transaction and seconds between progress logs
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+IMPORT_PROGRESS_SECONDS = 5
+# Phones per transaction when conversation_summary or the rollups are rebuilt at startup
+DERIVED_PHONE_CHUNK = int(os.getenv("DERIVED_PHONE_CHUNK", 500))
+
+def message_text_hash(text: str) -> str:
+    """Short content hash; with phone, direction and ts it forms the message's natural key"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+def iter_ndjson(lines: Iterable) -> Iterator[Optional[Dict]]:
+    """Parse NDJSON one line at a time (str or bytes); malformed lines yield None"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        yield record if isinstance(record, dict) else None
+
+# Rows per transaction when (re)building the full-text search index
+FTS_REBUILD_CHUNK = int(os.getenv("FTS_REBUILD_CHUNK", 2000))
+# Columns and options of messages_fts (external content: the text lives only in messages)
+FTS_DEFINITION = "message_text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 1'"
+# Control characters snippet() puts around matches, swapped for the mark tags after escaping
+SNIPPET_OPEN, SNIPPET_CLOSE = '\x02', '\x03'
+
+def to_fts_query(text: str) -> str:
+    """Turn free text into a safe FTS5 query: every word must match, the last one as a prefix"""
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+# Reporting rollups: UTC hour buckets (epoch ms) and local calendar days
+HOUR_MS = 60 * 60 * 1000
+REPORT_PERIOD_DAYS = {'24h': 1, '7d': 7, '30d': 30, '90d': 90}
+TREND_WEEKS = 12
+TREND_MONTHS = 12
+
+def local_day(ts: int) -> str:
+    return datetime.fromtimestamp(ts / 1000).strftime('%Y-%m-%d')
+
+def response_delay(received_ts: int, ts: int) -> int:
+    return max(round((ts - received_ts) / 1000), 0)
+
+# Columns get_messages/get_messages_by_phone can project ('from' is accepted for from_field).
+# session_data and created_at are left out by default: the panel never reads them.
+MESSAGE_COLUMNS = ('id', 'phone_number', 'message_text', 'direction', 'from_field',
+                   'timestamp', 'ts', 'session_data', 'created_at')
+DEFAULT_MESSAGE_COLUMNS = ('id', 'phone_number', 'message_text', 'direction', 'from_field', 'timestamp', 'ts')
+
+_UNDECODED = object()
+
+class MessageRow:
+    """
+    A projected messages row: a tuple plus a column map shared by the whole result set.
+    Read it like a dict (row['message_text'], row['from']); session_data is only
+    json-decoded the first time it is accessed.
+    """
+    __slots__ = ('_columns', '_values', '_session_data')
+    
+    def __init__(self, columns: Dict[str, int], values: tuple):
+        self._columns = columns
+        self._values = values
+        self._session_data = _UNDECODED
+    
+    def __getitem__(self, key: str):
+        if key == 'from':
+            key = 'from_field'
+        if key == 'session_data':
+            return self.session_data
+        return self._values[self._columns[key]]
+    
+    def __contains__(self, key: str) -> bool:
+        return (key == 'from' and 'from_field' in self._columns) or key in self._columns
+    
+    def get(self, key: str, default=None):
+        return self[key] if key in self else default
+    
+    @property
+    def session_data(self) -> Optional[Dict]:
+        if self._session_data is _UNDECODED:
+            raw = self._values[self._columns['session_data']] if 'session_data' in self._columns else None
+            self._session_data = json.loads(raw) if raw else None
+        return self._session_data
+    
+    def keys(self) -> List[str]:
+        return [('from' if name == 'from_field' else name) for name in self._columns]
+    
+    def to_dict(self) -> Dict:
+        return {key: self[key] for key in self.keys()}
+    
+    def __repr__(self) -> str:
+        return f"MessageRow({self.to_dict()!r})"
+
+class _RecentTail:
+    __slots__ = ('rows', 'complete')
+    
+    def __init__(self, rows: deque, complete: bool):
+        self.rows = rows
+        self.complete = complete
+
+def _row_bytes(row: MessageRow) -> int:
+    """Approximate memory held by one cached row (the column map is shared and not counted)"""
+    return sys.getsizeof(row) + sys.getsizeof(row._values) + sum(sys.getsizeof(v) for v in row._values)
+
+class RecentMessagesCache:
+    """
+    Ring buffer of the last N messages (default projection, oldest first) per phone,
+    with LRU eviction across phones. Tails are loaded on read misses and written
+    through by save_message; 'complete' marks a tail that holds the phone's whole history.
+    
+    A fill racing with a write for the same phone is discarded (the tail it loaded
+    may miss the new message); the next read simply loads it again.
+    """
+    
+    def __init__(self, size: int = RECENT_CACHE_SIZE, max_phones: int = RECENT_CACHE_PHONES):
+        self.size = size
+        self.max_phones = max_phones
+        self._lock = threading.Lock()
+        self._tails: "OrderedDict[str, _RecentTail]" = OrderedDict()
+        self._filling: Dict[str, List] = {}  # phone -> [fills in flight, written meanwhile]
+        
+        # Métricas
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._messages = 0
+        self._bytes = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0 and self.max_phones > 0
+    
+    def get(self, phone_number: str, limit: int) -> Optional[List[MessageRow]]:
+        """The phone's last 'limit' messages, or None on a miss"""
+        with self._lock:
+            tail = self._tails.get(phone_number)
+            if tail is None or (limit > len(tail.rows) and not tail.complete):
+                self._misses += 1
+                return None
+            self._tails.move_to_end(phone_number)
+            self._hits += 1
+            rows = list(tail.rows)
+            return rows[-limit:] if limit < len(rows) else rows
+    
+    def begin_fill(self, phone_number: str):
+        with self._lock:
+            self._filling.setdefault(phone_number, [0, False])[0] += 1
+    
+    def fill(self, phone_number: str, rows: Optional[List[MessageRow]], complete: bool = False):
+        """Store the tail loaded after begin_fill (None just ends the fill)"""
+        with self._lock:
+            pending = self._filling[phone_number]
+            pending[0] -= 1
+            if pending[0] == 0:
+                del self._filling[phone_number]
+            if rows is None or pending[1]:
+                return
+            self._drop(phone_number)
+            tail = _RecentTail(deque(rows[-self.size:], maxlen=self.size), complete and len(rows) <= self.size)
+            self._tails[phone_number] = tail
+            self._messages += len(tail.rows)
+            self._bytes += sum(_row_bytes(row) for row in tail.rows)
+            while len(self._tails) > self.max_phones:
+                self._drop(next(iter(self._tails)))
+                self._evictions += 1
+    
+    def append(self, phone_number: str, row: MessageRow):
+        """Write-through of a newly saved message; only tails already in memory are extended"""
+        with self._lock:
+            if phone_number in self._filling:
+                self._filling[phone_number][1] = True
+            tail = self._tails.get(phone_number)
+            if tail is None:
+                return
+            if tail.rows and row['ts'] < tail.rows[-1]['ts']:
+                # Out of order (backdated message): reload the tail on the next read
+                self._drop(phone_number)
+                return
+            if len(tail.rows) == self.size:
+                self._messages -= 1
+                self._bytes -= _row_bytes(tail.rows[0])
+                tail.complete = False
+            tail.rows.append(row)
+            self._messages += 1
+            self._bytes += _row_bytes(row)
+            self._tails.move_to_end(phone_number)
+    
+    def invalidate(self, phone_number: Optional[str] = None):
+        """Forget one phone's tail, or every tail (bulk imports, archival, clear)"""
+        with self._lock:
+            phones = [phone_number] if phone_number else list(self._tails)
+            for phone in phones:
+                self._drop(phone)
+            for phone, pending in self._filling.items():
+                if phone_number is None or phone == phone_number:
+                    pending[1] = True
+    
+    def _drop(self, phone_number: str):
+        tail = self._tails.pop(phone_number, None)
+        if tail is not None:
+            self._messages -= len(tail.rows)
+            self._bytes -= sum(_row_bytes(row) for row in tail.rows)
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': self.size,
+                'max_phones': self.max_phones,
+                'phones': len(self._tails),
+                'messages': self._messages,
+                'approx_bytes': self._bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else 0,
+                'evictions': self._evictions,
+            }
+
+_DEFAULT_COLUMN_MAP = {name: i for i, name in enumerate(DEFAULT_MESSAGE_COLUMNS)}
+
+def _message_projection(columns: Iterable[str]) -> List[str]:
+    """Validate the requested columns; id and ts are always included for keyset cursors"""
+    selected = ['id', 'ts']
+    for name in columns:
+        name = 'from_field' if name == 'from' else name
+        if name not in MESSAGE_COLUMNS:
+            raise ValueError(f"Unknown message column: {name}")
+        if name not in selected:
+            selected.append(name)
+    return selected
+
+class _PendingMessage:
+    __slots__ = ('phone_number', 'message_text', 'direction', 'from_field', 'session_json',
+                 'timestamp', 'ts', 'future')
+    
+    def __init__(self, phone_number: str, message_text: str, direction: str, from_field: str,
+                 session_json: Optional[str], timestamp: str, ts: int):
+        self.phone_number = phone_number
+        self.message_text = message_text
+        self.direction = direction
+        self.from_field = from_field
+        self.session_json = session_json
+        self.timestamp = timestamp
+        self.ts = ts
+        self.future: Future = Future()
+
+class MessageWriter:
+    """
+    Single writer thread for save_message: queued messages are committed in small
+    batches (one transaction, one fsync each) in submission order. Every message
+    has a Future that resolves to its id once committed, or to the insert error.
+    """
+    
+    def __init__(self, db: 'Database', batch_size: int = MESSAGE_WRITER_BATCH,
+                 flush_ms: int = MESSAGE_WRITER_FLUSH_MS):
+        self.db = db
+        self.batch_size = max(batch_size, 1)
+        self.flush_window = flush_ms / 1000
+        self._queue: "queue.Queue[_PendingMessage]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        
+        # Métricas
+        self._batches = 0
+        self._written = 0
+        self._failed = 0
+        self._max_batch = 0
+        self._commit_total = 0.0
+    
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sqlite-message-writer", daemon=True)
+                self._thread.start()
+    
+    def submit(self, message: _PendingMessage) -> Future:
+        self._start()
+        self._queue.put(message)
+        return message.future
+    
+    def flush(self):
+        """Block until everything submitted so far is committed"""
+        if self._thread is not None:
+            self._queue.join()
+    
+    def _take_batch(self) -> List[_PendingMessage]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            started = time.monotonic()
+            try:
+                self.db._write_batch(batch)
+            except Exception as e:
+                # Commit failed: nothing in the batch was stored
+                logger.error(f"❌ Error committing {len(batch)} messages: {e}")
+                for message in batch:
+                    if not message.future.done():
+                        message.future.set_exception(e)
+            elapsed = time.monotonic() - started
+            
+            failed = sum(1 for message in batch if message.future.exception() is not None)
+            with self._lock:
+                self._batches += 1
+                self._written += len(batch) - failed
+                self._failed += failed
+                self._max_batch = max(self._max_batch, len(batch))
+                self._commit_total += elapsed
+            for _ in batch:
+                self._queue.task_done()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'batch_size': self.batch_size,
+                'flush_window_ms': int(self.flush_window * 1000),
+                'queue_depth': self._queue.qsize(),
+                'batches': self._batches,
+                'written': self._written,
+                'failed': self._failed,
+                'avg_batch': round(self._written / self._batches, 1) if self._batches else 0,
+                'max_batch': self._max_batch,
+                'avg_commit_ms': round(self._commit_total / self._batches * 1000, 2) if self._batches else 0,
+            }
+
 class Database:
-    def __init__(self, db_path: str = "messages.db"):
+    def __init__(self, db_path: str = "messages.db", archive_dir: Optional[str] = None):
         self.db_path = db_path
+        self.archive = MessageArchive(archive_dir or ARCHIVE_DIR or
+                                      os.path.join(os.path.dirname(os.path.abspath(db_path)), 'archive'))
+        self.fts_enabled = False
+        # Highest message id copied into messages_fts_rebuild while a rebuild runs
+        self._fts_rebuilt_upto: Optional[int] = None
+        self.recent = RecentMessagesCache()
+        self.writer = MessageWriter(self)
+        self._read_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._read_pool_lock = threading.Lock()
+        self._read_conns = 0
+        self._write_lock = threading.RLock()
+        self._write_conn: Optional[sqlite3.Connection] = None
         self.init_database()
     
+    def _open_connection(self, read_only: bool = False) -> sqlite3.Connection:
+        """Open a connection with the shared pragmas applied (WAL is set once, in init_database)"""
+        conn = sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        if read_only:
+            conn.execute('PRAGMA query_only=ON')
+        return conn
+    
+    @contextmanager
+    def _reader(self):
+        """
+        Read-only connection borrowed from a bounded pool (the server starts a thread
+        per request, so per-thread connections would never be reused)
+        """
+        conn, pooled = None, True
+        try:
+            conn = self._read_pool.get_nowait()
+        except queue.Empty:
+            with self._read_pool_lock:
+                if self._read_conns < SQLITE_READ_POOL_SIZE:
+                    self._read_conns += 1
+                    conn = self._open_connection(read_only=True)
+            if conn is None:
+                try:
+                    conn = self._read_pool.get(timeout=SQLITE_READ_POOL_WAIT_MS / 1000)
+                except queue.Empty:
+                    conn, pooled = self._open_connection(read_only=True), False
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if pooled:
+                self._read_pool.put(conn)
+            else:
+                conn.close()
+    
+    @contextmanager
+    def _writer(self):
+        """Single shared write connection; commits on success, rolls back on error"""
+        with self._write_lock:
+            if self._write_conn is None:
+                self._write_conn = self._open_connection()
+            conn = self._write_conn
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def close(self):
+        """Flush queued messages, then close the write connection and the idle pooled read connections"""
+        self.writer.flush()
+        with self._write_lock:
+            if self._write_conn is not None:
+                self._write_conn.close()
+                self._write_conn = None
+        with self._read_pool_lock:
+            while True:
+                try:
+                    self._read_pool.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._read_conns -= 1
+    
     def init_database(self):
         """Initialize the database with required tables"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._writer() as conn:
+                # WAL is persistent in the database file: set once here, not per connection
+                conn.execute('PRAGMA journal_mode=WAL')
                 cursor = conn.cursor()
                 
                 # Create messages table
@@ -28,9 +534,12 @@ class Database:
                         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                         from_field TEXT DEFAULT 'user',
                         session_data TEXT,
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        ts INTEGER,
+                        text_hash TEXT
                     )
                 ''')
+                self._add_missing_columns(cursor, 'messages', {'ts': 'INTEGER', 'text_hash': 'TEXT'})
                 
                 # Create conversations table for better reporting
                 cursor.execute('''
@@ -44,7 +553,10 @@ class Database:
                         procedure_type TEXT,
                         transfer_count INTEGER DEFAULT 0,
                         message_count INTEGER DEFAULT 0,
-                        avg_response_time INTEGER DEFAULT 0
+                        avg_response_time INTEGER DEFAULT 0,
+                        pending_inbound_at DATETIME,
+                        response_time_sum INTEGER DEFAULT 0,
+                        response_count INTEGER DEFAULT 0
                     )
                 ''')
                 
@@ -73,194 +585,901 @@ class Database:
                     )
                 ''')
                 
-                # Create indexes for faster queries
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_phone_number ON messages(phone_number)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON messages(timestamp)')
+                # Create conversation_summary table: one row per phone, kept up to date by save_message
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS conversation_summary (
+                        phone_number TEXT PRIMARY KEY,
+                        last_message_id INTEGER,
+                        last_message TEXT,
+                        last_direction TEXT,
+                        last_from TEXT,
+                        last_timestamp DATETIME,
+                        first_timestamp DATETIME,
+                        message_count INTEGER DEFAULT 0,
+                        received_count INTEGER DEFAULT 0,
+                        sent_count INTEGER DEFAULT 0,
+                        last_ts INTEGER,
+                        first_ts INTEGER
+                    )
+                ''')
+                self._add_missing_columns(cursor, 'conversation_summary',
+                                          {'last_ts': 'INTEGER', 'first_ts': 'INTEGER'})
+                
+                # Reporting rollups, kept up to date by save_message and record_transfer.
+                # The *_phones tables hold one row per phone per bucket for distinct counts.
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_daily'")
+                rollups_exist = cursor.fetchone() is not None
+                for table, key in (('rollup_hourly', 'hour_ts INTEGER'), ('rollup_daily', 'day TEXT')):
+                    cursor.execute(f'''
+                        CREATE TABLE IF NOT EXISTS {table} (
+                            {key} PRIMARY KEY,
+                            received INTEGER DEFAULT 0,
+                            sent INTEGER DEFAULT 0,
+                            phones INTEGER DEFAULT 0,
+                            transfers INTEGER DEFAULT 0,
+                            response_time_sum INTEGER DEFAULT 0,
+                            response_count INTEGER DEFAULT 0
+                        )
+                    ''')
+                    cursor.execute(f'''
+                        CREATE TABLE IF NOT EXISTS {table}_phones (
+                            {key},
+                            phone_number TEXT,
+                            PRIMARY KEY ({key.split()[0]}, phone_number)
+                        ) WITHOUT ROWID
+                    ''')
+                
+                # Which archive months hold messages of each phone, so history reads
+                # only open the archive files that matter
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS archive_index (
+                        phone_number TEXT NOT NULL,
+                        month TEXT NOT NULL,
+                        messages INTEGER DEFAULT 0,
+                        PRIMARY KEY (phone_number, month)
+                    ) WITHOUT ROWID
+                ''')
+                
+                # Full-text index over message_text (external content: the text lives only in messages)
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+                fts_exists = cursor.fetchone() is not None
+                try:
+                    cursor.execute(f'''
+                        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5({FTS_DEFINITION})
+                    ''')
+                    self.fts_enabled = True
+                except sqlite3.OperationalError as e:
+                    logger.warning(f"⚠️ FTS5 indisponível neste SQLite, busca desativada: {e}")
+                
+                # Create indexes for faster queries. Messages are ordered and filtered by the
+                # epoch-ms ts column; (phone_number, ts) also serves plain phone lookups.
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_phone_ts ON messages(phone_number, ts)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(ts)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_status ON conversations(status)')
+                # Covers the report's per-period conversation counts (index-only range scan)
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_conversation_created
+                    ON conversations(created_at, status, transfer_count)
+                ''')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_phone ON conversations(phone_number)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_agent_status ON agents(status)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_metrics_date ON conversation_metrics(date)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_summary_last_ts_phone ON conversation_summary(last_ts, phone_number)')
+                # idx_messages_natural_key (unique) rejected legitimate repeats; imports check the key themselves
+                for index in ('idx_phone_number', 'idx_timestamp', 'idx_phone_timestamp_id',
+                              'idx_summary_last_timestamp', 'idx_summary_last_timestamp_phone',
+                              'idx_messages_natural_key'):
+                    cursor.execute(f'DROP INDEX IF EXISTS {index}')
+            
+            # Existing rows get their ts/text_hash in small transactions so the writer is never held for long
+            self.backfill_message_keys()
+            
+            with self._writer() as conn:
+                cursor = conn.cursor()
                 
-                conn.commit()
-                logger.info("✅ Database initialized successfully with reporting tables")
+                # Summary rows written before last_ts existed (or a brand new table) are rebuilt
+                cursor.execute('SELECT 1 FROM conversation_summary WHERE last_ts IS NULL LIMIT 1')
+                stale_summary = cursor.fetchone() is not None
+                cursor.execute('SELECT 1 FROM conversation_summary LIMIT 1')
+                empty_summary = cursor.fetchone() is None
+                cursor.execute('SELECT 1 FROM messages LIMIT 1')
+                has_messages = cursor.fetchone() is not None
+                
+                # Running metrics kept incrementally by save_message
+                self._migrate_conversation_metrics(cursor)
+            
+            # Derived tables and a new search index are filled in chunks, like the ts backfill
+            rebuild_summary = stale_summary or (empty_summary and has_messages)
+            rebuild_rollups = not rollups_exist and has_messages
+            if rebuild_summary or rebuild_rollups:
+                self._rebuild_derived(summary=rebuild_summary, rollups=rebuild_rollups)
+            if self.fts_enabled and not fts_exists and has_messages:
+                self.rebuild_search_index()
+            
+            logger.info("✅ Database initialized successfully with reporting tables")
                 
         except Exception as e:
             logger.error(f"❌ Error initializing database: {e}")
             raise
     
+    def _add_missing_columns(self, cursor: sqlite3.Cursor, table: str, columns: Dict[str, str]) -> List[str]:
+        """ALTER TABLE ADD COLUMN for each column not yet present; returns the names added"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        missing = [name for name in columns if name not in existing]
+        for name in missing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {columns[name]}')
+        return missing
+    
+    def backfill_message_keys(self, chunk_size: int = TS_BACKFILL_CHUNK) -> int:
+        """Fill messages.ts/text_hash for rows saved before the columns existed, one chunk per transaction"""
+        total = 0
+        last_id = 0
+        while True:
+            with self._writer() as conn:
+                rows = conn.execute('''
+                    SELECT id, timestamp, created_at, ts, message_text FROM messages
+                    WHERE id > ? AND (ts IS NULL OR text_hash IS NULL)
+                    ORDER BY id
+                    LIMIT ?
+                ''', (last_id, chunk_size)).fetchall()
+                if not rows:
+                    break
+                conn.executemany('UPDATE messages SET ts = ?, text_hash = ? WHERE id = ?', [
+                    (ts or to_epoch_ms(timestamp) or to_epoch_ms(created_at) or 0,
+                     message_text_hash(message_text), message_id)
+                    for message_id, timestamp, created_at, ts, message_text in rows
+                ])
+            last_id = rows[-1][0]
+            total += len(rows)
+        if total:
+            logger.info(f"✅ Epoch timestamps and text hashes backfilled for {total} messages")
+        return total
+    
     def save_message(self, phone_number: str, message_text: str, direction: str, 
                     from_field: str = "user", session_data: Optional[Dict] = None, 
-                    timestamp: Optional[str] = None) -> bool:
-        """Save a message to the database"""
+                    timestamp: Optional[str] = None) -> Optional[int]:
+        """Save a message to the database and return its id (None on failure)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                session_json = json.dumps(session_data) if session_data else None
-                
-                if timestamp:
-                    cursor.execute('''
-                        INSERT INTO messages (phone_number, message_text, direction, from_field, session_data, timestamp)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (phone_number, message_text, direction, from_field, session_json, timestamp))
-                else:
-                    cursor.execute('''
-                        INSERT INTO messages (phone_number, message_text, direction, from_field, session_data)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (phone_number, message_text, direction, from_field, session_json))
-                
-                # Update conversation metrics
-                self._update_conversation_metrics(phone_number)
-                
-                conn.commit()
-                logger.info(f"✅ Message saved for {phone_number}")
-                return True
-                
+            return self.submit_message(phone_number, message_text, direction, from_field,
+                                       session_data, timestamp).result()
         except Exception as e:
             logger.error(f"❌ Error saving message: {e}")
-            return False
+            return None
     
-    def _update_conversation_metrics(self, phone_number: str):
-        """Update conversation metrics when a message is saved"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
+    def submit_message(self, phone_number: str, message_text: str, direction: str,
+                       from_field: str = "user", session_data: Optional[Dict] = None,
+                       timestamp: Optional[str] = None) -> Future:
+        """
+        Queue a message for the group-commit writer without waiting for the disk.
+        The Future resolves to the message id once committed; call result() when the
+        caller needs to read its own write.
+        """
+        ts = to_epoch_ms(timestamp) or now_ms()
+        if not timestamp:
+            # Derived from ts so both always agree
+            timestamp = utc_text(ts)
+        session_json = json.dumps(session_data) if session_data else None
+        return self.writer.submit(_PendingMessage(phone_number, message_text, direction, from_field,
+                                                  session_json, timestamp, ts))
+    
+    def _write_batch(self, batch: List[_PendingMessage]):
+        """Insert a batch of queued messages in one transaction (called by the writer thread)"""
+        saved: List[Tuple[_PendingMessage, int]] = []
+        # Held across the commit and the cache write-through, so tails are extended in commit order
+        with self._write_lock:
+            with self._writer() as conn:
                 cursor = conn.cursor()
-                
-                # Get or create conversation
+                # Explicit BEGIN: a SAVEPOINT outside a transaction would commit on its own RELEASE
+                cursor.execute('BEGIN')
+                for message in batch:
+                    # A failing message (e.g. a constraint error) is rolled back alone
+                    cursor.execute('SAVEPOINT save_message')
+                    try:
+                        message_id = self._insert_message(cursor, message)
+                        cursor.execute('RELEASE save_message')
+                        saved.append((message, message_id))
+                    except sqlite3.Error as e:
+                        cursor.execute('ROLLBACK TO save_message')
+                        cursor.execute('RELEASE save_message')
+                        message.future.set_exception(e)
+            
+            for message, message_id in saved:
+                if self.recent.enabled:
+                    self.recent.append(message.phone_number, MessageRow(_DEFAULT_COLUMN_MAP, (
+                        message_id, message.phone_number, message.message_text, message.direction,
+                        message.from_field, message.timestamp, message.ts)))
+        
+        if saved:
+            logger.info(f"✅ {len(saved)} message(s) saved")
+        for message, message_id in saved:
+            message.future.set_result(message_id)
+    
+    def _insert_message(self, cursor: sqlite3.Cursor, message: _PendingMessage) -> int:
+        phone_number, message_text, direction = message.phone_number, message.message_text, message.direction
+        cursor.execute('''
+            INSERT INTO messages (phone_number, message_text, direction, from_field, session_data,
+                                  timestamp, ts, text_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (phone_number, message_text, direction, message.from_field, message.session_json,
+              message.timestamp, message.ts, message_text_hash(message_text)))
+        
+        message_id = cursor.lastrowid
+        
+        # Update conversation metrics, summary and rollups in the same transaction
+        response_seconds = self._update_conversation_metrics(cursor, phone_number, direction, message.timestamp)
+        self._update_conversation_summary(cursor, message_id, phone_number, message_text,
+                                          direction, message.from_field, message.timestamp, message.ts)
+        self._update_rollups(cursor, phone_number, message.ts,
+                             received=int(direction == 'received'), sent=int(direction == 'sent'),
+                             response_seconds=response_seconds)
+        if self.fts_enabled:
+            cursor.execute('INSERT INTO messages_fts (rowid, message_text) VALUES (?, ?)',
+                           (message_id, message_text))
+        return message_id
+    
+    def _update_conversation_metrics(self, cursor: sqlite3.Cursor, phone_number: str,
+                                     direction: str, timestamp: Optional[str]) -> Optional[int]:
+        """
+        Update conversation metrics incrementally when a message is saved (O(1) per message).
+        Returns the response time in seconds when an outbound message answers a pending inbound one.
+        """
+        try:
+            # Get or create conversation
+            cursor.execute('''
+                SELECT id FROM conversations 
+                WHERE phone_number = ? AND status = 'active'
+            ''', (phone_number,))
+            
+            result = cursor.fetchone()
+            if result:
+                conversation_id = result[0]
+            else:
+                # Create new conversation
                 cursor.execute('''
-                    SELECT id FROM conversations 
-                    WHERE phone_number = ? AND status = 'active'
+                    INSERT INTO conversations (phone_number, status)
+                    VALUES (?, 'active')
                 ''', (phone_number,))
-                
-                result = cursor.fetchone()
-                if result:
-                    conversation_id = result[0]
-                else:
-                    # Create new conversation
-                    cursor.execute('''
-                        INSERT INTO conversations (phone_number, status)
-                        VALUES (?, 'active')
-                    ''', (phone_number,))
-                    conversation_id = cursor.lastrowid
-                
-                # Update message count
+                conversation_id = cursor.lastrowid
+            
+            if direction == 'received':
+                # Inbound message: count it and mark it as awaiting a response
                 cursor.execute('''
                     UPDATE conversations 
-                    SET message_count = (
-                        SELECT COUNT(*) FROM messages WHERE phone_number = ?
-                    )
+                    SET message_count = message_count + 1,
+                        pending_inbound_at = COALESCE(?, CURRENT_TIMESTAMP)
                     WHERE id = ?
-                ''', (phone_number, conversation_id))
-                
-                # Calculate average response time
-                cursor.execute('''
-                    UPDATE conversations 
-                    SET avg_response_time = (
-                        SELECT AVG(
-                            CAST(
-                                (julianday(m2.timestamp) - julianday(m1.timestamp)) * 24 * 60 * 60 
-                                AS INTEGER
-                            )
-                        )
-                        FROM messages m1
-                        JOIN messages m2 ON m1.phone_number = m2.phone_number
-                        WHERE m1.phone_number = ? 
-                        AND m1.direction = 'received' 
-                        AND m2.direction = 'sent'
-                        AND m2.timestamp > m1.timestamp
-                    )
-                    WHERE id = ?
-                ''', (phone_number, conversation_id))
+                ''', (timestamp, conversation_id))
+                return None
+            
+            # Outbound message: close the pending inbound and add its response delta
+            cursor.execute('''
+                SELECT CASE
+                    WHEN pending_inbound_at IS NULL THEN NULL
+                    ELSE MAX(CAST(ROUND(
+                        (julianday(COALESCE(?, CURRENT_TIMESTAMP)) - julianday(pending_inbound_at)) * 24 * 60 * 60
+                    ) AS INTEGER), 0)
+                END
+                FROM conversations WHERE id = ?
+            ''', (timestamp, conversation_id))
+            response_seconds = cursor.fetchone()[0]
+            
+            cursor.execute('''
+                UPDATE conversations 
+                SET message_count = message_count + 1,
+                    response_time_sum = response_time_sum + COALESCE(?, 0),
+                    response_count = response_count + (? IS NOT NULL),
+                    pending_inbound_at = NULL
+                WHERE id = ?
+            ''', (response_seconds, response_seconds, conversation_id))
+            
+            cursor.execute('''
+                UPDATE conversations 
+                SET avg_response_time = response_time_sum / response_count
+                WHERE id = ? AND response_count > 0
+            ''', (conversation_id,))
+            return response_seconds
                 
         except Exception as e:
             logger.error(f"❌ Error updating conversation metrics: {e}")
+            return None
+    
+    def _migrate_conversation_metrics(self, cursor: sqlite3.Cursor):
+        """Add the running-metrics columns and backfill them with one ordered pass over messages"""
+        missing = self._add_missing_columns(cursor, 'conversations', {
+            'pending_inbound_at': 'DATETIME',
+            'response_time_sum': 'INTEGER DEFAULT 0',
+            'response_count': 'INTEGER DEFAULT 0',
+        })
+        if not missing:
+            return
+        
+        # Backfill: pair each outbound message with the latest unanswered inbound one
+        pending: Dict[str, tuple] = {}
+        totals: Dict[str, List[int]] = {}
+        rows = cursor.execute('''
+            SELECT phone_number, direction, timestamp, CAST(ROUND(ts / 1000.0) AS INTEGER)
+            FROM messages
+            ORDER BY phone_number, ts
+        ''')
+        for phone, direction, timestamp, seconds in rows:
+            totals.setdefault(phone, [0, 0])
+            if direction == 'received':
+                pending[phone] = (timestamp, seconds)
+            elif phone in pending and seconds is not None and pending[phone][1] is not None:
+                totals[phone][0] += max(seconds - pending.pop(phone)[1], 0)
+                totals[phone][1] += 1
+        
+        for phone, (total, count) in totals.items():
+            cursor.execute('''
+                UPDATE conversations
+                SET response_time_sum = ?, response_count = ?, pending_inbound_at = ?
+                WHERE phone_number = ? AND status = 'active'
+            ''', (total, count, pending[phone][0] if phone in pending else None, phone))
+        logger.info(f"✅ Conversation metrics backfilled for {len(totals)} phones")
+    
+    def _update_conversation_summary(self, cursor: sqlite3.Cursor, message_id: int, phone_number: str,
+                                     message_text: str, direction: str, from_field: str,
+                                     timestamp: Optional[str], ts: int):
+        """Upsert the phone's summary row; last_* only moves forward in time (by ts)"""
+        cursor.execute('''
+            INSERT INTO conversation_summary (
+                phone_number, last_message_id, last_message, last_direction, last_from,
+                last_timestamp, first_timestamp, last_ts, first_ts,
+                message_count, received_count, sent_count
+            )
+            VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP), ?, ?, 1, ?, ?)
+            ON CONFLICT(phone_number) DO UPDATE SET
+                message_count = message_count + 1,
+                received_count = received_count + excluded.received_count,
+                sent_count = sent_count + excluded.sent_count,
+                last_message_id = CASE WHEN excluded.last_ts >= last_ts
+                                       THEN excluded.last_message_id ELSE last_message_id END,
+                last_message = CASE WHEN excluded.last_ts >= last_ts
+                                    THEN excluded.last_message ELSE last_message END,
+                last_direction = CASE WHEN excluded.last_ts >= last_ts
+                                      THEN excluded.last_direction ELSE last_direction END,
+                last_from = CASE WHEN excluded.last_ts >= last_ts
+                                 THEN excluded.last_from ELSE last_from END,
+                last_timestamp = CASE WHEN excluded.last_ts >= last_ts
+                                      THEN excluded.last_timestamp ELSE last_timestamp END,
+                first_timestamp = CASE WHEN excluded.first_ts < first_ts
+                                       THEN excluded.first_timestamp ELSE first_timestamp END,
+                last_ts = MAX(last_ts, excluded.last_ts),
+                first_ts = MIN(first_ts, excluded.first_ts)
+        ''', (phone_number, message_id, message_text, direction, from_field, timestamp, timestamp, ts, ts,
+              1 if direction == 'received' else 0, 1 if direction == 'sent' else 0))
+    
+    def _rebuild_conversation_summary(self, cursor: sqlite3.Cursor, phones: Sequence[str]):
+        """Recompute the conversation_summary rows of 'phones' from their messages (backfill and bulk imports)"""
+        for start in range(0, len(phones), DERIVED_PHONE_CHUNK):
+            chunk = list(phones[start:start + DERIVED_PHONE_CHUNK])
+            marks = ', '.join('?' * len(chunk))
+            cursor.execute(f'DELETE FROM conversation_summary WHERE phone_number IN ({marks})', chunk)
+            cursor.execute(f'''
+                INSERT INTO conversation_summary (
+                    phone_number, last_message_id, last_message, last_direction, last_from,
+                    last_timestamp, first_timestamp, last_ts, first_ts,
+                    message_count, received_count, sent_count
+                )
+                SELECT phone_number, id, message_text, direction, from_field,
+                       timestamp, first_timestamp, ts, first_ts,
+                       message_count, received_count, sent_count
+                FROM (
+                    SELECT phone_number, id, message_text, direction, from_field, timestamp, ts,
+                           ROW_NUMBER() OVER (PARTITION BY phone_number ORDER BY ts DESC, id DESC) AS rn,
+                           FIRST_VALUE(timestamp) OVER (PARTITION BY phone_number ORDER BY ts, id) AS first_timestamp,
+                           MIN(ts) OVER (PARTITION BY phone_number) AS first_ts,
+                           COUNT(*) OVER (PARTITION BY phone_number) AS message_count,
+                           SUM(direction = 'received') OVER (PARTITION BY phone_number) AS received_count,
+                           SUM(direction = 'sent') OVER (PARTITION BY phone_number) AS sent_count
+                    FROM messages
+                    WHERE phone_number IN ({marks})
+                )
+                WHERE rn = 1
+            ''', chunk)
+    
+    def _update_rollups(self, cursor: sqlite3.Cursor, phone_number: str, ts: int,
+                        received: int = 0, sent: int = 0, transfers: int = 0,
+                        response_seconds: Optional[int] = None):
+        """Add one event to its hourly and daily rollup buckets"""
+        for table, key_column, key in (('rollup_hourly', 'hour_ts', ts - ts % HOUR_MS),
+                                       ('rollup_daily', 'day', local_day(ts))):
+            new_phone = 0
+            if received or sent:
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO {table}_phones ({key_column}, phone_number) VALUES (?, ?)
+                ''', (key, phone_number))
+                new_phone = cursor.rowcount
+            cursor.execute(f'''
+                INSERT INTO {table} ({key_column}, received, sent, phones, transfers, response_time_sum, response_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT({key_column}) DO UPDATE SET
+                    received = received + excluded.received,
+                    sent = sent + excluded.sent,
+                    phones = phones + excluded.phones,
+                    transfers = transfers + excluded.transfers,
+                    response_time_sum = response_time_sum + excluded.response_time_sum,
+                    response_count = response_count + excluded.response_count
+            ''', (key, received, sent, new_phone, transfers,
+                  response_seconds or 0, int(response_seconds is not None)))
+    
+    def _rebuild_rollups(self, cursor: sqlite3.Cursor, phones: Sequence[str]):
+        """
+        Add the whole history of 'phones' to the rollups by replaying it in order (startup rebuild
+        into fresh rollup tables). Transfers are not derived from messages and are left untouched.
+        """
+        deltas: Dict[str, Dict] = {'rollup_hourly': {}, 'rollup_daily': {}}
+        for phone in phones:
+            pending = None
+            for ts, direction in cursor.connection.execute('''
+                SELECT ts, direction FROM messages WHERE phone_number = ? ORDER BY ts, id
+            ''', (phone,)):
+                response = None
+                if direction == 'received':
+                    pending = ts
+                elif pending is not None:
+                    response, pending = response_delay(pending, ts), None
+                self._add_rollup_delta(cursor, deltas, phone, ts, direction, response)
+        self._apply_rollup_deltas(cursor, deltas)
+    
+    def _fold_imported_rows(self, cursor: sqlite3.Cursor, last_id: int):
+        """
+        Fold the rows imported after 'last_id' into conversation_summary and the rollups, reading only
+        those rows and their stored neighbours. Response times pair a received message with the next
+        message when it is not received, so each run of new rows between two stored neighbours P and N
+        drops the old P→N pair and adds the pairs along P, run..., N.
+        """
+        rows = cursor.execute('''
+            SELECT id, phone_number, message_text, direction, from_field, timestamp, ts
+            FROM messages WHERE id > ?
+            ORDER BY phone_number, ts, id
+        ''', (last_id,)).fetchall()
+        deltas: Dict[str, Dict] = {'rollup_hourly': {}, 'rollup_daily': {}}
+        
+        def neighbour(phone: str, ts: int, after: bool) -> Optional[tuple]:
+            # Stored rows have smaller ids than imported ones, so on a ts tie they come first
+            return cursor.execute(f'''
+                SELECT ts, direction, id FROM messages
+                WHERE phone_number = ? AND id <= ? AND ts {'>' if after else '<='} ?
+                ORDER BY ts {'' if after else 'DESC'}, id {'' if after else 'DESC'}
+                LIMIT 1
+            ''', (phone, last_id, ts)).fetchone()
+        
+        def fold_run(phone: str, previous: Optional[tuple], run: List[tuple]):
+            following = neighbour(phone, run[-1][6], after=True)
+            if previous and following and previous[1] == 'received' and following[1] != 'received':
+                self._add_rollup_delta(cursor, deltas, phone, following[0], following[1],
+                                       response_delay(previous[0], following[0]), new=False, count=-1)
+            chain = [previous] + [(row[6], row[3]) for row in run] + ([following] if following else [])
+            for position in range(1, len(chain)):
+                before, (ts, direction) = chain[position - 1], chain[position][:2]
+                new = position <= len(run)
+                response = None
+                if before and before[1] == 'received' and direction != 'received':
+                    response = response_delay(before[0], ts)
+                if new or response is not None:
+                    self._add_rollup_delta(cursor, deltas, phone, ts, direction, response, new=new)
+        
+        run: List[tuple] = []
+        run_previous = None
+        for row in rows:
+            message_id, phone, message_text, direction, from_field, timestamp, ts = row
+            self._update_conversation_summary(cursor, message_id, phone, message_text,
+                                              direction, from_field, timestamp, ts)
+            previous = neighbour(phone, ts, after=False)
+            if run and (run[-1][1] != phone or previous != run_previous):
+                fold_run(run[-1][1], run_previous, run)
+                run = []
+            if not run:
+                run_previous = previous
+            run.append(row)
+        if run:
+            fold_run(run[-1][1], run_previous, run)
+        self._apply_rollup_deltas(cursor, deltas)
     
-    def get_messages(self, limit: int = 100) -> List[Dict]:
-        """Get all messages ordered by timestamp"""
+    def _add_rollup_delta(self, cursor: sqlite3.Cursor, deltas: Dict[str, Dict], phone: str, ts: int,
+                          direction: str, response: Optional[int], new: bool = True, count: int = 1):
+        """Accumulate one message (new: counted, with its phone) and/or one response time into 'deltas'"""
+        for table, key_column, key in (('rollup_hourly', 'hour_ts', ts - ts % HOUR_MS),
+                                       ('rollup_daily', 'day', local_day(ts))):
+            delta = deltas[table].setdefault(key, [0, 0, 0, 0, 0])
+            if new:
+                delta[0] += direction == 'received'
+                delta[1] += direction == 'sent'
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO {table}_phones ({key_column}, phone_number) VALUES (?, ?)
+                ''', (key, phone))
+                delta[2] += cursor.rowcount
+            if response is not None:
+                delta[3] += count * response
+                delta[4] += count
+    
+    def _apply_rollup_deltas(self, cursor: sqlite3.Cursor, deltas: Dict[str, Dict]):
+        for table, key_column in (('rollup_hourly', 'hour_ts'), ('rollup_daily', 'day')):
+            cursor.executemany(f'''
+                INSERT INTO {table} ({key_column}, received, sent, phones, transfers, response_time_sum, response_count)
+                VALUES (?, ?, ?, ?, 0, ?, ?)
+                ON CONFLICT({key_column}) DO UPDATE SET
+                    received = received + excluded.received,
+                    sent = sent + excluded.sent,
+                    phones = phones + excluded.phones,
+                    response_time_sum = response_time_sum + excluded.response_time_sum,
+                    response_count = response_count + excluded.response_count
+            ''', [(key, *delta) for key, delta in deltas[table].items()])
+    
+    def _rebuild_derived(self, summary: bool, rollups: bool, chunk_size: int = DERIVED_PHONE_CHUNK):
+        """Recompute conversation_summary and/or the rollups from messages, one chunk of phones per transaction"""
+        last_phone = ''
+        rebuilt = 0
+        while True:
+            with self._writer() as conn:
+                cursor = conn.cursor()
+                phones = [row[0] for row in cursor.execute('''
+                    SELECT DISTINCT phone_number FROM messages
+                    WHERE phone_number > ?
+                    ORDER BY phone_number
+                    LIMIT ?
+                ''', (last_phone, chunk_size)).fetchall()]
+                if not phones:
+                    if summary:
+                        # Stale rows left are conversations without hot messages
+                        cursor.execute('DELETE FROM conversation_summary WHERE last_ts IS NULL')
+                    break
+                if summary:
+                    self._rebuild_conversation_summary(cursor, phones)
+                if rollups:
+                    self._rebuild_rollups(cursor, phones)
+            last_phone = phones[-1]
+            rebuilt += len(phones)
+        logger.info(f"✅ Derived tables rebuilt for {rebuilt} phones (summary={summary}, rollups={rollups})")
+    
+    def record_transfer(self, phone_number: str) -> bool:
+        """Count a bot-to-human transfer on the active conversation and in the rollups"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._writer() as conn:
                 cursor = conn.cursor()
-                
                 cursor.execute('''
-                    SELECT * FROM messages 
-                    ORDER BY timestamp DESC 
-                    LIMIT ?
-                ''', (limit,))
-                
-                messages = []
-                for row in cursor.fetchall():
-                    message = {
-                        'id': row['id'],
-                        'phone_number': row['phone_number'],
-                        'message_text': row['message_text'],
-                        'direction': row['direction'],
-                        'from': row['from_field'],
-                        'timestamp': row['timestamp'],
-                        'session_data': json.loads(row['session_data']) if row['session_data'] else None,
-                        'created_at': row['created_at']
-                    }
-                    messages.append(message)
+                    UPDATE conversations SET transfer_count = transfer_count + 1
+                    WHERE phone_number = ? AND status = 'active'
+                ''', (phone_number,))
+                self._update_rollups(cursor, phone_number, now_ms(), transfers=1)
+                return True
+        except Exception as e:
+            logger.error(f"❌ Error recording transfer for {phone_number}: {e}")
+            return False
+    
+    def rebuild_search_index(self, chunk_size: int = FTS_REBUILD_CHUNK) -> int:
+        """Rebuild the search index into a shadow FTS table one chunk per transaction, then swap it in.
+
+        Live writes keep indexing into messages_fts meanwhile, so searches stay complete; the last
+        chunk and the swap share one writer transaction, which catches up rows saved in between.
+        """
+        if not self.fts_enabled:
+            return 0
+        with self._writer() as conn:
+            conn.execute('DROP TABLE IF EXISTS messages_fts_rebuild')
+            conn.execute(f'CREATE VIRTUAL TABLE messages_fts_rebuild USING fts5({FTS_DEFINITION})')
+            self._fts_rebuilt_upto = 0
+        total = 0
+        try:
+            while True:
+                with self._writer() as conn:
+                    rows = conn.execute('''
+                        SELECT id, message_text FROM messages
+                        WHERE id > ?
+                        ORDER BY id
+                        LIMIT ?
+                    ''', (self._fts_rebuilt_upto, chunk_size)).fetchall()
+                    conn.executemany('INSERT INTO messages_fts_rebuild (rowid, message_text) VALUES (?, ?)', rows)
+                    total += len(rows)
+                    if len(rows) < chunk_size:
+                        conn.execute('DROP TABLE messages_fts')
+                        conn.execute('ALTER TABLE messages_fts_rebuild RENAME TO messages_fts')
+                        break
+                    self._fts_rebuilt_upto = rows[-1][0]
+                logger.info(f"🔎 Índice de busca: {total} mensagens indexadas")
+        finally:
+            self._fts_rebuilt_upto = None
+        logger.info(f"✅ Search index rebuilt for {total} messages")
+        return total
+    
+    def _delete_from_search_index(self, cursor: sqlite3.Cursor, rows: List[Dict]):
+        """Drop rows from the search index, including the shadow copy of a rebuild in progress"""
+        cursor.executemany("INSERT INTO messages_fts (messages_fts, rowid, message_text) VALUES ('delete', ?, ?)",
+                           [(row['id'], row['message_text']) for row in rows])
+        upto = self._fts_rebuilt_upto
+        if upto:
+            cursor.executemany("INSERT INTO messages_fts_rebuild (messages_fts_rebuild, rowid, message_text) VALUES ('delete', ?, ?)",
+                               [(row['id'], row['message_text']) for row in rows if row['id'] <= upto])
+    
+    def search_messages(self, query: str, phone_number: Optional[str] = None,
+                        start_ts: Optional[int] = None, end_ts: Optional[int] = None,
+                        limit: int = 20, offset: int = 0,
+                        mark: Tuple[str, str] = ('<mark>', '</mark>')) -> List[Dict]:
+        """
+        Full-text search over message_text, best matches first (bm25).
+        Optional filters: phone_number and a [start_ts, end_ts) epoch-ms range.
+        'snippet' is HTML-escaped message text with the matched terms wrapped in the 'mark' strings.
+        """
+        match = to_fts_query(query)
+        if not self.fts_enabled or not match:
+            return []
+        
+        conditions = ['messages_fts MATCH ?']
+        params: List = [SNIPPET_OPEN, SNIPPET_CLOSE, match]
+        if phone_number:
+            conditions.append('m.phone_number = ?')
+            params.append(phone_number)
+        if start_ts is not None:
+            conditions.append('m.ts >= ?')
+            params.append(start_ts)
+        if end_ts is not None:
+            conditions.append('m.ts < ?')
+            params.append(end_ts)
+        params += [limit, offset]
+        
+        try:
+            with self._reader() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                cursor.execute(f'''
+                    SELECT m.id, m.phone_number, m.message_text, m.direction, m.from_field,
+                           m.timestamp, m.ts,
+                           snippet(messages_fts, 0, ?, ?, '…', 16) AS snippet,
+                           bm25(messages_fts) AS score
+                    FROM messages_fts
+                    JOIN messages m ON m.id = messages_fts.rowid
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY score
+                    LIMIT ? OFFSET ?
+                ''', params)
                 
-                return messages
+                return [{
+                    'id': row['id'],
+                    'phone_number': row['phone_number'],
+                    'message_text': row['message_text'],
+                    'direction': row['direction'],
+                    'from': row['from_field'],
+                    'timestamp': row['timestamp'],
+                    'ts': row['ts'],
+                    'snippet': self._render_snippet(row['snippet'], mark),
+                    'score': row['score']
+                } for row in cursor.fetchall()]
                 
         except Exception as e:
-            logger.error(f"❌ Error getting messages: {e}")
+            logger.error(f"❌ Error searching messages for '{query}': {e}")
             return []
     
-    def get_messages_by_phone(self, phone_number: str, limit: int = 50) -> List[Dict]:
-        """Get messages for a specific phone number"""
+    @staticmethod
+    def _render_snippet(snippet: str, mark: Tuple[str, str]) -> str:
+        """Escape a snippet() result and only then turn its match delimiters into 'mark'"""
+        return (html.escape(snippet)
+                .replace(SNIPPET_OPEN, mark[0])
+                .replace(SNIPPET_CLOSE, mark[1]))
+    
+    def get_conversation_summaries(self, limit: int = 1000,
+                                   before: Optional[Tuple[int, str]] = None) -> List[Dict]:
+        """
+        Get one summary row per conversation, most recent first.
+        'before' is a (last_ts, phone_number) keyset cursor from the previous page.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self._reader() as conn:
                 cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
                 
-                cursor.execute('''
-                    SELECT * FROM messages 
-                    WHERE phone_number = ?
-                    ORDER BY timestamp ASC
-                    LIMIT ?
-                ''', (phone_number, limit))
+                if before:
+                    cursor.execute('''
+                        SELECT * FROM conversation_summary
+                        WHERE (last_ts, phone_number) < (?, ?)
+                        ORDER BY last_ts DESC, phone_number DESC
+                        LIMIT ?
+                    ''', (before[0], before[1], limit))
+                else:
+                    cursor.execute('''
+                        SELECT * FROM conversation_summary
+                        ORDER BY last_ts DESC, phone_number DESC
+                        LIMIT ?
+                    ''', (limit,))
                 
-                messages = []
-                for row in cursor.fetchall():
-                    message = {
-                        'id': row['id'],
-                        'phone_number': row['phone_number'],
-                        'message_text': row['message_text'],
-                        'direction': row['direction'],
-                        'from': row['from_field'],
-                        'timestamp': row['timestamp'],
-                        'session_data': json.loads(row['session_data']) if row['session_data'] else None,
-                        'created_at': row['created_at']
-                    }
-                    messages.append(message)
+                return [dict(row) for row in cursor.fetchall()]
                 
-                return messages
+        except Exception as e:
+            logger.error(f"❌ Error getting conversation summaries: {e}")
+            return []
+    
+    def get_conversation_summaries_for(self, phone_numbers: Sequence[str]) -> Dict[str, Dict]:
+        """Summary rows for the given phones, keyed by phone (phones without a summary are left out)."""
+        if not phone_numbers:
+            return {}
+        try:
+            with self._reader() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                summaries = {}
+                # Em blocos para ficar abaixo do limite de parâmetros do SQLite
+                for i in range(0, len(phone_numbers), 500):
+                    chunk = list(phone_numbers[i:i + 500])
+                    cursor.execute(f'''
+                        SELECT * FROM conversation_summary
+                        WHERE phone_number IN ({','.join('?' * len(chunk))})
+                    ''', chunk)
+                    summaries.update((row['phone_number'], dict(row)) for row in cursor.fetchall())
+                return summaries
+        except Exception as e:
+            logger.error(f"❌ Error getting conversation summaries: {e}")
+            return {}
+    
+    def get_messages(self, limit: int = 100, before: Optional[Tuple[int, int]] = None,
+                     columns: Iterable[str] = DEFAULT_MESSAGE_COLUMNS) -> List[MessageRow]:
+        """
+        Get all messages, newest first, projected to 'columns'.
+        'before' is a (ts, id) keyset cursor from the previous page.
+        """
+        return self._query_messages(None, limit, before, columns, newest_first=True)
+    
+    def get_messages_by_phone(self, phone_number: str, limit: int = 50,
+                              before: Optional[Tuple[int, int]] = None,
+                              columns: Iterable[str] = DEFAULT_MESSAGE_COLUMNS) -> List[MessageRow]:
+        """
+        Get the latest messages for a specific phone number, oldest first, projected to 'columns'.
+        'before' is a (ts, id) keyset cursor pointing at the oldest message already loaded.
+        The first page is served from the recent-messages cache when it holds enough rows;
+        older messages continue transparently from the archive files.
+        """
+        columns = tuple(columns)
+        if before or not self.recent.enabled or not set(_message_projection(columns)) <= _DEFAULT_COLUMN_MAP.keys():
+            return self._query_history(phone_number, limit, before, columns)
+        
+        rows = self.recent.get(phone_number, limit)
+        if rows is not None:
+            return rows
+        
+        # Miss: load at least a full tail so the next reads hit
+        fetch = max(limit, self.recent.size)
+        self.recent.begin_fill(phone_number)
+        rows = None
+        try:
+            rows = self._query_history(phone_number, fetch, None, DEFAULT_MESSAGE_COLUMNS)
+        finally:
+            self.recent.fill(phone_number, rows, complete=rows is not None and len(rows) < fetch)
+        return rows[-limit:] if len(rows) > limit else rows
+    
+    def _query_history(self, phone_number: str, limit: int, before: Optional[Tuple[int, int]],
+                       columns: Iterable[str]) -> List[MessageRow]:
+        """Hot messages of the phone, topped up from its archive months when the page isn't full (oldest first)"""
+        rows = self._query_messages(phone_number, limit, before, columns, newest_first=True)
+        if len(rows) < limit:
+            try:
+                with self._reader() as conn:
+                    months = [row[0] for row in conn.execute(
+                        'SELECT month FROM archive_index WHERE phone_number = ?', (phone_number,))]
+                if months:
+                    selected = _message_projection(columns)
+                    column_map = {name: i for i, name in enumerate(selected)}
+                    cursor = (rows[-1]['ts'], rows[-1]['id']) if rows else before
+                    rows += [MessageRow(column_map, values) for values in self.archive.get_messages_by_phone(
+                        phone_number, months, limit - len(rows), cursor, selected)]
+            except Exception as e:
+                logger.error(f"❌ Error reading archived messages for {phone_number}: {e}")
+        rows.reverse()
+        return rows
+    
+    def _query_messages(self, phone_number: Optional[str], limit: int, before: Optional[Tuple[int, int]],
+                        columns: Iterable[str], newest_first: bool) -> List[MessageRow]:
+        selected = _message_projection(columns)
+        conditions: List[str] = []
+        params: List = []
+        if phone_number is not None:
+            conditions.append('phone_number = ?')
+            params.append(phone_number)
+        if before:
+            conditions.append('(ts, id) < (?, ?)')
+            params += [before[0], before[1]]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        params.append(limit)
+        
+        try:
+            with self._reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT {', '.join(selected)} FROM messages
+                    {where}
+                    ORDER BY ts DESC, id DESC
+                    LIMIT ?
+                ''', params)
+                
+                rows = cursor.fetchall()
+                if not newest_first:
+                    rows.reverse()
+                column_map = {name: i for i, name in enumerate(selected)}
+                return [MessageRow(column_map, row) for row in rows]
                 
         except Exception as e:
-            logger.error(f"❌ Error getting messages for {phone_number}: {e}")
+            logger.error(f"❌ Error getting messages{f' for {phone_number}' if phone_number else ''}: {e}")
             return []
     
+    def export_rows(self, dataset: str, start_ts: Optional[int] = None, end_ts: Optional[int] = None,
+                    phone_number: Optional[str] = None) -> Iterator[tuple]:
+        """
+        Stream an export dataset (see EXPORT_DATASETS) for [start_ts, end_ts), straight from the cursor,
+        EXPORT_FETCH_ROWS at a time. Messages include the archived months, merged in (ts, id) order.
+        Runs on its own connection so a long download doesn't hold the shared ones; raises ValueError
+        for an unknown dataset before anything is read.
+        """
+        if dataset not in EXPORT_DATASETS:
+            raise ValueError(f"Unknown export dataset: {dataset}")
+        columns = EXPORT_DATASETS[dataset]
+        
+        conditions: List[str] = []
+        params: List = []
+        if dataset == 'messages':
+            key, start, end = 'ts', start_ts, end_ts
+        elif dataset == 'conversations':
+            key = 'created_at'
+            start = utc_text(start_ts) if start_ts is not None else None
+            end = utc_text(end_ts) if end_ts is not None else None
+        elif dataset == 'rollups_hourly':
+            key, start, end = 'hour_ts', start_ts, end_ts
+        else:
+            key = 'day'
+            start = local_day(start_ts) if start_ts is not None else None
+            # A day is exported when any part of it falls before end_ts
+            end = local_day(end_ts - 1) if end_ts is not None else None
+        if start is not None:
+            conditions.append(f'{key} >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append(f'{key} <= ?' if dataset == 'rollups_daily' else f'{key} < ?')
+            params.append(end)
+        if phone_number and dataset in ('messages', 'conversations'):
+            conditions.append('phone_number = ?')
+            params.append(phone_number)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        table = {'rollups_hourly': 'rollup_hourly', 'rollups_daily': 'rollup_daily'}.get(dataset, dataset)
+        order = 'ts, id' if dataset == 'messages' else key
+        
+        def hot_rows() -> Iterator[tuple]:
+            # Own connection: a slow client must not hold a pooled reader for the whole export
+            conn = self._open_connection(read_only=True)
+            try:
+                cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY {order}", params)
+                while True:
+                    rows = cursor.fetchmany(EXPORT_FETCH_ROWS)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                conn.close()
+        
+        if dataset != 'messages':
+            return hot_rows()
+        ts_index, id_index = columns.index('ts'), columns.index('id')
+        return heapq.merge(hot_rows(),
+                           self.archive.iter_range(start_ts, end_ts, phone_number, columns, EXPORT_FETCH_ROWS),
+                           key=lambda row: (row[ts_index], row[id_index]))
+    
     def get_stats(self) -> Dict:
         """Get message statistics"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._reader() as conn:
                 cursor = conn.cursor()
                 
                 # Total messages
                 cursor.execute('SELECT COUNT(*) FROM messages')
                 total_messages = cursor.fetchone()[0]
                 
-                # Messages today
+                # Messages today (local day, as a ts range)
+                today = datetime.now().astimezone().replace(hour=0, minute=0, second=0, microsecond=0)
                 cursor.execute('''
                     SELECT COUNT(*) FROM messages 
-                    WHERE DATE(timestamp) = DATE('now')
-                ''')
+                    WHERE ts >= ? AND ts < ?
+                ''', (to_epoch_ms(today.isoformat()), to_epoch_ms((today + timedelta(days=1)).isoformat())))
                 messages_today = cursor.fetchone()[0]
                 
-                # Unique phone numbers
-                cursor.execute('SELECT COUNT(DISTINCT phone_number) FROM messages')
+                # Unique phone numbers (one summary row per phone)
+                cursor.execute('SELECT COUNT(*) FROM conversation_summary')
                 unique_phones = cursor.fetchone()[0]
                 
                 # Messages by direction
@@ -288,50 +1507,40 @@ class Database:
             }
     
     def get_reporting_data(self, period: str = '24h', filters: Optional[Dict] = None) -> Dict:
-        """Get comprehensive reporting data"""
+        """Get comprehensive reporting data, answered from the hourly/daily rollups"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._reader() as conn:
                 cursor = conn.cursor()
                 
-                # Calculate date range based on period
-                now = datetime.now()
-                if period == '24h':
-                    start_date = now - timedelta(days=1)
-                elif period == '7d':
-                    start_date = now - timedelta(days=7)
-                elif period == '30d':
-                    start_date = now - timedelta(days=30)
-                elif period == '90d':
-                    start_date = now - timedelta(days=90)
+                # Calculate date range based on period: 24h reads hourly buckets, longer periods daily ones
+                now = now_ms()
+                start = now - REPORT_PERIOD_DAYS.get(period, 1) * 24 * HOUR_MS
+                if period in REPORT_PERIOD_DAYS and period != '24h':
+                    table, key_column, since = 'rollup_daily', 'day', local_day(start)
                 else:
-                    start_date = now - timedelta(days=1)
+                    table, key_column, since = 'rollup_hourly', 'hour_ts', start - start % HOUR_MS
                 
-                # Get conversation statistics
-                cursor.execute('''
+                cursor.execute(f'''
                     SELECT 
-                        COUNT(*) as total,
-                        SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) as active,
-                        SUM(CASE WHEN status = 'closed' THEN 1 ELSE 0 END) as closed,
-                        SUM(CASE WHEN transfer_count > 0 THEN 1 ELSE 0 END) as transferred
-                    FROM conversations 
-                    WHERE created_at >= ?
-                ''', (start_date.isoformat(),))
-                
-                conv_stats = cursor.fetchone()
+                        SUM(received), SUM(sent),
+                        SUM(response_time_sum), SUM(response_count)
+                    FROM {table}
+                    WHERE {key_column} >= ?
+                ''', (since,))
+                received, sent, response_time_sum, response_count = cursor.fetchone()
                 
-                # Get message statistics
+                # Conversations created in the period, by current status / transferred at least
+                # once (index-only scan of idx_conversation_created; created_at is UTC text)
                 cursor.execute('''
                     SELECT 
-                        COUNT(*) as total,
-                        SUM(CASE WHEN direction = 'received' THEN 1 ELSE 0 END) as received,
-                        SUM(CASE WHEN direction = 'sent' THEN 1 ELSE 0 END) as sent,
-                        AVG(avg_response_time) as avg_response_time
-                    FROM messages m
-                    JOIN conversations c ON m.phone_number = c.phone_number
-                    WHERE m.timestamp >= ?
-                ''', (start_date.isoformat(),))
-                
-                msg_stats = cursor.fetchone()
+                        COUNT(*),
+                        SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN status = 'closed' THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN transfer_count > 0 THEN 1 ELSE 0 END)
+                    FROM conversations
+                    WHERE created_at >= ?
+                ''', (utc_text(start),))
+                conv_total, conv_active, conv_closed, conv_transferred = cursor.fetchone()
                 
                 # Get agent performance
                 cursor.execute('''
@@ -356,39 +1565,20 @@ class Database:
                         'satisfaction': round(row[3] or 4.5, 1)
                     })
                 
-                # Get daily trends
-                cursor.execute('''
-                    SELECT 
-                        DATE(timestamp) as date,
-                        COUNT(DISTINCT phone_number) as conversations,
-                        COUNT(*) as messages
-                    FROM messages 
-                    WHERE timestamp >= ?
-                    GROUP BY DATE(timestamp)
-                    ORDER BY date DESC
-                    LIMIT 7
-                ''', (start_date.isoformat(),))
-                
-                daily_trends = []
-                for row in cursor.fetchall():
-                    daily_trends.append({
-                        'date': row[0],
-                        'conversations': row[1],
-                        'messages': row[2]
-                    })
+                avg_response_time = (response_time_sum or 0) / response_count if response_count else 0
                 
                 return {
                     'conversations': {
-                        'total': conv_stats[0] or 0,
-                        'active': conv_stats[1] or 0,
-                        'closed': conv_stats[2] or 0,
-                        'transferred': conv_stats[3] or 0
+                        'total': conv_total or 0,
+                        'active': conv_active or 0,
+                        'closed': conv_closed or 0,
+                        'transferred': conv_transferred or 0
                     },
                     'messages': {
-                        'total': msg_stats[0] or 0,
-                        'received': msg_stats[1] or 0,
-                        'sent': msg_stats[2] or 0,
-                        'avgResponseTime': f"{int(msg_stats[3] or 0)}s"
+                        'total': (received or 0) + (sent or 0),
+                        'received': received or 0,
+                        'sent': sent or 0,
+                        'avgResponseTime': f"{int(avg_response_time)}s"
                     },
                     'agents': {
                         'online': len(agents_performance),
@@ -396,9 +1586,11 @@ class Database:
                         'performance': agents_performance
                     },
                     'trends': {
-                        'daily': daily_trends,
-                        'weekly': [],  # TODO: Implement weekly aggregation
-                        'monthly': []   # TODO: Implement monthly aggregation
+                        'daily': self._get_trend(cursor, 'date', '%Y-%m-%d', local_day(start), limit=7),
+                        'weekly': self._get_trend(cursor, 'week', '%Y-W%W',
+                                                  local_day(now - TREND_WEEKS * 7 * 24 * HOUR_MS), limit=TREND_WEEKS),
+                        'monthly': self._get_trend(cursor, 'month', '%Y-%m',
+                                                   local_day(now - TREND_MONTHS * 31 * 24 * HOUR_MS), limit=TREND_MONTHS)
                     }
                 }
                 
@@ -411,54 +1603,251 @@ class Database:
                 'trends': {'daily': [], 'weekly': [], 'monthly': []}
             }
     
-    def migrate_old_messages(self, old_messages: List[Dict]) -> bool:
-        """Migrate old messages from Redis or other format"""
+    def _get_trend(self, cursor: sqlite3.Cursor, label: str, day_format: str, since: str, limit: int) -> List[Dict]:
+        """Group daily rollups by strftime(day_format, day), most recent first"""
+        cursor.execute('''
+            SELECT strftime(?, day) AS bucket, COUNT(DISTINCT phone_number)
+            FROM rollup_daily_phones
+            WHERE day >= ?
+            GROUP BY bucket
+        ''', (day_format, since))
+        phones = dict(cursor.fetchall())
+        
+        cursor.execute('''
+            SELECT strftime(?, day) AS bucket, SUM(received), SUM(sent), SUM(transfers)
+            FROM rollup_daily
+            WHERE day >= ?
+            GROUP BY bucket
+            ORDER BY bucket DESC
+            LIMIT ?
+        ''', (day_format, since, limit))
+        
+        return [{
+            label: bucket,
+            'conversations': phones.get(bucket, 0),
+            'messages': received + sent,
+            'received': received,
+            'sent': sent,
+            'transfers': transfers
+        } for bucket, received, sent, transfers in cursor.fetchall()]
+    
+    def migrate_old_messages(self, old_messages: Iterable[Dict]) -> bool:
+        """Migrate old messages from Redis or other format (see import_messages)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                for msg in old_messages:
-                    # Normalize the 'from' field
-                    from_field = msg.get('from', 'user')
-                    if from_field == 'bot':
-                        from_field = 'agent'
-                    
-                    session_data = msg.get('session_data')
-                    session_json = json.dumps(session_data) if session_data else None
-                    
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO messages 
-                        (phone_number, message_text, direction, from_field, session_data, timestamp)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        msg.get('phone_number', ''),
-                        msg.get('message_text', ''),
-                        msg.get('direction', 'received'),
-                        from_field,
-                        session_json,
-                        msg.get('timestamp', datetime.now().isoformat())
-                    ))
-                
-                conn.commit()
-                logger.info(f"✅ Migrated {len(old_messages)} messages")
-                return True
+            stats = self.import_messages(old_messages)
+            logger.info(f"✅ Migrated {stats['inserted']} messages")
+            return True
                 
         except Exception as e:
             logger.error(f"❌ Error migrating messages: {e}")
             return False
     
+    def import_messages(self, records: Iterable[Optional[Dict]], batch_size: int = IMPORT_BATCH_SIZE,
+                        progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Stream messages into the database in fixed-size batches, one transaction each. Rows already
+        stored (same phone, direction, ts and text) are skipped, so re-running an import is safe.
+        Each batch also folds its own rows into conversation_summary and the rollups, so memory,
+        transaction size and work per batch stay bounded by the batch, not by stored history.
+        Returns counters: read, inserted, duplicates, invalid.
+        """
+        stats = {'read': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0}
+        started = last_report = time.monotonic()
+        batch: List[tuple] = []
+        for msg in records:
+            stats['read'] += 1
+            row = self._import_row(msg)
+            if row is None:
+                stats['invalid'] += 1
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self._import_batch(batch, stats)
+                batch = []
+                if progress:
+                    progress(dict(stats))
+                if time.monotonic() - last_report >= IMPORT_PROGRESS_SECONDS:
+                    last_report = time.monotonic()
+                    rate = stats['read'] / (last_report - started)
+                    logger.info(f"📦 Importação: {stats['read']} lidas, {stats['inserted']} inseridas, "
+                                f"{stats['duplicates']} duplicadas ({rate:.0f} msg/s)")
+        if batch:
+            self._import_batch(batch, stats)
+            if progress:
+                progress(dict(stats))
+
+        logger.info(f"✅ Import finished in {time.monotonic() - started:.1f}s: {stats}")
+        return stats
+    
+    def import_messages_file(self, path: str, batch_size: int = IMPORT_BATCH_SIZE,
+                             progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Import an NDJSON file (optionally .gz) line by line"""
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            return self.import_messages(iter_ndjson(f), batch_size=batch_size, progress=progress)
+    
+    def _import_row(self, msg: Optional[Dict]) -> Optional[tuple]:
+        """Normalize one imported record into an INSERT row; None if it is unusable"""
+        if not msg or not msg.get('phone_number') or msg.get('message_text') is None:
+            return None
+        
+        # Normalize the 'from' field
+        from_field = msg.get('from', 'user')
+        if from_field == 'bot':
+            from_field = 'agent'
+        
+        session_data = msg.get('session_data')
+        message_text = str(msg['message_text'])
+        timestamp = msg.get('timestamp') or datetime.now(timezone.utc).isoformat()
+        return (
+            str(msg['phone_number']),
+            message_text,
+            msg.get('direction', 'received'),
+            from_field,
+            json.dumps(session_data) if session_data else None,
+            timestamp,
+            to_epoch_ms(timestamp) or now_ms(),
+            message_text_hash(message_text)
+        )
+    
+    def _import_batch(self, rows: List[tuple], stats: Dict):
+        with self._writer() as conn:
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()[0]
+            changes = conn.total_changes
+            # Natural key (phone, direction, ts, text hash), found through idx_messages_phone_ts
+            conn.executemany('''
+                INSERT INTO messages 
+                (phone_number, message_text, direction, from_field, session_data, timestamp, ts, text_hash)
+                SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM messages
+                    WHERE phone_number = ?1 AND ts = ?7 AND direction = ?3 AND text_hash = ?8
+                )
+            ''', rows)
+            inserted = conn.total_changes - changes
+            # AUTOINCREMENT ids only grow, so this batch's rows are exactly those after last_id
+            if inserted:
+                if self.fts_enabled:
+                    conn.execute('''
+                        INSERT INTO messages_fts (rowid, message_text)
+                        SELECT id, message_text FROM messages WHERE id > ?
+                    ''', (last_id,))
+                self._fold_imported_rows(conn.cursor(), last_id)
+        if inserted:
+            # Imported rows can land anywhere in a conversation's history
+            self.recent.invalidate()
+        stats['inserted'] += inserted
+        stats['duplicates'] += len(rows) - inserted
+    
+    def archive_conversations(self, older_than_days: int = ARCHIVE_AFTER_DAYS, chunk_size: int = ARCHIVE_CHUNK,
+                              max_messages: Optional[int] = None) -> Dict:
+        """
+        Move the messages of conversations idle for more than 'older_than_days' to the monthly archives.
+        Each chunk is written to the archive first and then deleted from the hot table in its own short
+        transaction, so save_message never waits for more than one chunk. A fully archived conversation
+        is closed and leaves conversation_summary; its history stays readable through get_messages_by_phone.
+        Stops after roughly 'max_messages' (None: until nothing is left). Returns counters: phones, messages.
+        'older_than_days' <= 0 disables archiving.
+        """
+        stats = {'phones': 0, 'messages': 0}
+        if older_than_days <= 0:
+            return stats
+        cutoff = now_ms() - older_than_days * 24 * HOUR_MS
+        seen = set()
+        while max_messages is None or stats['messages'] < max_messages:
+            with self._reader() as conn:
+                phones = [row[0] for row in conn.execute('''
+                    SELECT phone_number FROM conversation_summary
+                    WHERE last_ts < ?
+                    ORDER BY last_ts, phone_number
+                    LIMIT 100
+                ''', (cutoff,)) if row[0] not in seen]
+            if not phones:
+                break
+            for phone in phones:
+                seen.add(phone)
+                stats['phones'] += 1
+                stats['messages'] += self._archive_phone(phone, cutoff, chunk_size)
+                if max_messages is not None and stats['messages'] >= max_messages:
+                    break
+        
+        if stats['messages']:
+            logger.info(f"📦 {stats['messages']} messages from {stats['phones']} conversations archived")
+        return stats
+    
+    def _archive_phone(self, phone_number: str, cutoff: int, chunk_size: int) -> int:
+        archived = 0
+        while True:
+            with self._reader() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                cursor.execute('''
+                    SELECT id, phone_number, message_text, direction, from_field, timestamp, ts,
+                           session_data, created_at, text_hash
+                    FROM messages
+                    WHERE phone_number = ? AND ts < ?
+                    ORDER BY ts, id
+                    LIMIT ?
+                ''', (phone_number, cutoff, chunk_size))
+                rows = [dict(row) for row in cursor.fetchall()]
+            months = self.archive.store(rows) if rows else {}
+            
+            with self._writer() as conn:
+                cursor = conn.cursor()
+                if self.fts_enabled:
+                    self._delete_from_search_index(cursor, rows)
+                cursor.executemany('DELETE FROM messages WHERE id = ?', [(row['id'],) for row in rows])
+                cursor.executemany('''
+                    INSERT INTO archive_index (phone_number, month, messages) VALUES (?, ?, ?)
+                    ON CONFLICT(phone_number, month) DO UPDATE SET messages = messages + excluded.messages
+                ''', [(phone_number, month, count) for month, count in months.items()])
+                
+                done = len(rows) < chunk_size
+                # Close the conversation unless a new message arrived meanwhile
+                if done and not cursor.execute('SELECT 1 FROM messages WHERE phone_number = ? LIMIT 1',
+                                               (phone_number,)).fetchone():
+                    cursor.execute('DELETE FROM conversation_summary WHERE phone_number = ?', (phone_number,))
+                    cursor.execute('''
+                        UPDATE conversations SET status = 'closed', closed_at = CURRENT_TIMESTAMP
+                        WHERE phone_number = ? AND status = 'active'
+                    ''', (phone_number,))
+            
+            archived += len(rows)
+            if rows:
+                self.recent.invalidate(phone_number)
+            if done:
+                return archived
+    
+    def purge_archives(self, older_than_days: int = ARCHIVE_PURGE_AFTER_DAYS) -> List[str]:
+        """Delete the archive months that ended more than 'older_than_days' ago (retention limit)"""
+        cutoff_month = archive_month(now_ms() - older_than_days * 24 * HOUR_MS)
+        purged = self.archive.purge(before_month=cutoff_month)
+        if purged:
+            with self._writer() as conn:
+                conn.execute('DELETE FROM archive_index WHERE month < ?', (cutoff_month,))
+        return purged
+    
     def clear_messages(self) -> bool:
         """Clear all messages (for testing)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._writer() as conn:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM messages')
                 cursor.execute('DELETE FROM conversations')
                 cursor.execute('DELETE FROM conversation_metrics')
-                conn.commit()
-                logger.info("✅ All messages cleared")
-                return True
-                
+                cursor.execute('DELETE FROM conversation_summary')
+                for table in ('rollup_hourly', 'rollup_daily', 'rollup_hourly_phones', 'rollup_daily_phones'):
+                    cursor.execute(f'DELETE FROM {table}')
+                cursor.execute('DELETE FROM archive_index')
+                if self.fts_enabled:
+                    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')")
+                    if self._fts_rebuilt_upto:
+                        cursor.execute("INSERT INTO messages_fts_rebuild (messages_fts_rebuild) VALUES ('delete-all')")
+            self.archive.purge()
+            self.recent.invalidate()
+            logger.info("✅ All messages cleared")
+            return True
+            
         except Exception as e:
             logger.error(f"❌ Error clearing messages: {e}")
             return False
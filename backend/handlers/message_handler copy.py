@@ -3,7 +3,7 @@ import re
 import time
 import requests
 from clients.openai_client import chat_with_functions
-from session_store import get_session, set_session
+from session_store import get_session, update_session
 from clinicaagil_client import call
 
 SAUDACOES = ["oi", "olá", "ola", "bom dia", "boa tarde", "boa noite"]
@@ -277,6 +277,6 @@ def handle_message(from_number: str, text: str) -> str:
 
     session_data["dados"] = dados
     session_data["ultima_resposta_ts"] = time.time()
-    set_session(from_number, session_data)
+    update_session(from_number, lambda sessao: sessao.update(session_data))
 
     return resposta
@@ -1,7 +1,9 @@
 import json
 import time
 import re
-from session_store import get_session, set_session, acquire_lock, release_lock
+from session_store import lock_and_load, save_and_unlock, release_lock, LOCK_TTL_SECONDS
+from database import db
+from realtime import publish_conversation
 from handlers.etapa_inicio import process as etapa_inicio
 from handlers.etapa_perguntar_unidade import process as etapa_perguntar_unidade
 from handlers.etapa_perguntar_procedimento import process as etapa_perguntar_procedimento
@@ -113,12 +115,15 @@ def analisar_intencao_resposta(texto: str, etapa_atual: str) -> tuple[str | None
 def handle_message(from_number: str, text: str) -> str:
     from_number = normalizar_numero(from_number)
     
-    if not acquire_lock(from_number):
-        print(f"🔒 Mensagem de {from_number} ignorada, uma requisição anterior está em andamento.")
+    # Aguarda a vez em vez de descartar a mensagem; a trava expira sozinha após LOCK_TTL_SECONDS.
+    # Trava e sessão vêm juntas em uma única ida ao Redis.
+    token, session_data = lock_and_load(from_number, wait_seconds=LOCK_TTL_SECONDS)
+    if not token:
+        print(f"🔒 Mensagem de {from_number} ignorada, a trava não foi liberada a tempo.")
         return "" 
 
+    saved = False
     try:
-        session_data = get_session(from_number)
         session_data["from_number"] = from_number
         texto_processado = text.strip().lower()
 
@@ -180,17 +185,28 @@ def handle_message(from_number: str, text: str) -> str:
                 dados_atuais["agendamento"] = agendamento
 
         funcao_etapa = ETAPAS_MAPEAMENTO.get(etapa_atual, etapa_padrao)
+        ja_transferido = bool(dados_atuais.get("transferido_humano"))
         resposta, dados_atualizados, proxima_etapa = funcao_etapa(texto_processado, dados_atuais, session_data)
 
+        # Conta a transferência bot → humano nos relatórios
+        transferido_agora = not ja_transferido and bool(dados_atualizados.get("transferido_humano"))
+        if transferido_agora:
+            db.record_transfer(from_number)
+
         session_data["dados"] = dados_atualizados
         session_data["etapa"] = proxima_etapa
         if resposta:
             session_data["historico"].append({"role": "assistant", "content": resposta})
             session_data["historico"] = session_data["historico"][-6:]
         
-        set_session(from_number, session_data)
+        # Grava a sessão e libera a trava juntos
+        saved = save_and_unlock(from_number, token, session_data)
+        if saved and transferido_agora:
+            # A gravação já pôs a conversa na fila global; o painel é avisado sem recarregar
+            publish_conversation(from_number, {'transferido_humano': True, 'atribuido_para': None})
         return resposta
 
     finally:
-        print(f"🔓 Liberando trava para {from_number}")
-        release_lock(from_number)
+        if not saved:
+            print(f"🔓 Liberando trava para {from_number}")
+            release_lock(from_number, token)
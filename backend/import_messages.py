@@ -0,0 +1,32 @@
+"""
+Importa mensagens antigas de um arquivo NDJSON (uma mensagem JSON por linha, .gz aceito).
+
+Uso: python import_messages.py arquivo.ndjson [--batch-size N]
+     python import_messages.py - < arquivo.ndjson
+
+Campos por linha: phone_number, message_text, direction, from, timestamp, session_data.
+Mensagens já existentes (mesmo telefone, direção, horário e texto) são ignoradas.
+"""
+import argparse
+import logging
+import sys
+
+from database import db, iter_ndjson, IMPORT_BATCH_SIZE
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Importa mensagens de um arquivo NDJSON")
+    parser.add_argument("path", help="arquivo .ndjson/.ndjson.gz, ou - para ler da entrada padrão")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+                        help="mensagens por transação (padrão: %(default)s)")
+    args = parser.parse_args()
+
+    def progress(stats):
+        print(f"\r📦 {stats['read']} lidas | {stats['inserted']} inseridas | "
+              f"{stats['duplicates']} duplicadas | {stats['invalid']} inválidas", end="", flush=True)
+
+    if args.path == "-":
+        stats = db.import_messages(iter_ndjson(sys.stdin), batch_size=args.batch_size, progress=progress)
+    else:
+        stats = db.import_messages_file(args.path, batch_size=args.batch_size, progress=progress)
+    print(f"\n✅ Importação concluída: {stats}")
@@ -0,0 +1,172 @@
+import os
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Intervalo de flush do broadcaster: eventos acumulados na janela saem juntos
+# na borda final, limitando a taxa de emissões sem nunca perder a última atualização.
+REALTIME_FLUSH_MS = int(os.getenv("REALTIME_FLUSH_MS", 150))
+# Máximo de conversas no mapa de sequências; acima disso sai a usada há mais tempo (LRU)
+REALTIME_SEQ_MAX_CONVERSATIONS = int(os.getenv("REALTIME_SEQ_MAX_CONVERSATIONS", 50000))
+
+# Instância do SocketIO registrada pelo app
+socketio = None
+
+def init_socketio(sio) -> None:
+    global socketio
+    socketio = sio
+
+class Broadcaster:
+    """
+    Acumula as conversas alteradas e as envia em lote a cada REALTIME_FLUSH_MS.
+
+    Cada conversa tem um número de sequência, atribuído no flush: o painel aplica
+    os eventos em ordem e, ao detectar um salto, recarrega a lista via /api/messages.
+    Cada lote leva o 'epoch' deste processo, então um restart é visto pela troca do
+    epoch, sem depender das sequências. O mapa guarda até REALTIME_SEQ_MAX_CONVERSATIONS
+    conversas (LRU); uma conversa que saiu dele recomeça no instante atual em ms, não
+    em 1, para o painel ver um salto em vez de descartar os eventos como já aplicados.
+    Mensagens novas são sempre enviadas uma a uma; mudanças de resumo da mesma
+    conversa dentro da janela são mescladas em um único 'conversation_update'.
+    """
+
+    def __init__(self, flush_ms: int = REALTIME_FLUSH_MS, max_seqs: int = REALTIME_SEQ_MAX_CONVERSATIONS):
+        self.interval = flush_ms / 1000
+        self.max_seqs = max_seqs
+        self.epoch = uuid.uuid4().hex
+        self._cond = threading.Condition()
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        # conversation_id -> último seq, do uso mais antigo ao mais recente
+        self._seqs: "OrderedDict[str, int]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+
+        # Métricas
+        self._flushes = 0
+        self._events = 0
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="realtime-broadcaster", daemon=True)
+            self._thread.start()
+
+    def _mark(self, conversation_id: str) -> Dict[str, Any]:
+        self._start()
+        entry = self._dirty.get(conversation_id)
+        if entry is None:
+            entry = self._dirty[conversation_id] = {'messages': [], 'changes': {}}
+            self._cond.notify()
+        return entry
+
+    def add_message(self, conversation_id: str, message: Dict[str, Any]) -> None:
+        with self._cond:
+            self._mark(conversation_id)['messages'].append(message)
+
+    def add_changes(self, conversation_id: str, changes: Dict[str, Any]) -> None:
+        with self._cond:
+            self._mark(conversation_id)['changes'].update(changes)
+
+    def get_seq(self, conversation_id: str) -> int:
+        with self._cond:
+            return self._touch(conversation_id)
+
+    def _touch(self, conversation_id: str) -> int:
+        seq = self._seqs.get(conversation_id)
+        if seq is None:
+            seq = self._seqs[conversation_id] = int(time.time() * 1000)
+        self._seqs.move_to_end(conversation_id)
+        return seq
+
+    def _prune_seqs(self) -> None:
+        while len(self._seqs) > self.max_seqs:
+            self._seqs.popitem(last=False)
+
+    def reset(self) -> None:
+        with self._cond:
+            self._dirty.clear()
+            self._seqs.clear()
+            _emit('conversations_reset', {})
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._dirty:
+                    self._cond.wait()
+            # Borda final: espera a janela fechar antes de enviar o que acumulou
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self) -> None:
+        with self._cond:
+            dirty, self._dirty = self._dirty, {}
+            events: List[Dict[str, Any]] = []
+            for conversation_id, entry in dirty.items():
+                for message in entry['messages']:
+                    events.append(self._event('message_new', conversation_id, message=message))
+                if entry['changes']:
+                    events.append(self._event('conversation_update', conversation_id, changes=entry['changes']))
+            self._prune_seqs()
+            if events:
+                self._flushes += 1
+                self._events += len(events)
+                # Emite dentro do lock para que lotes consecutivos saiam em ordem de sequência
+                _emit('realtime_batch', {'epoch': self.epoch, 'events': events})
+
+    def _event(self, event_type: str, conversation_id: str, **payload) -> Dict[str, Any]:
+        seq = self._seqs[conversation_id] = self._touch(conversation_id) + 1
+        return {'type': event_type, 'conversation_id': conversation_id, 'seq': seq, **payload}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'epoch': self.epoch,
+                'flush_interval_ms': int(self.interval * 1000),
+                'dirty_conversations': len(self._dirty),
+                'tracked_sequences': len(self._seqs),
+                'flushes': self._flushes,
+                'events': self._events,
+            }
+
+def _emit(event: str, payload: Dict[str, Any]) -> None:
+    if not socketio:
+        return
+    try:
+        socketio.emit(event, payload)
+    except Exception as e:
+        logger.error(f"❌ Erro ao emitir '{event}' via WebSocket: {e}")
+
+broadcaster = Broadcaster()
+
+def get_epoch() -> str:
+    """Identificador deste processo do servidor, enviado com cada lote de eventos."""
+    return broadcaster.epoch
+
+def get_seq(conversation_id: str) -> int:
+    """Último número de sequência emitido para a conversa."""
+    return broadcaster.get_seq(conversation_id)
+
+def publish_message(phone_number: str, message_id: Optional[int], message_text: str,
+                    direction: str, from_field: str, timestamp: str) -> None:
+    """Agenda o envio apenas da nova mensagem da conversa ('message_new')."""
+    broadcaster.add_message(phone_number, {
+        'id': message_id,
+        'from': from_field,
+        'text': message_text,
+        'timestamp': timestamp,
+        'direction': direction
+    })
+
+def publish_conversation(phone_number: str, changes: Dict[str, Any]) -> None:
+    """Agenda o envio dos campos alterados do resumo da conversa ('conversation_update')."""
+    broadcaster.add_changes(phone_number, changes)
+
+def publish_reset() -> None:
+    """Avisa o painel que o estado mudou em massa e deve ser recarregado."""
+    broadcaster.reset()
+
+def get_broadcaster_stats() -> Dict[str, Any]:
+    return broadcaster.stats()
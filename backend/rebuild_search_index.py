@@ -0,0 +1,22 @@
+"""
+Reconstrói o índice de busca (messages_fts) a partir da tabela messages.
+
+Uso: python rebuild_search_index.py [--chunk-size N]
+"""
+import argparse
+import logging
+
+from database import db, FTS_REBUILD_CHUNK
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Reconstrói o índice de busca full-text das mensagens")
+    parser.add_argument("--chunk-size", type=int, default=FTS_REBUILD_CHUNK,
+                        help="mensagens por transação (padrão: %(default)s)")
+    args = parser.parse_args()
+
+    if not db.fts_enabled:
+        print("❌ FTS5 não está disponível neste SQLite")
+    else:
+        total = db.rebuild_search_index(chunk_size=args.chunk_size)
+        print(f"✅ Índice de busca reconstruído: {total} mensagens")
@@ -0,0 +1,95 @@
+import os
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from database import db, ARCHIVE_AFTER_DAYS, ARCHIVE_PURGE_AFTER_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Intervalo entre execuções do arquivamento em background
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", 3600))
+
+class RetentionJob:
+    """
+    Roda periodicamente o arquivamento das conversas inativas e o expurgo dos
+    arquivos fora da retenção. Cada execução trabalha em blocos pequenos
+    (ARCHIVE_CHUNK mensagens por transação), então nunca segura o writer.
+    """
+
+    def __init__(self, interval_seconds: int = ARCHIVE_INTERVAL_SECONDS,
+                 archive_after_days: int = ARCHIVE_AFTER_DAYS,
+                 purge_after_days: int = ARCHIVE_PURGE_AFTER_DAYS):
+        self.interval = interval_seconds
+        self.archive_after_days = archive_after_days
+        self.purge_after_days = purge_after_days
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        # Métricas
+        self._runs = 0
+        self._failures = 0
+        self._archived_messages = 0
+        self._archived_phones = 0
+        self._purged_months = 0
+        self._last_run: Optional[float] = None
+        self._last_duration = 0.0
+
+    def start(self) -> None:
+        if self.archive_after_days <= 0:
+            logger.info("📦 Arquivamento de mensagens desativado (ARCHIVE_AFTER_DAYS=0)")
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="message-retention", daemon=True)
+                self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            self.run_once()
+            time.sleep(self.interval)
+
+    def run_once(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        result: Dict[str, Any] = {'phones': 0, 'messages': 0, 'purged': []}
+        try:
+            result.update(db.archive_conversations(older_than_days=self.archive_after_days))
+            if self.purge_after_days > 0:
+                result['purged'] = db.purge_archives(older_than_days=self.purge_after_days)
+        except Exception as e:
+            logger.error(f"❌ Erro no arquivamento de mensagens: {e}")
+            with self._lock:
+                self._failures += 1
+        with self._lock:
+            self._runs += 1
+            self._archived_messages += result['messages']
+            self._archived_phones += result['phones']
+            self._purged_months += len(result['purged'])
+            self._last_run = time.time()
+            self._last_duration = time.monotonic() - started
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'archive_after_days': self.archive_after_days,
+                'purge_after_days': self.purge_after_days,
+                'interval_seconds': self.interval,
+                'runs': self._runs,
+                'failures': self._failures,
+                'archived_messages': self._archived_messages,
+                'archived_phones': self._archived_phones,
+                'purged_months': self._purged_months,
+                'last_run': self._last_run,
+                'last_duration_ms': round(self._last_duration * 1000, 1),
+                'archive': db.archive.stats(),
+            }
+
+retention_job = RetentionJob()
+
+def start_retention() -> None:
+    retention_job.start()
+
+def get_retention_stats() -> Dict[str, Any]:
+    return retention_job.stats()
@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Near-cache das sessões: até N sessões decodificadas em memória (LRU, 0 desativa),
+# cada uma servida por no máximo SESSION_CACHE_TTL_SECONDS como rede de segurança
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 1000))
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", 30))
+SESSION_INVALIDATION_CHANNEL = os.getenv("SESSION_INVALIDATION_CHANNEL", "sessao_user:invalidate")
+SESSION_INVALIDATION_RETRY_SECONDS = 5
+
+def clone_session(value: Any) -> Any:
+    """Cópia profunda de dados JSON (dict/list/escalares), mais rápida que copy.deepcopy."""
+    if isinstance(value, dict):
+        return {k: clone_session(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [clone_session(v) for v in value]
+    return value
+
+class SessionNearCache:
+    """
+    Cache LRU em processo das sessões do Redis. As gravações deste processo
+    atualizam o cache e publicam o id do usuário em SESSION_INVALIDATION_CHANNEL
+    (no próprio script de gravação do session_store, sem ida extra ao Redis);
+    os outros processos descartam a entrada ao receber a mensagem.
+
+    Enquanto a assinatura do canal não está ativa o cache é ignorado (leituras vão
+    direto ao Redis), e ao (re)conectar ele é esvaziado: uma invalidação perdida
+    nunca deixa uma sessão velha em uso. Quem recebe a sessão ganha uma cópia,
+    então alterações só chegam ao cache pelas gravações do session_store.
+    """
+
+    def __init__(self, client, size: int = SESSION_CACHE_SIZE, ttl_seconds: float = SESSION_CACHE_TTL_SECONDS,
+                 channel: str = SESSION_INVALIDATION_CHANNEL):
+        self.client = client
+        self.size = size
+        self.ttl = ttl_seconds
+        self.channel = channel
+        self.instance_id = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # user_id -> (sessão, cached_at)
+        self._filling: Dict[str, List] = {}  # user_id -> [leituras em andamento, invalidada no meio]
+        self._subscribed = False
+        self._thread: Optional[threading.Thread] = None
+
+        # Métricas
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expired = 0
+        self._invalidations_sent = 0
+        self._invalidations_received = 0
+        self._hit_age_total = 0.0
+        self._hit_age_max = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name="session-invalidation", daemon=True)
+                self._thread.start()
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Cópia da sessão em cache, ou None (ausente, expirada ou cache inativo)."""
+        if not self.enabled:
+            return None
+        self._start()
+        with self._lock:
+            entry = self._entries.get(user_id) if self._subscribed else None
+            if entry is not None:
+                age = time.monotonic() - entry[1]
+                if age <= self.ttl:
+                    self._entries.move_to_end(user_id)
+                    self._hits += 1
+                    self._hit_age_total += age
+                    self._hit_age_max = max(self._hit_age_max, age)
+                    session = entry[0]
+                else:
+                    del self._entries[user_id]
+                    self._expired += 1
+                    session = None
+            else:
+                session = None
+            if session is None:
+                self._misses += 1
+                return None
+        return clone_session(session)
+
+    def begin_fill(self, user_id: str) -> None:
+        """Marca uma leitura do Redis em andamento; chame fill() com o resultado."""
+        with self._lock:
+            self._filling.setdefault(user_id, [0, False])[0] += 1
+
+    def fill(self, user_id: str, session: Optional[Dict[str, Any]]) -> None:
+        """Guarda a sessão lida após begin_fill, a menos que ela tenha sido invalidada no meio."""
+        with self._lock:
+            pending = self._filling[user_id]
+            pending[0] -= 1
+            if pending[0] == 0:
+                del self._filling[user_id]
+            if session is not None and not pending[1]:
+                self._put(user_id, clone_session(session))
+
+    def invalidation_message(self, user_id: str) -> str:
+        """Mensagem de invalidação para publicar junto com a gravação ('' com o cache inativo)."""
+        return f"{self.instance_id}:{user_id}" if self.enabled else ''
+
+    def write(self, user_id: str, session: Dict[str, Any], published: bool = False) -> None:
+        """
+        Write-through de uma gravação deste processo: atualiza o cache e avisa os demais
+        ('published' quando a invalidation_message já saiu junto com a gravação).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._mark_invalidated(user_id)
+            self._put(user_id, clone_session(session))
+        self._notify(user_id, published)
+
+    def invalidate(self, user_id: str, published: bool = False) -> None:
+        """Descarta a sessão aqui e nos outros processos (gravação sem o valor final em mãos)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._drop(user_id)
+        self._notify(user_id, published)
+
+    def _put(self, user_id: str, session: Dict[str, Any]) -> None:
+        if not self._subscribed:
+            return
+        self._entries[user_id] = (session, time.monotonic())
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _drop(self, user_id: str) -> None:
+        self._entries.pop(user_id, None)
+        self._mark_invalidated(user_id)
+
+    def _mark_invalidated(self, user_id: str) -> None:
+        if user_id in self._filling:
+            self._filling[user_id][1] = True
+
+    def _notify(self, user_id: str, published: bool) -> None:
+        try:
+            if not published:
+                self.client.publish(self.channel, self.invalidation_message(user_id))
+            with self._lock:
+                self._invalidations_sent += 1
+        except Exception as e:
+            print(f"❌ Erro ao publicar invalidação da sessão de {user_id}: {e}")
+
+    def _listen(self) -> None:
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                with self._lock:
+                    # O que chegou antes da assinatura pode ter sido perdido
+                    self._entries.clear()
+                    for pending in self._filling.values():
+                        pending[1] = True
+                    self._subscribed = True
+                for message in pubsub.listen():
+                    data = message.get('data')
+                    if isinstance(data, bytes):
+                        data = data.decode('utf-8')
+                    if not isinstance(data, str):
+                        continue
+                    sender, _, user_id = data.partition(':')
+                    if sender == self.instance_id:
+                        continue
+                    with self._lock:
+                        self._invalidations_received += 1
+                        self._drop(user_id)
+            except Exception as e:
+                print(f"❌ Canal de invalidação de sessões indisponível: {e}")
+            finally:
+                with self._lock:
+                    self._subscribed = False
+                    self._entries.clear()
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            time.sleep(SESSION_INVALIDATION_RETRY_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': self.size,
+                'entries': len(self._entries),
+                'subscribed': self._subscribed,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 3) if lookups else 0,
+                'evictions': self._evictions,
+                'expired': self._expired,
+                'invalidations_sent': self._invalidations_sent,
+                'invalidations_received': self._invalidations_received,
+                'avg_hit_age_ms': round(self._hit_age_total / self._hits * 1000, 1) if self._hits else 0,
+                'max_hit_age_ms': round(self._hit_age_max * 1000, 1),
+            }
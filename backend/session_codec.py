@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import zlib
+from typing import Any, Callable, Dict, Tuple
+
+try:
+    import msgpack
+except ImportError:  # só é exigido com SESSION_CODEC=msgpack (o padrão, ver requirements.txt)
+    msgpack = None
+
+# Formato das sessões gravadas no Redis ('json' ou 'msgpack') e tamanho a partir
+# do qual o payload é comprimido com zlib (0 desativa a compressão)
+SESSION_CODEC = os.getenv("SESSION_CODEC", "msgpack")
+SESSION_COMPRESS_MIN_BYTES = int(os.getenv("SESSION_COMPRESS_MIN_BYTES", 1024))
+SESSION_COMPRESS_LEVEL = int(os.getenv("SESSION_COMPRESS_LEVEL", 6))
+
+# Byte de versão no início do valor: tag do formato nos bits baixos e FLAG_ZLIB
+# quando comprimido. Sessões antigas (JSON puro, começam com '{') não têm o
+# byte e continuam sendo lidas.
+TAG_JSON = 0x01
+TAG_MSGPACK = 0x02
+FLAG_ZLIB = 0x80
+LEGACY_JSON_START = ord('{')
+
+def _json_dumps(data: Any) -> bytes:
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+CODECS: Dict[str, Tuple[int, Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    'json': (TAG_JSON, _json_dumps, json.loads),
+}
+if msgpack:
+    CODECS['msgpack'] = (
+        TAG_MSGPACK,
+        lambda data: msgpack.packb(data, use_bin_type=True),
+        lambda raw: msgpack.unpackb(raw, raw=False, strict_map_key=False),
+    )
+
+class SessionCodec:
+    """
+    Serializa as sessões para o Redis com o codec configurado e comprime com
+    zlib as que passam de 'compress_min_bytes'. A leitura segue o byte de
+    versão, então valores gravados com outro codec (ou no JSON antigo) ainda
+    são decodificados.
+    """
+
+    def __init__(self, name: str = SESSION_CODEC, compress_min_bytes: int = SESSION_COMPRESS_MIN_BYTES):
+        # Falha já na inicialização: um worker que não lê o formato dos outros veria
+        # as sessões deles como corrompidas
+        if name not in CODECS:
+            raise RuntimeError(f"Codec de sessão '{name}' indisponível (SESSION_CODEC); "
+                               f"instale as dependências de requirements.txt ou use 'json'")
+        self.name = name
+        self.tag, self._dumps, _ = CODECS[name]
+        self.compress_min_bytes = compress_min_bytes
+        self._loads = {tag: loads for tag, _, loads in CODECS.values()}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._encoded = 0
+        self._compressed = 0
+        self._payload_bytes = 0
+        self._stored_bytes = 0
+
+    def encode(self, data: Any) -> bytes:
+        payload = self._dumps(data)
+        header = self.tag
+        body = payload
+        if self.compress_min_bytes and len(payload) >= self.compress_min_bytes:
+            compressed = zlib.compress(payload, SESSION_COMPRESS_LEVEL)
+            if len(compressed) < len(payload):
+                header |= FLAG_ZLIB
+                body = compressed
+        value = bytes([header]) + body
+        with self._lock:
+            self._encoded += 1
+            self._compressed += bool(header & FLAG_ZLIB)
+            self._payload_bytes += len(payload)
+            self._stored_bytes += len(value)
+        return value
+
+    def decode(self, raw: bytes) -> Any:
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        header = raw[0]
+        if header == LEGACY_JSON_START:
+            return json.loads(raw)
+        body = raw[1:]
+        if header & FLAG_ZLIB:
+            body = zlib.decompress(body)
+        loads = self._loads.get(header & ~FLAG_ZLIB)
+        if loads is None:
+            raise ValueError(f"formato de sessão desconhecido (byte de versão 0x{header:02x})")
+        return loads(body)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'codec': self.name,
+                'compress_min_bytes': self.compress_min_bytes,
+                'encoded': self._encoded,
+                'compressed': self._compressed,
+                'avg_payload_bytes': round(self._payload_bytes / self._encoded) if self._encoded else 0,
+                'avg_stored_bytes': round(self._stored_bytes / self._encoded) if self._encoded else 0,
+            }
+
+codec = SessionCodec()
+
+def get_codec_stats() -> Dict[str, Any]:
+    return codec.stats()
@@ -1,106 +1,705 @@
 import redis
-import json
 import os
-from typing import Dict, Any, Optional
-from collections.abc import Iterable
+import secrets
+import time
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
+
+from session_codec import codec
+from session_cache import SessionNearCache
 
 # Define prefixos para organizar as chaves no Redis
 SESSION_PREFIX = "sessao_user:"
 LOCK_PREFIX = "lock:sessao_user:" 
+# Sorted set telefone → última atividade (epoch s), mantido a cada gravação de sessão
+SESSION_REGISTRY_KEY = "sessoes_ativas"
+# Fila humana, derivada de dados.transferido_humano/atribuido_para/prioridade a cada gravação:
+# hash telefone → atendente ('' = sem atendente) das conversas transferidas, hash telefone →
+# "prioridade:entrada em ms", sorted set da fila global (transferidas sem atendente) e um
+# set de telefones por atendente. O score da fila global é a faixa da prioridade mais a
+# entrada, então o ZPOPMIN entrega a de maior prioridade e, dentro dela, a mais antiga.
+QUEUE_STATE_KEY = "fila_humana:estado"
+QUEUE_ENTRY_KEY = "fila_humana:entrada"
+QUEUE_GLOBAL_KEY = "fila_humana:global"
+QUEUE_AGENT_PREFIX = "fila_humana:atendente:"
+QUEUE_INDEX_MARKER = "fila_humana:indexada"
+QUEUE_MAX_PRIORITY = 9
+QUEUE_PRIORITY_BAND = 10 ** 13  # maior que qualquer epoch em ms, exato em double até a faixa 9
+
+# Cada sessão é um hash: um campo por chave de primeiro nível (etapa, historico, ...),
+# um campo "dados.<chave>" por subseção de dados, cada um codificado pelo codec, e o
+# contador de versão "_v", incrementado a cada gravação. A versão volta no dicionário
+# da sessão em SESSION_VERSION_KEY e serve de checagem otimista em update_session.
+SESSION_VERSION_FIELD = "_v"
+SESSION_VERSION_KEY = "_versao"
+DADOS_FIELD_PREFIX = "dados."
+SESSION_UPDATE_RETRIES = 5
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+# Sessões são gravadas em binário (byte de versão + payload), então usam um cliente sem decode
+session_client = redis.Redis.from_url(REDIS_URL)
+
+# Cache em processo das sessões, invalidado entre processos via pub/sub
+session_cache = SessionNearCache(redis_client)
 
 # Define a duração da sessão (8 horas) e da trava (25 segundos)
 SESSION_TTL_SECONDS = 8 * 60 * 60
 LOCK_TTL_SECONDS = 25
+LOCK_RETRY_INTERVAL_SECONDS = 0.05
+
+# Chaves por SCAN/MGET nas varreduras completas de sessões
+SESSION_SCAN_BATCH = 500
+
+# Leitura da sessão: {'h', campo, valor, ...} para o hash, {'s', valor} para o formato
+# antigo (um único valor serializado) ou {} se não existir
+_LOAD_LUA = """
+local function load_session(key)
+    local kind = redis.call('TYPE', key).ok
+    if kind == 'hash' then
+        local fields = redis.call('HGETALL', key)
+        table.insert(fields, 1, 'h')
+        return fields
+    elseif kind == 'string' then
+        return {'s', redis.call('GET', key)}
+    end
+    return {}
+end
+"""
+
+# KEYS: sessão → ver _LOAD_LUA
+_LOAD = session_client.register_script(_LOAD_LUA + """
+return load_session(KEYS[1])
+""")
+
+# Trava + leitura da sessão em uma única ida ao Redis.
+# KEYS: trava, sessão | ARGV: token, TTL da trava → {1, <leitura>} ou {0}
+_LOCK_AND_LOAD = session_client.register_script(_LOAD_LUA + """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    local loaded = load_session(KEYS[2])
+    table.insert(loaded, 1, 1)
+    return loaded
+end
+return {0}
+""")
+
+# Atualiza os índices da fila humana para um telefone (trecho comum aos scripts abaixo).
+# O set do atendente anterior vem do próprio hash; as chaves por atendente não são
+# declaradas em KEYS, o que exige Redis standalone (sem Cluster), como o resto do módulo.
+_INDEX_QUEUE_LUA = """
+local AGENT_PREFIX = '""" + QUEUE_AGENT_PREFIX + """'
+local MAX_PRIORITY = """ + str(QUEUE_MAX_PRIORITY) + """
+local PRIORITY_BAND = """ + str(QUEUE_PRIORITY_BAND) + """
+local function queue_score(entry)
+    local priority, enqueued = string.match(entry, '^(%d+):(%d+)$')
+    return (MAX_PRIORITY - tonumber(priority)) * PRIORITY_BAND + tonumber(enqueued)
+end
+local function now_ms(now)
+    return string.format('%d', math.floor(tonumber(now) * 1000))
+end
+-- Mantém a entrada (e o lugar na fila) enquanto a conversa continuar transferida
+local function queue_entry(entry_key, phone, priority, now)
+    local entry = redis.call('HGET', entry_key, phone)
+    local enqueued = entry and string.match(entry, ':(%d+)$') or now_ms(now)
+    entry = priority .. ':' .. enqueued
+    redis.call('HSET', entry_key, phone, entry)
+    return entry
+end
+local function index_queue(state_key, global_key, entry_key, phone, transferred, assignee, priority, now)
+    local previous = redis.call('HGET', state_key, phone)
+    if previous and previous ~= '' and (transferred ~= '1' or previous ~= assignee) then
+        redis.call('SREM', AGENT_PREFIX .. previous, phone)
+    end
+    if transferred == '1' then
+        local entry = queue_entry(entry_key, phone, priority, now)
+        redis.call('HSET', state_key, phone, assignee)
+        if assignee == '' then
+            redis.call('ZADD', global_key, queue_score(entry), phone)
+        else
+            redis.call('SADD', AGENT_PREFIX .. assignee, phone)
+            redis.call('ZREM', global_key, phone)
+        end
+    else
+        redis.call('HDEL', state_key, phone)
+        redis.call('HDEL', entry_key, phone)
+        redis.call('ZREM', global_key, phone)
+    end
+end
+"""
+
+# Gravação parcial da sessão + versão + registro de atividade + índices da fila +
+# invalidação do near-cache, e liberação da trava quando houver token. Um valor no
+# formato antigo só é trocado pelo hash numa gravação completa; a gravação parcial
+# recebe conflito e relê.
+# Com token, a versão esperada (a lida com a trava) só é conferida se a trava expirou
+# no meio do turno (sem outro dono, a gravação vale se ninguém gravou a sessão depois)
+# ou numa gravação completa, que apagaria os campos gravados pelo painel no meio.
+# A gravação completa mantém a contagem de "_v", que nunca volta atrás.
+# KEYS: sessão, registro, estado da fila, fila global, trava, entradas da fila
+# ARGV: token ('' = sem trava), versão esperada ('' = sem checagem), completa ('1' apaga
+#       os campos antigos), TTL, usuário, agora (s), transferida ('1'/'0'/'' = índices
+#       inalterados), atendente, prioridade, canal de invalidação, mensagem ('' = não
+#       publica), n, n pares campo/valor, campos removidos...
+# → nova versão, 0 em conflito de versão ou -1 se a trava é de outro token
+_WRITE = session_client.register_script(_INDEX_QUEUE_LUA + """
+local check_version = ARGV[2] ~= ''
+if ARGV[1] ~= '' then
+    local holder = redis.call('GET', KEYS[5])
+    if holder and holder ~= ARGV[1] then
+        return -1
+    end
+    check_version = check_version and (not holder or ARGV[3] == '1')
+end
+local kind = redis.call('TYPE', KEYS[1]).ok
+if check_version then
+    local current = '0'
+    if kind == 'hash' then
+        current = redis.call('HGET', KEYS[1], '""" + SESSION_VERSION_FIELD + """') or '0'
+    end
+    if current ~= ARGV[2] then
+        return 0
+    end
+end
+if ARGV[3] == '1' then
+    local previous = kind == 'hash' and redis.call('HGET', KEYS[1], '""" + SESSION_VERSION_FIELD + """')
+    redis.call('DEL', KEYS[1])
+    if previous then
+        redis.call('HSET', KEYS[1], '""" + SESSION_VERSION_FIELD + """', previous)
+    end
+elseif kind == 'string' then
+    return 0
+end
+local n = tonumber(ARGV[12])
+for i = 13, 12 + 2 * n, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+for i = 13 + 2 * n, #ARGV do
+    redis.call('HDEL', KEYS[1], ARGV[i])
+end
+local version = redis.call('HINCRBY', KEYS[1], '""" + SESSION_VERSION_FIELD + """', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('ZADD', KEYS[2], ARGV[6], ARGV[5])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', '(' .. (tonumber(ARGV[6]) - tonumber(ARGV[4])))
+if ARGV[7] ~= '' then
+    index_queue(KEYS[3], KEYS[4], KEYS[6], ARGV[5], ARGV[7], ARGV[8], ARGV[9], ARGV[6])
+end
+if ARGV[1] ~= '' then
+    redis.call('DEL', KEYS[5])
+end
+if ARGV[11] ~= '' then
+    redis.call('PUBLISH', ARGV[10], ARGV[11])
+end
+return version
+""")
+
+# Operações atômicas da fila humana; a sessão é espelhada depois por update_session.
+# KEYS em todas: estado da fila, fila global, entradas da fila
+
+# Entrega ao atendente a conversa da cabeça da fila global (O(log n)). Conversas cuja
+# sessão expirou saem da fila no caminho, como no /global-queue.
+# ARGV: atendente → telefone ou nil se a fila estiver vazia
+_CLAIM_NEXT = session_client.register_script(_INDEX_QUEUE_LUA + """
+local head
+repeat
+    head = redis.call('ZPOPMIN', KEYS[2])[1]
+    if not head then
+        return false
+    end
+    local alive = redis.call('EXISTS', '""" + SESSION_PREFIX + """' .. head) == 1
+    if not alive then
+        redis.call('HDEL', KEYS[1], head)
+        redis.call('HDEL', KEYS[3], head)
+    end
+until alive
+redis.call('HSET', KEYS[1], head, ARGV[1])
+redis.call('SADD', AGENT_PREFIX .. ARGV[1], head)
+return head
+""")
+
+# Atribui uma conversa específica, a menos que ela já seja de outro atendente.
+# ARGV: telefone, atendente, prioridade, agora (s) → '' se atribuída, senão o atendente atual
+_CLAIM = session_client.register_script(_INDEX_QUEUE_LUA + """
+local owner = redis.call('HGET', KEYS[1], ARGV[1])
+if owner and owner ~= '' and owner ~= ARGV[2] then
+    return owner
+end
+index_queue(KEYS[1], KEYS[2], KEYS[3], ARGV[1], '1', ARGV[2], ARGV[3], ARGV[4])
+return ''
+""")
+
+# Devolve a conversa à fila global. Sem prioridade, ela volta ao lugar que tinha
+# (mesma entrada); com prioridade, reentra no fim da faixa dessa prioridade.
+# ARGV: telefone, atendente ('' = qualquer), prioridade ('' = mantém), agora (s) → 1 ou 0
+_UNCLAIM = session_client.register_script(_INDEX_QUEUE_LUA + """
+local owner = redis.call('HGET', KEYS[1], ARGV[1])
+if not owner or (ARGV[2] ~= '' and owner ~= ARGV[2]) then
+    return 0
+end
+local entry = redis.call('HGET', KEYS[3], ARGV[1])
+if ARGV[3] ~= '' then
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    index_queue(KEYS[1], KEYS[2], KEYS[3], ARGV[1], '1', '', ARGV[3], ARGV[4])
+else
+    index_queue(KEYS[1], KEYS[2], KEYS[3], ARGV[1], '1', '', entry and string.match(entry, '^(%d+):') or '0', ARGV[4])
+end
+return 1
+""")
+
+# Liberação da trava comparando o token (não apaga a trava de outro worker)
+_RELEASE = session_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+# Campos da sessão como lidos por lock_and_load, por token, para que save_and_unlock
+# grave só o que o turno alterou
+_locked_fields: Dict[str, Tuple[int, Optional[Dict[str, bytes]]]] = {}
+
+_QUEUE_FIELDS = {DADOS_FIELD_PREFIX + "transferido_humano", DADOS_FIELD_PREFIX + "atribuido_para",
+                 DADOS_FIELD_PREFIX + "prioridade"}
+_QUEUE_KEYS = [QUEUE_STATE_KEY, QUEUE_GLOBAL_KEY, QUEUE_ENTRY_KEY]
+
+def _new_session() -> Dict[str, Any]:
+    return { "etapa": "inicio", "dados": {}, "historico": [] }
+
+def _session_fields(session_data: Dict[str, Any]) -> Dict[str, bytes]:
+    """Campos do hash de uma sessão: um por chave de primeiro nível e um por subseção de 'dados'."""
+    fields = {}
+    for key, value in session_data.items():
+        if key == SESSION_VERSION_KEY:
+            continue
+        if key == "dados" and isinstance(value, dict):
+            for dados_key, dados_value in value.items():
+                fields[DADOS_FIELD_PREFIX + dados_key] = codec.encode(dados_value)
+        else:
+            fields[key] = codec.encode(value)
+    return fields
+
+def _parse_session(user_id: str, loaded: Any) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, bytes]]]:
+    """
+    Decodifica o resultado de load_session: (sessão, campos crus do hash).
+    Sessão None se não existir ou for inválida; campos None se veio do formato antigo.
+    """
+    if not loaded:
+        return None, None
+    kind, values = loaded[0], loaded[1:]
+    try:
+        if kind == b's':
+            data = codec.decode(values[0])
+            fields = None
+        else:
+            fields = {name.decode('utf-8'): value for name, value in zip(values[::2], values[1::2])}
+            data = {"dados": {}}
+            for name, value in fields.items():
+                if name == SESSION_VERSION_FIELD:
+                    data[SESSION_VERSION_KEY] = int(value)
+                elif name.startswith(DADOS_FIELD_PREFIX):
+                    data["dados"][name[len(DADOS_FIELD_PREFIX):]] = codec.decode(value)
+                else:
+                    data[name] = codec.decode(value)
+    except Exception as e:
+        print(f"⚠️ Sessão corrompida para {user_id}: {e}")
+        return None, None
+    if not isinstance(data, dict):
+        print(f"⚠️ Sessão inválida para {user_id}: não é um dicionário")
+        return None, None
+    # Garante que a estrutura mínima da sessão sempre exista
+    data.setdefault("etapa", "inicio")
+    data.setdefault("dados", {})
+    data.setdefault("historico", [])
+    return data, fields
+
+def queue_priority(value: Any) -> int:
+    """Prioridade na fila humana, de 0 (normal) a QUEUE_MAX_PRIORITY."""
+    try:
+        return max(0, min(int(value or 0), QUEUE_MAX_PRIORITY))
+    except (TypeError, ValueError):
+        return 0
+
+def _queue_state(session_data: Dict[str, Any]) -> Tuple[str, str, int]:
+    """('1' se transferida para humano senão '0', atendente ou '', prioridade) para os índices da fila."""
+    dados = session_data.get("dados") or {}
+    if not dados.get("transferido_humano"):
+        return '0', '', 0
+    assignee = dados.get("atribuido_para")
+    return '1', str(assignee) if assignee else '', queue_priority(dados.get("prioridade"))
+
+def _write_session(user_id: str, session_data: Dict[str, Any], before: Optional[Dict[str, bytes]],
+                   token: str = '', expected_version: Optional[int] = None) -> int:
+    """
+    Grava a sessão comparando com os campos 'before' (None = gravação completa): só os
+    campos alterados são enviados e os que sumiram são removidos. Os índices da fila só
+    são tocados quando a gravação mexe em transferido_humano/atribuido_para.
+    Com 'token', 'expected_version' só é conferida se a trava tiver expirado ou se a
+    gravação for completa.
+    Retorna a nova versão, 0 em conflito de versão ou -1 se a trava é de outro token.
+    """
+    fields = _session_fields(session_data)
+    if before is None:
+        changed, removed = fields, []
+    else:
+        changed = {name: value for name, value in fields.items() if before.get(name) != value}
+        removed = [name for name in before if name not in fields and name != SESSION_VERSION_FIELD]
+    if before is None or _QUEUE_FIELDS & (set(changed) | set(removed)):
+        transferred, assignee, priority = _queue_state(session_data)
+    else:
+        transferred, assignee, priority = '', '', 0
+
+    args = [token, '' if expected_version is None else expected_version, '1' if before is None else '0',
+            SESSION_TTL_SECONDS, user_id, time.time(), transferred, assignee, priority,
+            session_cache.channel, session_cache.invalidation_message(user_id), len(changed)]
+    for name, value in changed.items():
+        args += [name, value]
+    args += removed
+    return _WRITE(keys=[SESSION_PREFIX + user_id, SESSION_REGISTRY_KEY, QUEUE_STATE_KEY, QUEUE_GLOBAL_KEY,
+                        LOCK_PREFIX + user_id, QUEUE_ENTRY_KEY], args=args)
+
+def _load_session(user_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, bytes]]]:
+    return _parse_session(user_id, _LOAD(keys=[SESSION_PREFIX + user_id]))
 
 def get_session(user_id: str) -> Dict[str, Any]:
-    """Retorna a sessão do usuário do Redis com uma estrutura padrão segura."""
-    try:
-        raw = redis_client.get(SESSION_PREFIX + user_id)
-        if raw and isinstance(raw, str):
-            data = json.loads(raw)
-            if isinstance(data, dict):
-                # Garante que a estrutura mínima da sessão sempre exista
-                data.setdefault("etapa", "inicio")
-                data.setdefault("dados", {})
-                data.setdefault("historico", [])
-                return data
+    """Retorna a sessão do usuário (near-cache ou Redis) com uma estrutura padrão segura."""
+    cached = session_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    data = None
+    session_cache.begin_fill(user_id)
+    try:
+        data, _ = _load_session(user_id)
+        if data is not None:
+            return data
     except Exception as e:
         print(f"❌ Erro ao ler sessão de {user_id}: {e}")
-    
+    finally:
+        session_cache.fill(user_id, data)
+
     # Retorna uma sessão nova e limpa se não existir ou se ocorrer um erro
-    return { "etapa": "inicio", "dados": {}, "historico": [] }
+    return _new_session()
+
+def update_session(user_id: str, mutate: Callable[[Dict[str, Any]], None],
+                   retries: int = SESSION_UPDATE_RETRIES, create: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Lê a sessão, aplica 'mutate' (que altera o dicionário no lugar) e grava só os campos
+    alterados, desde que a versão não tenha mudado entre a leitura e a gravação; em
+    conflito relê do Redis e tenta de novo. Não usa a trava do bot: uma gravação do
+    painel não sobrescreve campos que o bot alterou no meio e vice-versa.
+    Com create=False, uma sessão inexistente (expirada) não é recriada.
+    Retorna a sessão gravada, ou None se não conseguiu.
+    """
+    session_data = session_cache.get(user_id)
+    for attempt in range(retries):
+        try:
+            if session_data is None:
+                session_data, _ = _load_session(user_id)
+                if session_data is None and not create:
+                    print(f"⚠️ Sessão de {user_id} não existe; nada a atualizar")
+                    return None
+                session_data = session_data or _new_session()
+            version = session_data.get(SESSION_VERSION_KEY, 0)
+            # Versão 0: sessão nova ou no formato antigo, gravada por inteiro
+            before = _session_fields(session_data) if version else None
+            mutate(session_data)
+            new_version = _write_session(user_id, session_data, before, expected_version=version)
+            if new_version > 0:
+                session_data[SESSION_VERSION_KEY] = new_version
+                session_cache.write(user_id, session_data, published=True)
+                print(f"✅ Sessão de {user_id} atualizada (versão {new_version})")
+                return session_data
+            print(f"⚠️ Sessão de {user_id} mudou durante a atualização; tentativa {attempt + 1}")
+        except Exception as e:
+            print(f"❌ Erro ao atualizar sessão de {user_id}: {e}")
+            return None
+        session_data = None
+    return None
 
-def set_session(user_id: str, session_data: Dict[str, Any]) -> None:
-    """Salva ou atualiza a sessão do usuário no Redis com TTL."""
+def lock_and_load(user_id: str, wait_seconds: float = 0) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    Adquire a trava do usuário e lê a sessão na mesma ida ao Redis (script Lua).
+    Retorna (token, sessão); token None se a trava não foi obtida dentro de 'wait_seconds'.
+    O token identifica o dono da trava e deve ser passado a save_and_unlock/release_lock.
+    """
+    token = secrets.token_hex(16)
+    deadline = time.monotonic() + wait_seconds
     try:
-        session_string = json.dumps(session_data, indent=2)
-        redis_client.set(SESSION_PREFIX + user_id, session_string, ex=SESSION_TTL_SECONDS)
-        print(f"✅ Sessão salva no Redis para {user_id} - etapa: {session_data.get('etapa')}")
+        while True:
+            result = _LOCK_AND_LOAD(keys=[LOCK_PREFIX + user_id, SESSION_PREFIX + user_id],
+                                    args=[token, LOCK_TTL_SECONDS])
+            if result[0]:
+                session_data, fields = _parse_session(user_id, result[1:])
+                session_data = session_data or _new_session()
+                _locked_fields[token] = (session_data.get(SESSION_VERSION_KEY, 0), fields)
+                return token, session_data
+            if time.monotonic() >= deadline:
+                return None, _new_session()
+            time.sleep(LOCK_RETRY_INTERVAL_SECONDS)
     except Exception as e:
-        print(f"❌ Erro ao salvar sessão de {user_id}: {e}")
+        print(f"❌ Erro ao tentar adquirir a trava para {user_id}: {e}")
+        return None, _new_session()
 
-def acquire_lock(user_id: str) -> bool:
-    """Tenta adquirir uma trava para um usuário, impedindo processamento concorrente."""
-    lock_key = LOCK_PREFIX + user_id
+def save_and_unlock(user_id: str, token: str, session_data: Dict[str, Any]) -> bool:
+    """
+    Grava os campos da sessão alterados desde lock_and_load e libera a trava na mesma ida
+    ao Redis. Se a trava expirou durante o turno (resposta lenta da OpenAI, por exemplo),
+    a gravação ainda vale desde que ninguém tenha gravado a sessão no meio, o que também
+    vale para a gravação completa de uma sessão nova; se outro worker pegou a trava,
+    nada é gravado (a sessão é dele agora) e retorna False.
+    """
+    loaded_version, fields = _locked_fields.pop(token, (0, None))
     try:
-        # 'nx=True' garante que a chave só é definida se ela NÃO existir (operação atômica).
-        lock_adquirido = redis_client.set(lock_key, "locked", ex=LOCK_TTL_SECONDS, nx=True)
-        return bool(lock_adquirido)
+        version = _write_session(user_id, session_data, fields if loaded_version else None,
+                                 token=token, expected_version=loaded_version)
+        if version > 0:
+            session_data[SESSION_VERSION_KEY] = version
+            if version == loaded_version + 1:
+                session_cache.write(user_id, session_data, published=True)
+            else:
+                # O painel gravou outros campos durante o turno: esta cópia não é a sessão inteira
+                session_cache.invalidate(user_id, published=True)
+            print(f"✅ Sessão salva no Redis para {user_id} - etapa: {session_data.get('etapa')}")
+        elif version < 0:
+            print(f"⚠️ Trava de {user_id} expirou e foi tomada por outro worker; sessão não gravada")
+        else:
+            print(f"⚠️ Sessão de {user_id} gravada por outro processo durante o turno; sessão não gravada")
+        return version > 0
     except Exception as e:
-        print(f"❌ Erro ao tentar adquirir a trava para {user_id}: {e}")
+        print(f"❌ Erro ao salvar sessão de {user_id}: {e}")
         return False
 
-def release_lock(user_id: str) -> None:
-    """Libera a trava de um usuário após o processamento da mensagem."""
-    lock_key = LOCK_PREFIX + user_id
+def release_lock(user_id: str, token: str) -> None:
+    """Libera a trava de um usuário, apenas se ela ainda pertencer a 'token'."""
+    _locked_fields.pop(token, None)
     try:
-        redis_client.delete(lock_key)
+        _RELEASE(keys=[LOCK_PREFIX + user_id], args=[token])
     except Exception as e:
         print(f"❌ Erro ao tentar liberar a trava para {user_id}: {e}")
 
-def get_all_sessions() -> Dict[str, Dict[str, Any]]:
-    """Retorna todas as sessões ativas no Redis (para estatísticas)."""
+def get_session_cache_stats() -> Dict[str, Any]:
+    return session_cache.stats()
+
+def count_active_sessions(since_seconds: float = SESSION_TTL_SECONDS) -> int:
+    """Quantos usuários tiveram a sessão gravada nos últimos 'since_seconds' (ZCOUNT no registro)."""
     try:
-        pattern = SESSION_PREFIX + "*"
-        raw_keys = redis_client.keys(pattern)
-        if isinstance(raw_keys, Iterable) and not isinstance(raw_keys, str):
-            key_list = list(raw_keys)
-        else:
-            key_list = []
-        
-        if not key_list:
-            print("📊 Nenhuma sessão encontrada no Redis")
-            return {}
-            
-        result: Dict[str, Dict[str, Any]] = {}
-        values = redis_client.mget(key_list)
-        
-        if isinstance(values, list):
-            for i, key in enumerate(key_list):
-                value = values[i]
-                if value and isinstance(value, str):
-                    user_id = key.replace(SESSION_PREFIX, "")
-                    try:
-                        session = json.loads(value)
-                        if isinstance(session, dict):
-                            # Garante que a estrutura mínima da sessão sempre exista
-                            session.setdefault("etapa", "inicio")
-                            session.setdefault("dados", {})
-                            session.setdefault("historico", [])
-                            result[user_id] = session
-                        else:
-                            print(f"⚠️ Sessão inválida para {user_id}: não é um dicionário")
-                    except json.JSONDecodeError as e:
-                        print(f"⚠️ Sessão corrompida para {user_id}: {e}")
-                    except Exception as e:
-                        print(f"❌ Erro ao processar sessão de {user_id}: {e}")
-        
-        print(f"📊 {len(result)} sessões válidas encontradas")
-        return result
+        return session_client.zcount(SESSION_REGISTRY_KEY, time.time() - since_seconds, "+inf")
+    except Exception as e:
+        print(f"❌ Erro ao contar sessões ativas: {e}")
+        return 0
+
+def iter_sessions(batch_size: int = SESSION_SCAN_BATCH) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Percorre todas as sessões com SCAN + leituras em pipeline, em lotes, sem bloquear o Redis como KEYS.
+    Uma chave pode aparecer mais de uma vez se o keyspace mudar durante a varredura.
+    """
+    batch: List[str] = []
+    for key in redis_client.scan_iter(match=SESSION_PREFIX + "*", count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            yield from _load_sessions(batch)
+            batch = []
+    if batch:
+        yield from _load_sessions(batch)
+
+def _load_sessions(keys: List[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    pipe = session_client.pipeline(transaction=False)
+    for key in keys:
+        _LOAD(keys=[key], client=pipe)
+    for key, loaded in zip(keys, pipe.execute()):
+        user_id = key[len(SESSION_PREFIX):]
+        try:
+            session, _ = _parse_session(user_id, loaded)
+            if session is not None:
+                yield user_id, session
+        except Exception as e:
+            print(f"❌ Erro ao processar sessão de {user_id}: {e}")
+
+def get_sessions_dados(user_ids: List[str], keys: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Leitura parcial: só as subseções 'keys' de dados das sessões pedidas, com um HMGET
+    por sessão em um único pipeline. Sessões inexistentes ficam de fora; uma sessão que
+    existe mas não pôde ser decodificada entra com as subseções em None.
+    Retorna None se a leitura falhou (não dá para saber quais sessões existem).
+    """
+    if not user_ids:
+        return {}
+    fields = [SESSION_VERSION_FIELD] + [DADOS_FIELD_PREFIX + key for key in keys]
+    try:
+        pipe = session_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hmget(SESSION_PREFIX + user_id, fields)
+        results = pipe.execute(raise_on_error=False)
     except Exception as e:
         print(f"❌ Erro ao buscar sessões: {e}")
+        return None
+
+    dados: Dict[str, Dict[str, Any]] = {}
+    for user_id, values in zip(user_ids, results):
+        if isinstance(values, Exception):
+            # Sessão ainda no formato antigo (um único valor): lida por inteiro
+            session = get_session(user_id)
+            dados[user_id] = {key: session["dados"].get(key) for key in keys}
+            continue
+        if values[0] is None:
+            continue
+        try:
+            dados[user_id] = {key: codec.decode(value) if value is not None else None
+                              for key, value in zip(keys, values[1:])}
+        except Exception as e:
+            print(f"❌ Erro ao processar sessão de {user_id}: {e}")
+            dados[user_id] = {key: None for key in keys}
+    return dados
+
+_queue_index_checked = False
+
+def _ensure_queue_index() -> None:
+    """Na primeira consulta, monta os índices da fila a partir das sessões existentes se ainda não existirem."""
+    global _queue_index_checked
+    if _queue_index_checked:
+        return
+    if not session_client.exists(QUEUE_INDEX_MARKER):
+        rebuild_queue_index()
+    _queue_index_checked = True
+
+def rebuild_queue_index() -> int:
+    """Recria os índices da fila humana varrendo as sessões (SCAN); retorna quantas estão transferidas."""
+    now = time.time()
+    now_ms = int(now * 1000)
+    states: Dict[str, str] = {}
+    priorities: Dict[str, int] = {}
+    for user_id, session in iter_sessions():
+        transferred, assignee, priority = _queue_state(session)
+        if transferred == '1':
+            states[user_id] = assignee
+            priorities[user_id] = priority
+    agent_keys = list(redis_client.scan_iter(match=QUEUE_AGENT_PREFIX + "*", count=SESSION_SCAN_BATCH))
+    pipe = session_client.pipeline()
+    pipe.delete(QUEUE_STATE_KEY, QUEUE_GLOBAL_KEY, QUEUE_ENTRY_KEY, *agent_keys)
+    if states:
+        pipe.hset(QUEUE_STATE_KEY, mapping=states)
+        pipe.hset(QUEUE_ENTRY_KEY, mapping={user_id: f"{priority}:{now_ms}"
+                                            for user_id, priority in priorities.items()})
+        waiting = {user_id: _queue_score(priorities[user_id], now_ms)
+                   for user_id, assignee in states.items() if not assignee}
+        if waiting:
+            pipe.zadd(QUEUE_GLOBAL_KEY, waiting)
+        for user_id, assignee in states.items():
+            if assignee:
+                pipe.sadd(QUEUE_AGENT_PREFIX + assignee, user_id)
+    pipe.set(QUEUE_INDEX_MARKER, int(now))
+    pipe.execute()
+    print(f"📋 Índices da fila humana recriados: {len(states)} conversas transferidas")
+    return len(states)
+
+def _queue_score(priority: int, enqueued_ms: int) -> int:
+    return (QUEUE_MAX_PRIORITY - priority) * QUEUE_PRIORITY_BAND + enqueued_ms
+
+def get_global_queue(limit: int = 1000) -> List[Tuple[str, int, float]]:
+    """
+    (telefone, prioridade, entrada na fila em epoch s) das conversas transferidas sem
+    atendente, na ordem em que claim_next as entrega: maior prioridade, depois a mais antiga.
+    """
+    try:
+        _ensure_queue_index()
+        queue = []
+        for phone, score in redis_client.zrange(QUEUE_GLOBAL_KEY, 0, limit - 1, withscores=True):
+            band, enqueued_ms = divmod(int(score), QUEUE_PRIORITY_BAND)
+            queue.append((phone, QUEUE_MAX_PRIORITY - band, enqueued_ms / 1000))
+        return queue
+    except Exception as e:
+        print(f"❌ Erro ao ler a fila global: {e}")
+        return []
+
+def claim_next(agent_id: str) -> Optional[str]:
+    """Retira atomicamente a cabeça da fila global para o atendente; telefone ou None se vazia."""
+    try:
+        _ensure_queue_index()
+        return _CLAIM_NEXT(keys=_QUEUE_KEYS, args=[str(agent_id)], client=redis_client) or None
+    except Exception as e:
+        print(f"❌ Erro ao puxar conversa da fila para {agent_id}: {e}")
+        return None
+
+def claim_conversation(phone: str, agent_id: str, priority: int = 0) -> Optional[str]:
+    """
+    Atribui a conversa ao atendente se ela estiver livre (na fila, fora dela ou já dele).
+    Retorna None se atribuída; senão o atendente que já a tem. Erro no Redis conta como livre,
+    como as demais leituras da fila.
+    """
+    try:
+        _ensure_queue_index()
+        owner = _CLAIM(keys=_QUEUE_KEYS, args=[phone, str(agent_id), queue_priority(priority), time.time()],
+                       client=redis_client)
+        return owner or None
+    except Exception as e:
+        print(f"❌ Erro ao atribuir {phone} a {agent_id}: {e}")
+        return None
+
+def release_conversation(phone: str, agent_id: Optional[str] = None, priority: Optional[int] = None) -> bool:
+    """
+    Devolve a conversa à fila global (só se for de 'agent_id', quando informado). Sem
+    'priority' ela retoma o lugar original; com 'priority' reentra no fim dessa faixa.
+    """
+    try:
+        _ensure_queue_index()
+        return bool(_UNCLAIM(keys=_QUEUE_KEYS,
+                             args=[phone, '' if agent_id is None else str(agent_id),
+                                   '' if priority is None else queue_priority(priority), time.time()]))
+    except Exception as e:
+        print(f"❌ Erro ao devolver {phone} à fila: {e}")
+        return False
+
+def get_human_queue_stats() -> Dict[str, Any]:
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zcard(QUEUE_GLOBAL_KEY)
+        pipe.hlen(QUEUE_STATE_KEY)
+        pipe.zrange(QUEUE_GLOBAL_KEY, 0, 0, withscores=True)
+        waiting, transferred, head = pipe.execute()
+    except Exception as e:
+        print(f"❌ Erro ao ler métricas da fila humana: {e}")
         return {}
+    head_wait = 0.0
+    if head:
+        head_wait = max(0.0, time.time() - int(head[0][1]) % QUEUE_PRIORITY_BAND / 1000)
+    return {
+        'waiting': waiting,
+        'assigned': transferred - waiting,
+        'head_wait_seconds': round(head_wait, 1),
+    }
 
+def get_transfer_states(phones: List[str]) -> Dict[str, Optional[str]]:
+    """Telefone → atendente (None se na fila global), só para as conversas transferidas; um HMGET."""
+    if not phones:
+        return {}
+    try:
+        _ensure_queue_index()
+        values = redis_client.hmget(QUEUE_STATE_KEY, phones)
+        return {phone: value or None for phone, value in zip(phones, values) if value is not None}
+    except Exception as e:
+        print(f"❌ Erro ao ler o estado da fila: {e}")
+        return {}
+
+def get_agent_conversations(agent_id: str) -> List[str]:
+    """Telefones das conversas transferidas atribuídas ao atendente; um SMEMBERS."""
+    try:
+        _ensure_queue_index()
+        return sorted(redis_client.smembers(QUEUE_AGENT_PREFIX + str(agent_id)))
+    except Exception as e:
+        print(f"❌ Erro ao ler as conversas do atendente {agent_id}: {e}")
+        return []
+
+def prune_queue_index(phones: List[str]) -> None:
+    """Remove dos índices telefones cuja sessão expirou (o TTL da sessão não alcança os índices)."""
+    if not phones:
+        return
+    try:
+        assignees = redis_client.hmget(QUEUE_STATE_KEY, phones)
+        pipe = session_client.pipeline()
+        pipe.hdel(QUEUE_STATE_KEY, *phones)
+        pipe.hdel(QUEUE_ENTRY_KEY, *phones)
+        pipe.zrem(QUEUE_GLOBAL_KEY, *phones)
+        for phone, assignee in zip(phones, assignees):
+            if assignee:
+                pipe.srem(QUEUE_AGENT_PREFIX + assignee, phone)
+        pipe.execute()
+    except Exception as e:
+        print(f"❌ Erro ao limpar os índices da fila: {e}")
@@ -43,14 +43,15 @@ def test_immediate_message():
     messages_response = requests.get(messages_url)
     
     if messages_response.status_code == 200:
-        conversations = messages_response.json()
+        conversations = messages_response.json()['conversations']
         for conv in conversations:
             if conv['phone'] == message_data['from']:
                 print(f"📱 Conversa encontrada: {conv['phone']}")
-                print(f"📨 Total de mensagens: {len(conv['messages'])}")
+                print(f"📨 Total de mensagens: {conv['message_count']}")
                 
                 # Mostrar as últimas 3 mensagens
-                for i, msg in enumerate(conv['messages'][-3:], 1):
+                history = requests.get(f"{messages_url}/{conv['phone']}").json()['messages']
+                for i, msg in enumerate(history[-3:], 1):
                     print(f"  {i}. {msg['from']}: {msg['text']} ({msg['timestamp']})")
                 break
     else:
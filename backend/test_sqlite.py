@@ -7,7 +7,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from database import db
+from database import db, _PendingMessage, now_ms, utc_text
 import json
 
 def test_database():
@@ -83,6 +83,23 @@ def test_database():
         for phone, msgs in conversations.items():
             print(f"  {phone}: {len(msgs)} messages")
         
+        # Test 8: Group commit (a writer batch is one transaction, whatever its size)
+        print("\n📦 Testing group commit...")
+        batch = [_PendingMessage("5511777777777", f"Mensagem {i}", "received", "user",
+                                 None, utc_text(now_ms() + i), now_ms() + i) for i in range(5)]
+        statements = []
+        with db._writer() as conn:
+            conn.set_trace_callback(statements.append)
+        try:
+            db._write_batch(batch)
+        finally:
+            with db._writer() as conn:
+                conn.set_trace_callback(None)
+        transactions = [s.strip().upper() for s in statements if s.strip().upper() in ('BEGIN', 'COMMIT')]
+        print(f"Transactions for a batch of {len(batch)}: {transactions}")
+        assert transactions == ['BEGIN', 'COMMIT'], transactions
+        assert all(message.future.result() for message in batch)
+        
         print("\n🎉 All database tests passed!")
         return True
         
@@ -116,6 +116,12 @@ async function processBufferedMessages(client, from) {
 
     logger.info(`✅ Resposta recebida do webhook: ${JSON.stringify(response.data)}`);
 
+    // Modo assíncrono: o backend enfileirou a mensagem e enviará a resposta via /send-message
+    if (response.status === 202) {
+      logger.info(`📥 Mensagem de ${from} enfileirada pelo backend. A resposta chegará via /send-message.`);
+      return;
+    }
+
     const reply = response.data.result;
     if (reply) {
       await client.sendText(from, reply);
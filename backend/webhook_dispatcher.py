@@ -0,0 +1,238 @@
+import os
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Deque, Dict
+
+import requests
+
+from database import db
+from handlers.message_handler import handle_message, normalizar_numero
+from realtime import publish_message
+
+logger = logging.getLogger(__name__)
+
+# Modo assíncrono: o webhook salva a mensagem, enfileira o job e responde 202.
+# A resposta do bot é entregue depois pelo endpoint /send-message do Venom Bot.
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "false").lower() in ("1", "true", "yes")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+VENOM_SEND_URL = os.getenv("VENOM_SEND_URL", "http://localhost:3000/send-message")
+VENOM_SEND_TIMEOUT = 30
+
+# Janela de agrupamento: mensagens do mesmo telefone que chegam a menos de N ms
+# uma da outra viram um único turno do bot (0 desativa). O teto evita que um
+# paciente digitando sem parar adie a resposta indefinidamente.
+WEBHOOK_COALESCE_MS = int(os.getenv("WEBHOOK_COALESCE_MS", 0))
+WEBHOOK_COALESCE_MAX_MS = int(os.getenv("WEBHOOK_COALESCE_MAX_MS", WEBHOOK_COALESCE_MS * 5))
+
+FALLBACK_REPLY = "Desculpe, não entendi."
+
+def save_and_publish(from_number: str, text: str, direction: str, from_field: str) -> Future:
+    """
+    Enfileira a mensagem no writer do banco sem esperar o commit; o painel é
+    avisado assim que ela for gravada. O Future resolve com o id da mensagem.
+    """
+    timestamp = datetime.now(timezone.utc).isoformat()
+    future = db.submit_message(
+        phone_number=from_number,
+        message_text=text,
+        direction=direction,
+        from_field=from_field,
+        timestamp=timestamp
+    )
+
+    def publish(done: Future) -> None:
+        if done.exception() is not None:
+            logger.error(f"❌ Erro ao salvar mensagem de {from_number}: {done.exception()}")
+            return
+        logger.info("🔔 Emitindo mensagem via WebSocket...")
+        publish_message(from_number, done.result(), text, direction, from_field, timestamp)
+
+    future.add_done_callback(publish)
+    return future
+
+def save_incoming(from_number: str, incoming_msg: str) -> Future:
+    """Salva a mensagem do usuário e avisa o painel assim que ela for gravada."""
+    return save_and_publish(from_number, incoming_msg, 'received', 'user')
+
+def generate_reply(from_number: str, incoming_msg: str) -> str:
+    """Executa o fluxo do bot, salva a resposta e avisa o painel."""
+    reply_text = handle_message(from_number, incoming_msg) or FALLBACK_REPLY
+    logger.info(f"💬 Resposta gerada: {reply_text}")
+
+    save_and_publish(from_number, reply_text, 'sent', 'agent')
+    return reply_text
+
+def deliver_reply(from_number: str, reply_text: str) -> bool:
+    """Envia a resposta ao paciente pelo Venom Bot."""
+    try:
+        response = requests.post(
+            VENOM_SEND_URL,
+            json={'phone': from_number, 'message': reply_text},
+            timeout=VENOM_SEND_TIMEOUT
+        )
+        if response.status_code == 200:
+            logger.info(f"📤 Resposta entregue via Venom Bot para {from_number}")
+            return True
+        logger.error(f"❌ Erro ao enviar via Venom Bot: {response.status_code} - {response.text}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"❌ Erro de conexão com Venom Bot: {e}")
+    return False
+
+class _Job:
+    __slots__ = ("from_number", "text", "deliver", "enqueued_at", "future")
+
+    def __init__(self, from_number: str, text: str, deliver: bool):
+        self.from_number = from_number
+        self.text = text
+        self.deliver = deliver
+        self.enqueued_at = time.monotonic()
+        self.future: Future = Future()
+
+class ConversationQueue:
+    """
+    Fila FIFO por conversa (telefone normalizado) atendida por um pool de workers.
+
+    Cada telefone é processado por no máximo um worker por vez e suas mensagens
+    seguem a ordem de chegada; telefones diferentes rodam em paralelo. Mensagens
+    pendentes dentro da janela de agrupamento são unidas em um único turno.
+    """
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, coalesce_ms: int = WEBHOOK_COALESCE_MS,
+                 coalesce_max_ms: int = WEBHOOK_COALESCE_MAX_MS):
+        self.workers = workers
+        self.coalesce_window = coalesce_ms / 1000
+        self.coalesce_max = max(coalesce_max_ms, coalesce_ms) / 1000
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Deque[_Job]] = {}
+        self._ready: "queue.Queue[str]" = queue.Queue()
+        self._threads: list = []
+
+        # Métricas
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._turns = 0
+        self._coalesced = 0
+        self._started = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"🧵 Pool de workers do webhook iniciado com {self.workers} threads")
+
+    def submit(self, from_number: str, text: str, deliver: bool = True) -> Future:
+        """Enfileira uma mensagem; o Future resolve com o texto da resposta."""
+        key = normalizar_numero(from_number)
+        job = _Job(from_number, text, deliver)
+        with self._lock:
+            self._start()
+            self._enqueued += 1
+            pending = self._pending.get(key)
+            if pending is None:
+                # Conversa ociosa: fica pronta para o próximo worker livre
+                self._pending[key] = deque([job])
+                self._ready.put(key)
+            else:
+                # Conversa já em processamento: aguarda a vez, na ordem
+                pending.append(job)
+        return job.future
+
+    def _take_batch(self, key: str) -> list:
+        """Aguarda a janela de agrupamento e retira as mensagens pendentes do telefone."""
+        while True:
+            with self._lock:
+                pending = self._pending[key]
+                now = time.monotonic()
+                quiet_for = now - pending[-1].enqueued_at
+                waited = now - pending[0].enqueued_at
+                if quiet_for >= self.coalesce_window or waited >= self.coalesce_max:
+                    batch = list(pending) if self.coalesce_window else [pending[0]]
+                    for job in batch:
+                        wait = now - job.enqueued_at
+                        self._started += 1
+                        self._wait_total += wait
+                        self._wait_max = max(self._wait_max, wait)
+                    return batch
+                remaining = min(self.coalesce_window - quiet_for, self.coalesce_max - waited)
+            time.sleep(remaining)
+
+    def _worker(self) -> None:
+        while True:
+            key = self._ready.get()
+            batch = self._take_batch(key)
+
+            self._run(batch)
+
+            with self._lock:
+                pending = self._pending[key]
+                for _ in batch:
+                    pending.popleft()
+                if pending:
+                    self._ready.put(key)
+                else:
+                    del self._pending[key]
+
+    def _run(self, batch: list) -> None:
+        last = batch[-1]
+        text = "\n".join(job.text for job in batch)
+        if len(batch) > 1:
+            logger.info(f"🧩 {len(batch)} mensagens de {last.from_number} agrupadas em um único turno")
+        try:
+            reply_text = generate_reply(last.from_number, text)
+            if any(job.deliver for job in batch):
+                deliver_reply(last.from_number, reply_text)
+            # A resposta pertence ao turno inteiro; as mensagens absorvidas resolvem vazias
+            for job in batch[:-1]:
+                job.future.set_result("")
+            last.future.set_result(reply_text)
+            with self._lock:
+                self._processed += len(batch)
+                self._turns += 1
+                self._coalesced += len(batch) - 1
+        except Exception as e:
+            logger.error(f"❌ Erro processando mensagem de {last.from_number} em background: {e}")
+            for job in batch:
+                job.future.set_exception(e)
+            with self._lock:
+                self._failed += len(batch)
+
+    def stats(self) -> Dict:
+        """Profundidade das filas e tempos de espera (enfileiramento → início)."""
+        with self._lock:
+            depths = [len(p) for p in self._pending.values()]
+            return {
+                'workers': self.workers,
+                'conversations_pending': len(depths),
+                'queue_depth': sum(depths),
+                'max_conversation_depth': max(depths, default=0),
+                'enqueued': self._enqueued,
+                'processed': self._processed,
+                'failed': self._failed,
+                'turns': self._turns,
+                'coalesced': self._coalesced,
+                'coalesce_window_ms': int(self.coalesce_window * 1000),
+                'avg_wait_ms': round(self._wait_total / self._started * 1000, 1) if self._started else 0,
+                'max_wait_ms': round(self._wait_max * 1000, 1),
+            }
+
+conversation_queue = ConversationQueue()
+
+def enqueue_message(from_number: str, incoming_msg: str, deliver: bool = True) -> Future:
+    """Enfileira o processamento da mensagem na fila ordenada da conversa."""
+    future = conversation_queue.submit(from_number, incoming_msg, deliver)
+    logger.info(f"📥 Mensagem de {from_number} enfileirada para processamento")
+    return future
+
+def get_queue_stats() -> Dict:
+    return conversation_queue.stats()
@@ -5,9 +5,10 @@ import TransferPopup from '../TransferPopup';
 import './ChatWindow.css';
 
 const ChatWindow = () => {
-  const { selectedConversation, messages, loading, refreshConversations } = useChat();
+  const { selectedConversation, messages, loading, refreshConversations, loadOlderMessages } = useChat();
   const messagesEndRef = useRef(null);
   const messagesContainerRef = useRef(null);
+  const prevScrollHeightRef = useRef(null);
   const [isScrolledToBottom, setIsScrolledToBottom] = useState(true);
   const [hasScrolledUp, setHasScrolledUp] = useState(false);
   const [showTypingIndicator, setShowTypingIndicator] = useState(false);
@@ -60,7 +61,15 @@ const ChatWindow = () => {
     const isAtBottom = Math.abs(scrollHeight - scrollTop - clientHeight) < threshold;
     setShowScrollButton(!isAtBottom);
     setIsScrolledToBottom(isAtBottom);
-  }, []);
+
+    // Chegou ao topo: carrega a página anterior do histórico
+    if (scrollTop < threshold && selectedConversation && prevScrollHeightRef.current === null) {
+      prevScrollHeightRef.current = scrollHeight;
+      loadOlderMessages(selectedConversation.phone).then(loaded => {
+        if (!loaded) prevScrollHeightRef.current = null;
+      });
+    }
+  }, [selectedConversation, loadOlderMessages]);
 
   useEffect(() => {
     const container = messagesContainerRef.current;
@@ -72,6 +81,15 @@ const ChatWindow = () => {
     }
   }, [handleScroll]);
 
+  // Mantém a posição de leitura quando mensagens antigas entram no topo
+  useEffect(() => {
+    const container = messagesContainerRef.current;
+    if (container && prevScrollHeightRef.current !== null) {
+      container.scrollTop = container.scrollHeight - prevScrollHeightRef.current;
+      prevScrollHeightRef.current = null;
+    }
+  }, [messages]);
+
   // Auto-scroll to bottom when new messages arrive
   useEffect(() => {
     if (messages.length > 0 && isScrolledToBottom) {
@@ -5,7 +5,7 @@ import GlobalQueue from '../Chat/BotQueue/index';
 import './Sidebar.css';
 
 const Sidebar = () => {
-  const { conversations, selectedConversation, selectConversation, unreadCounts, refreshConversations, socketConnected } = useChat();
+  const { conversations, selectedConversation, selectConversation, unreadCounts, refreshConversations, socketConnected, loadMoreConversations } = useChat();
   const [searchTerm, setSearchTerm] = useState('');
   const [refreshing, setRefreshing] = useState(false);
   const [filterType, setFilterType] = useState('all'); // Mudança: 'all' como padrão
@@ -181,7 +181,14 @@ const Sidebar = () => {
       />
 
       {/* Conversations List */}
-      <div className="conversations-list">
+      <div
+        className="conversations-list"
+        onScroll={(e) => {
+          // Perto do fim da lista: busca a próxima página de conversas
+          const { scrollTop, scrollHeight, clientHeight } = e.currentTarget;
+          if (scrollHeight - scrollTop - clientHeight < 200) loadMoreConversations();
+        }}
+      >
         {filteredConversations.length > 0 ? (
           filteredConversations.map((conversation) => (
             <div
@@ -13,12 +13,25 @@ const initialState = {
   unreadCounts: {},
   stats: null,
   socketConnected: false,
+  // Cursores de paginação (null = não há mais páginas)
+  conversationsCursor: null,
+  messagesCursors: {},
 };
 
 const chatReducer = (state, action) => {
   switch (action.type) {
     case 'SET_CONVERSATIONS':
       return { ...state, conversations: action.payload };
+    case 'APPEND_CONVERSATIONS': {
+      // Próxima página da lista: ignora conversas que já subiram via WebSocket
+      const known = new Set(state.conversations.map(conv => conv.id));
+      return {
+        ...state,
+        conversations: [...state.conversations, ...action.payload.filter(conv => !known.has(conv.id))],
+      };
+    }
+    case 'SET_CONVERSATIONS_CURSOR':
+      return { ...state, conversationsCursor: action.payload };
     case 'SET_SELECTED_CONVERSATION':
       return { ...state, selectedConversation: action.payload };
     case 'SET_MESSAGES':
@@ -61,6 +74,85 @@ const chatReducer = (state, action) => {
         ...state,
         messages: state.messages.filter(msg => msg.id !== action.payload),
       };
+    case 'APPLY_MESSAGE_NEW': {
+      // Evento incremental: acrescenta só a nova mensagem à conversa
+      const { conversation_id: phone, message } = action.payload;
+      const baseConversation = state.conversations.find(conv => conv.phone === phone) || {
+        id: phone,
+        name: formatContactName(phone, null, null, null),
+        originalName: null,
+        phone,
+        formattedPhone: phone,
+        unread: 0,
+        avatar: generateAvatar(phone, null, null),
+        messages: [],
+        transferido_humano: false,
+        atribuido_para: null,
+        dados_transferencia: null,
+      };
+      // A carga inicial pode já conter a mensagem se o lote ainda não tinha saído
+      if (message.id && baseConversation.messages.some(m => m.messageId === message.id)) {
+        return state;
+      }
+      const mapped = mapMessage(message, phone, baseConversation.messages.length);
+      const updatedConversation = {
+        ...baseConversation,
+        lastMessage: message.text,
+        timestamp: mapped.timestamp,
+        messageCount: (baseConversation.messageCount || 0) + 1,
+        messages: [...baseConversation.messages, mapped],
+      };
+      const others = state.conversations.filter(conv => conv.phone !== phone);
+      const isSelected = state.selectedConversation && state.selectedConversation.id === phone;
+      return {
+        ...state,
+        conversations: [updatedConversation, ...others],
+        // Substitui a mensagem otimista do painel (pending) pela confirmada pelo backend
+        messages: isSelected
+          ? [...state.messages.filter(m => !(m.pending && m.text === mapped.text)), mapped]
+          : state.messages,
+      };
+    }
+    case 'SET_CONVERSATION_MESSAGES': {
+      // Mensagens de uma conversa carregadas sob demanda via /api/messages/<phone>
+      const { phone, messages, nextCursor } = action.payload;
+      const isSelected = state.selectedConversation && state.selectedConversation.id === phone;
+      return {
+        ...state,
+        conversations: state.conversations.map(conv =>
+          conv.phone === phone ? { ...conv, messages } : conv
+        ),
+        messages: isSelected ? messages : state.messages,
+        messagesCursors: { ...state.messagesCursors, [phone]: nextCursor || null },
+      };
+    }
+    case 'PREPEND_CONVERSATION_MESSAGES': {
+      // Página mais antiga do histórico, carregada ao rolar para o topo
+      const { phone, messages, nextCursor } = action.payload;
+      const isSelected = state.selectedConversation && state.selectedConversation.id === phone;
+      const prepend = (current) => {
+        const known = new Set(current.map(m => m.id));
+        return [...messages.filter(m => !known.has(m.id)), ...current];
+      };
+      return {
+        ...state,
+        conversations: state.conversations.map(conv =>
+          conv.phone === phone ? { ...conv, messages: prepend(conv.messages || []) } : conv
+        ),
+        messages: isSelected ? prepend(state.messages) : state.messages,
+        messagesCursors: { ...state.messagesCursors, [phone]: nextCursor || null },
+      };
+    }
+    case 'APPLY_CONVERSATION_UPDATE': {
+      // Evento incremental: aplica só os campos alterados do resumo
+      const { conversation_id: phone, changes } = action.payload;
+      return {
+        ...state,
+        conversations: state.conversations.map(conv =>
+          conv.phone === phone ? { ...conv, ...changes } : conv
+        ),
+      };
+    }
     default:
       return state;
   }
@@ -114,42 +206,59 @@ function areMessagesEqual(a, b) {
   return true;
 }
 
-// Função para comparar arrays de conversas (deep compare)
-function areConversationsEqual(a, b) {
-  if (a.length !== b.length) return false;
-  for (let i = 0; i < a.length; i++) {
-    if (
-      a[i].id !== b[i].id ||
-      a[i].name !== b[i].name ||
-      a[i].phone !== b[i].phone ||
-      a[i].lastMessage !== b[i].lastMessage ||
-      !areMessagesEqual(a[i].messages || [], b[i].messages || [])
-    ) {
-      return false;
-    }
-  }
-  return true;
+// Função utilitária para mapear uma mensagem do backend para o frontend
+function mapMessage(msg, phone, index) {
+  // Se já tem sender, não remapeia
+  if (msg.sender) return msg;
+
+  // PADRÃO WHATSAPP CORRETO:
+  // direction='received' (mensagens recebidas do paciente) -> sender='received' (esquerda, branco)
+  // direction='sent' (mensagens enviadas pelo bot/agente) -> sender='sent' (direita, verde)
+  const sender = msg.direction === 'received' ? 'received' : 'sent';
+
+  return {
+    id: msg.id ? `${phone}-${msg.id}` : `${phone}-${index}-${msg.text}`,
+    messageId: msg.id,
+    text: msg.text,
+    sender,
+    timestamp: msg.timestamp ? new Date(msg.timestamp) : new Date(),
+  };
 }
 
 // Função utilitária para mapear mensagens do backend para o frontend
 function mapMessages(messages, phone) {
   console.log('🔎 Mensagens recebidas para mapear:', messages);
-  return (messages || []).map((msg, index) => {
-    // Se já tem sender, não remapeia
-    if (msg.sender) return msg;
-    
-    // PADRÃO WHATSAPP CORRETO:
-    // direction='received' (mensagens recebidas do paciente) -> sender='received' (esquerda, branco)
-    // direction='sent' (mensagens enviadas pelo bot/agente) -> sender='sent' (direita, verde)
-    const sender = msg.direction === 'received' ? 'received' : 'sent';
-    
-    return {
-      id: `${phone}-${index}-${msg.text}`,
-      text: msg.text,
-      sender,
-      timestamp: msg.timestamp ? new Date(msg.timestamp) : new Date(),
-    };
-  });
+  return (messages || []).map((msg, index) => mapMessage(msg, phone, index));
+}
+
+// Função utilitária para mapear uma conversa (resumo) do backend para o frontend
+function mapConversation(conv) {
+  const formattedName = formatContactName(
+    conv.phone, 
+    conv.name, 
+    conv.originalName, 
+    conv.formattedPhone
+  );
+  const avatar = generateAvatar(conv.phone, conv.name, conv.avatar);
+  
+  return {
+    id: conv.phone,
+    name: formattedName,
+    originalName: conv.originalName || conv.name,
+    phone: conv.phone,
+    formattedPhone: conv.formattedPhone || conv.phone,
+    lastMessage: conv.last_message || 'Nenhuma mensagem',
+    timestamp: conv.last_timestamp ? new Date(conv.last_timestamp) : new Date(),
+    unread: 0, // Backend doesn't provide unread count yet
+    avatar: avatar,
+    messageCount: conv.message_count || 0,
+    // Mensagens são carregadas sob demanda ao abrir a conversa
+    messages: [],
+    // Adicionar campos de transferência
+    transferido_humano: conv.transferido_humano || false,
+    atribuido_para: conv.atribuido_para || null,
+    dados_transferencia: conv.dados_transferencia || null,
+  };
 }
 
 export const ChatProvider = ({ children }) => {
@@ -157,6 +266,8 @@ export const ChatProvider = ({ children }) => {
   const pollingIntervalRef = useRef(null);
   const socketRef = useRef(null);
   const lastUpdateRef = useRef(0);
+  const seqRef = useRef({});
+  const epochRef = useRef(null);
 
   // Inicializar WebSocket
   const initializeSocket = () => {
@@ -173,6 +284,11 @@ export const ChatProvider = ({ children }) => {
       socketRef.current.on('connect', () => {
         console.log('🔌 WebSocket conectado');
         dispatch({ type: 'SET_SOCKET_CONNECTED', payload: true });
+        // Eventos perdidos enquanto desconectado (ou servidor reiniciado): descarta as
+        // sequências conhecidas e recarrega a base
+        seqRef.current = {};
+        lastUpdateRef.current = 0;
+        loadConversations();
       });
 
       socketRef.current.on('disconnect', () => {
@@ -180,68 +296,54 @@ export const ChatProvider = ({ children }) => {
         dispatch({ type: 'SET_SOCKET_CONNECTED', payload: false });
       });
 
-      socketRef.current.on('message_update', (data) => {
-        console.log('📨 Atualização de mensagens recebida via WebSocket');
-        
-        // Extrair conversas do objeto correto que vem do backend
-        const conversations = data.conversations || data;
-        
-        // Verificar se as conversas realmente mudaram antes de atualizar
-        const currentConversations = state.conversations;
-        const hasChanges = !areConversationsEqual(currentConversations, conversations);
-        
-        if (!hasChanges) {
-          console.log('⏸️ Nenhuma mudança detectada, ignorando atualização WebSocket');
+      // Eventos incrementais: cada conversa tem um número de sequência. Eventos já
+      // aplicados são ignorados; um salto na sequência força o recarregamento completo.
+      // Conversa sem base conhecida (fora das páginas carregadas) adota a sequência recebida.
+      const acceptSeq = (conversationId, seq) => {
+        const last = seqRef.current[conversationId];
+        if (last === undefined) {
+          seqRef.current[conversationId] = seq;
+          return true;
+        }
+        if (seq <= last) return false;
+        seqRef.current[conversationId] = seq;
+        if (seq > last + 1) {
+          console.log(`⚠️ Salto de sequência em ${conversationId} (${last} → ${seq}), recarregando conversas`);
+          lastUpdateRef.current = 0;
+          loadConversations();
+          return false;
+        }
+        return true;
+      };
+
+      // O backend agrupa os eventos e envia um lote a cada ~150ms. Um epoch diferente
+      // do conhecido é um servidor reiniciado: as sequências antigas não valem mais.
+      socketRef.current.on('realtime_batch', ({ epoch, events }) => {
+        console.log(`📨 Lote de ${events.length} eventos recebido via WebSocket`);
+        if (epochRef.current && epoch !== epochRef.current) {
+          console.log('⚠️ Servidor reiniciado, recarregando conversas');
+          epochRef.current = epoch;
+          seqRef.current = {};
+          lastUpdateRef.current = 0;
+          loadConversations();
           return;
         }
-        
-        // Processar conversas imediatamente sem delays
-        const formattedConversations = conversations.map(conv => {
-          const formattedName = formatContactName(
-            conv.phone, 
-            conv.name, 
-            conv.originalName, 
-            conv.formattedPhone
-          );
-          const avatar = generateAvatar(conv.phone, conv.name, conv.avatar);
-          
-          // Mapear mensagens imediatamente
-          const formattedMessages = conv.messages.map((msg, index) => ({
-            id: `${conv.phone}-${index}-${msg.text}`, // ID estável baseado no conteúdo
-            text: msg.text,
-            sender: msg.direction === 'received' ? 'received' : 'sent', // PADRÃO WHATSAPP: received = esquerda (branco), sent = direita (verde)
-            timestamp: msg.timestamp ? new Date(msg.timestamp) : new Date(),
-          }));
-          
-          return {
-            id: conv.phone,
-            name: formattedName,
-            originalName: conv.originalName || conv.name,
-            phone: conv.phone,
-            formattedPhone: conv.formattedPhone || conv.phone,
-            lastMessage: conv.messages.length > 0 ? conv.messages[conv.messages.length - 1].text : 'Nenhuma mensagem',
-            timestamp: new Date(),
-            unread: 0,
-            avatar: avatar,
-            messages: formattedMessages,
-            // Adicionar campos de transferência
-            transferido_humano: conv.transferido_humano || false,
-            atribuido_para: conv.atribuido_para || null,
-            dados_transferencia: conv.dados_transferencia || null,
-          };
+        epochRef.current = epoch;
+        events.forEach((event) => {
+          if (!acceptSeq(event.conversation_id, event.seq)) return;
+          if (event.type === 'message_new') {
+            dispatch({ type: 'APPLY_MESSAGE_NEW', payload: event });
+          } else if (event.type === 'conversation_update') {
+            dispatch({ type: 'APPLY_CONVERSATION_UPDATE', payload: event });
+          }
         });
+      });
 
-        // Atualizar estado imediatamente
-        dispatch({ type: 'SET_CONVERSATIONS', payload: formattedConversations });
-        
-        // Atualizar mensagens da conversa selecionada imediatamente
-        if (state.selectedConversation) {
-          const selectedConv = formattedConversations.find(c => c.id === state.selectedConversation.id);
-          if (selectedConv) {
-            console.log(`🔄 Atualizando mensagens da conversa selecionada: ${selectedConv.messages.length} mensagens`);
-            dispatch({ type: 'SET_MESSAGES', payload: selectedConv.messages });
-          }
-        }
+      socketRef.current.on('conversations_reset', () => {
+        console.log('🔄 Reset de conversas recebido via WebSocket');
+        seqRef.current = {};
+        lastUpdateRef.current = 0;
+        loadConversations();
       });
 
       socketRef.current.on('stats_update', (stats) => {
@@ -277,50 +379,18 @@ export const ChatProvider = ({ children }) => {
       console.log('📡 Fazendo requisição para /api/messages...');
       const response = await whatsappAPI.getConversations();
       console.log('✅ Resposta recebida:', response.data);
+      epochRef.current = response.data.epoch || null;
       
-      // Transform backend data to frontend format
-      const conversations = response.data.map(conv => {
-        console.log('🔄 Processando conversa:', conv);
-        const formattedName = formatContactName(
-          conv.phone, 
-          conv.name, 
-          conv.originalName, 
-          conv.formattedPhone
-        );
-        const avatar = generateAvatar(conv.phone, conv.name, conv.avatar);
-        
-        const formattedMessages = mapMessages(conv.messages, conv.phone);
-        
-        console.log(`📱 loadConversations - Conversa ${conv.phone}: ${formattedMessages.length} mensagens formatadas`);
-        console.log(`📋 Campos de transferência para ${conv.phone}:`, {
-          transferido_humano: conv.transferido_humano,
-          atribuido_para: conv.atribuido_para,
-          dados_transferencia: conv.dados_transferencia
-        });
-        formattedMessages.forEach((msg, i) => {
-          console.log(`  ${i}: sender="${msg.sender}" | "${msg.text}"`);
-        });
-        
-        return {
-          id: conv.phone,
-          name: formattedName,
-          originalName: conv.originalName || conv.name,
-          phone: conv.phone,
-          formattedPhone: conv.formattedPhone || conv.phone,
-          lastMessage: conv.messages.length > 0 ? conv.messages[conv.messages.length - 1].text : 'Nenhuma mensagem',
-          timestamp: new Date(), // Backend doesn't provide timestamp, using current time
-          unread: 0, // Backend doesn't provide unread count yet
-          avatar: avatar,
-          messages: formattedMessages,
-          // Adicionar campos de transferência
-          transferido_humano: conv.transferido_humano || false,
-          atribuido_para: conv.atribuido_para || null,
-          dados_transferencia: conv.dados_transferencia || null,
-        };
+      // Transform backend data to frontend format (primeira página)
+      const conversations = response.data.conversations.map(conv => {
+        // Sequência base para os eventos incrementais do WebSocket
+        seqRef.current[conv.phone] = conv.seq || 0;
+        return mapConversation(conv);
       });
 
       // Sempre atualizar as conversas quando chamado explicitamente
       dispatch({ type: 'SET_CONVERSATIONS', payload: conversations });
+      dispatch({ type: 'SET_CONVERSATIONS_CURSOR', payload: response.data.next_cursor });
       // Set unread counts (for now, all 0)
       conversations.forEach(conv => {
         dispatch({
@@ -366,6 +436,26 @@ export const ChatProvider = ({ children }) => {
     }
   }, []);
 
+  // Carregar a próxima página de conversas (rolagem da lista)
+  const loadingMoreRef = useRef(false);
+  const loadMoreConversations = useCallback(async () => {
+    if (!state.conversationsCursor || loadingMoreRef.current) return;
+    loadingMoreRef.current = true;
+    try {
+      const response = await whatsappAPI.getConversations(state.conversationsCursor);
+      const conversations = response.data.conversations.map(conv => {
+        seqRef.current[conv.phone] = conv.seq || 0;
+        return mapConversation(conv);
+      });
+      dispatch({ type: 'APPEND_CONVERSATIONS', payload: conversations });
+      dispatch({ type: 'SET_CONVERSATIONS_CURSOR', payload: response.data.next_cursor });
+    } catch (error) {
+      console.error('❌ Erro ao carregar mais conversas:', error);
+    } finally {
+      loadingMoreRef.current = false;
+    }
+  }, [state.conversationsCursor]);
+
   // Load statistics
   const loadStats = useCallback(async () => {
     try {
@@ -469,6 +559,7 @@ export const ChatProvider = ({ children }) => {
       text,
       sender: 'sent', // Mensagens enviadas pelo painel são 'sent' (lado direito, verde)
       timestamp: new Date(),
+      pending: true, // Substituída quando o evento 'message_new' confirmar o envio
     };
 
     // Add message to local state immediately for instant feedback
@@ -509,11 +600,54 @@ export const ChatProvider = ({ children }) => {
   }, []);
 
   // Atualizar mensagens apenas se mudarem
+  // Carregar as mensagens de uma conversa sob demanda
+  const loadConversationMessages = useCallback(async (phone) => {
+    try {
+      const response = await whatsappAPI.getMessages(phone);
+      dispatch({
+        type: 'SET_CONVERSATION_MESSAGES',
+        payload: {
+          phone,
+          messages: mapMessages(response.data.messages, phone),
+          nextCursor: response.data.next_cursor,
+        },
+      });
+    } catch (error) {
+      console.error(`❌ Erro ao carregar mensagens de ${phone}:`, error);
+    }
+  }, []);
+
+  // Carregar a página anterior do histórico da conversa (rolagem para o topo)
+  const loadingOlderRef = useRef(false);
+  const loadOlderMessages = useCallback(async (phone) => {
+    const cursor = state.messagesCursors[phone];
+    if (!cursor || loadingOlderRef.current) return false;
+    loadingOlderRef.current = true;
+    try {
+      const response = await whatsappAPI.getMessages(phone, cursor);
+      dispatch({
+        type: 'PREPEND_CONVERSATION_MESSAGES',
+        payload: {
+          phone,
+          messages: mapMessages(response.data.messages, phone),
+          nextCursor: response.data.next_cursor,
+        },
+      });
+      return true;
+    } catch (error) {
+      console.error(`❌ Erro ao carregar mensagens antigas de ${phone}:`, error);
+      return false;
+    } finally {
+      loadingOlderRef.current = false;
+    }
+  }, [state.messagesCursors]);
+
   const selectConversation = (conversation) => {
     dispatch({ type: 'SET_SELECTED_CONVERSATION', payload: conversation });
     if (!areMessagesEqual(state.messages, conversation.messages || [])) {
       dispatch({ type: 'SET_MESSAGES', payload: mapMessages(conversation.messages, conversation.phone) });
     }
+    loadConversationMessages(conversation.phone);
     dispatch({ type: 'MARK_AS_READ', payload: conversation.id });
     // Join conversation room via WebSocket
     if (socketRef.current && socketRef.current.connected) {
@@ -527,6 +661,9 @@ export const ChatProvider = ({ children }) => {
     sendMessage,
     refreshConversations,
     loadConversations,
+    loadConversationMessages,
+    loadMoreConversations,
+    loadOlderMessages,
     loadStats,
   };
 
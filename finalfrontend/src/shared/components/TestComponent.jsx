@@ -12,7 +12,7 @@ const TestComponent = () => {
         console.log('🧪 Testando API...');
         const response = await whatsappAPI.getConversations();
         console.log('✅ API funcionando:', response.data);
-        setData(response.data);
+        setData(response.data.conversations);
       } catch (err) {
         console.error('❌ Erro na API:', err);
         setError(err.message);
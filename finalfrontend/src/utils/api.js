@@ -40,8 +40,14 @@ api.interceptors.response.use(
 
 // API functions for WhatsApp conversations
 export const whatsappAPI = {
-  // Get all conversations with messages
-  getConversations: () => api.get('/messages'),
+  // Get conversations (one summary per conversation), paginated by cursor
+  getConversations: (cursor) => api.get('/messages', { params: cursor ? { cursor } : {} }),
+  
+  // Get the latest messages of a conversation; pass next_cursor to load older ones
+  getMessages: (phone, cursor) => api.get(`/messages/${encodeURIComponent(phone)}`, { params: cursor ? { cursor } : {} }),
+  
+  // Full-text search over message history ({ q, phone, from, to, limit, offset })
+  searchMessages: (params) => api.get('/search', { params }),
   
   // Send a message to a specific phone number
   sendMessage: (phone, message) => api.post('/send-message', { phone, message }),